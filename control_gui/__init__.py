@@ -1,2 +1,4 @@
 from .server import server
+from .stream_server import stream_server
+from .hub import hub
 from .gui import gui
\ No newline at end of file
@@ -3,9 +3,14 @@
 
 # written by grey@mutovis.com
 
-import matplotlib.pyplot as plt
+import matplotlib
+matplotlib.use('Agg')  # we only render to files, from a worker thread
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 from control_gui import server
+from control_gui import stream_server
 from collections import deque
+import threading
 import argparse
 import numpy
 
@@ -17,62 +22,158 @@ class gui:
   args = None
   # a place to store the last 64 measurements we've done
   rois = deque([], 64)
+
+  # traces longer than this get decimated before plotting
+  max_plot_points = 2000
+
+  # (y label, x label, file suffix) for each of the plots made for an ROI
+  plots = [('Potential [Volts]', 'Time [Seconds]', '_0'), ('Current [Amps]', 'Time [Seconds]', '_1'), ('Current [Amps]', 'Potential [Volts]', '_2'), ('Power [Watts]', 'Time [Seconds]', '_3')]
   
   def __init__(self):
     self.args = self.get_args()
     self.server = server(self.args.server_listen_ip, self.args.server_listen_port)
     self.server.rpc_server.register_function(self.q_append, name='drop')  #
-    # plt.ion()
+
+    # binary ROI stream, the control software falls back to XML-RPC drops if it can't use this
+    self.stream_server = None
+    if self.args.stream_address.upper() != 'NONE':
+      self.stream_server = stream_server(self.args.stream_address, self.add_roi)
+      self.stream_server.start()
+
+    # and/or watch rigs through a hub
+    if self.args.hub_address.upper() != 'NONE':
+      if self.stream_server is None:
+        self.stream_server = stream_server(None, self.add_roi)
+      filters = {'rig': self.args.hub_rig, 'run': self.args.hub_run, 'substrate': self.args.hub_substrate}
+      self.stream_server.follow(self.args.hub_address, filters)
+
+    # ROIs waiting to be plotted, if plotting falls behind the oldest ones are never plotted
+    self.pending = deque([], 64)
+    self.new_roi = threading.Condition()
+
+    # traces of ROIs that are still being measured, by message, built up from live chunks
+    self.live = {}
+    self.stopping = False
+
+    # the figures are made once and reused for every ROI
+    self.figures = []
+    for ylabel, xlabel, suffix in self.plots:
+      fig = Figure()
+      FigureCanvasAgg(fig)
+      self.figures.append(fig)
+
+    self.plotter = threading.Thread(target=self.plot_worker, name='plotter', daemon=True)
+    self.plotter.start()
     
   def __del__(self):
-      self.server.stop_server()
+    self.stopping = True
+    with self.new_roi:
+      self.new_roi.notify()
+    self.server.stop_server()
+    if self.stream_server is not None:
+      self.stream_server.stop()
 
   def run(self):
     self.server.run_server()
     
   def q_append(self, item):
     """
-    puts an item into the roi queue
+    puts an item into the roi queue, plotting happens in the background so this returns right away
     """
-    self.rois.append(item)
-    
-    print("Device area = {:}".format(item['area']))
-    v = numpy.array(item['v'])
-    i = numpy.array(item['i'])
-    t = numpy.array(item['t'])
-    s = numpy.array(item['s'])
-    
-    plt.figure()
-    plt.plot(t, v, '.')
-    plt.ylabel('Potential [Volts]')
-    plt.xlabel('Time [Seconds]')
-    plt.title(item['message'])
-    plt.savefig("/tmp/"+item['message']+'_0')
-    
-    plt.figure()
-    plt.plot(t, i, '.')
-    plt.ylabel('Current [Amps]')
-    plt.xlabel('Time [Seconds]')
-    plt.title(item['message'])
-    plt.savefig("/tmp/"+item['message']+'_1')
-    
-    plt.figure()
-    plt.plot(v, i, '.')
-    plt.ylabel('Current [Amps]')
-    plt.xlabel('Potential [Volts]')
-    plt.title(item['message'])
-    plt.savefig("/tmp/"+item['message']+'_2')
-    
-    plt.figure()
-    plt.plot(t, abs(v*i), '.')
-    plt.ylabel('Power [Watts]')
-    plt.xlabel('Time [Seconds]')
-    plt.title(item['message'])
-    plt.savefig("/tmp/"+item['message']+'_3')
-    
-    # plt.show()
-    # plt.pause(0.1)
+    roi = dict(item)
+    for key in ('v', 'i', 't', 's'):
+      roi[key] = numpy.array(item[key], dtype=float)
+    self.add_roi(roi)
     return 0
+
+  def add_roi(self, roi):
+    """
+    stores an roi (with numpy arrays for v, i, t and s) and queues it for plotting
+    live rois are chunks of an roi that's still being measured, they're appended to its live trace
+    which is replotted until the whole roi arrives and replaces it
+    """
+    with self.new_roi:
+      if roi.get('live', False):
+        trace = self.live.get(roi['message'])
+        if trace is None:
+          trace = dict(roi)
+          self.live[roi['message']] = trace
+        else:
+          for key in ('v', 'i', 't', 's'):
+            trace[key] = numpy.concatenate((trace[key], roi[key]))
+        if not any(item is trace for item in self.pending):  # one replot covers all the chunks that came in meanwhile
+          self.pending.append(trace)
+          self.new_roi.notify()
+        return
+      trace = self.live.pop(roi['message'], None)
+      if trace is not None:  # don't let a stale live plot overwrite the whole roi's
+        self.pending = deque([item for item in self.pending if item is not trace], 64)
+      self.rois.append(roi)
+      self.pending.append(roi)
+      self.new_roi.notify()
+
+  def plot_worker(self):
+    """plots ROIs as they come in"""
+    while True:
+      with self.new_roi:
+        while (len(self.pending) == 0) and not self.stopping:
+          self.new_roi.wait()
+        if self.stopping:
+          return
+        roi = dict(self.pending.popleft())  # live traces keep growing while we plot
+      try:
+        self.plot(roi)
+      except Exception as e:
+        print("WARNING: Failed to plot {:}: {:}".format(roi['message'], e))
+
+  def plot(self, item):
+    """draws the plots for an ROI and saves them to /tmp"""
+    print("Device area = {:}".format(item['area']))
+    v = item['v']
+    i = item['i']
+    t = item['t']
+    p = abs(v*i)
+
+    # long traces (eg. MPPT) are decimated, keeping their shape
+    vi = gui.lttb(t, v, self.max_plot_points)
+    ii = gui.lttb(t, i, self.max_plot_points)
+    pi = gui.lttb(t, p, self.max_plot_points)
+    both = numpy.union1d(vi, ii)
+    series = [(t[vi], v[vi]), (t[ii], i[ii]), (v[both], i[both]), (t[pi], p[pi])]
+
+    for fig, (ylabel, xlabel, suffix), (x, y) in zip(self.figures, self.plots, series):
+      fig.clear()
+      ax = fig.add_subplot(111)
+      ax.plot(x, y, '.')
+      ax.set_ylabel(ylabel)
+      ax.set_xlabel(xlabel)
+      ax.set_title(item['message'])
+      fig.savefig("/tmp/"+item['message']+suffix)
+
+  def lttb(x, y, threshold):
+    """
+    largest triangle three buckets downsampling
+    returns the indices of (at most) threshold points of x, y (x ascending) that keep the shape of the trace
+    """
+    n = len(x)
+    if (threshold >= n) or (threshold < 3):
+      return numpy.arange(n)
+    edges = numpy.linspace(1, n - 1, threshold - 1).astype(int)  # buckets between the first and last points
+    keep = numpy.zeros(threshold, dtype=int)
+    a = 0
+    for b in range(threshold - 2):
+      lo, hi = edges[b], edges[b + 1]
+      if b + 2 < threshold - 1:  # the next bucket's average is the third corner of the triangles
+        nx = x[edges[b + 1]:edges[b + 2]].mean()
+        ny = y[edges[b + 1]:edges[b + 2]].mean()
+      else:
+        nx = x[n - 1]
+        ny = y[n - 1]
+      areas = abs((x[a] - nx) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ny - y[a]))
+      a = lo + int(numpy.argmax(areas))
+      keep[b + 1] = a
+    keep[-1] = n - 1
+    return keep
         
   def get_args(self):
     """Get CLI arguments and options"""
@@ -81,5 +182,10 @@ class gui:
     setup = parser.add_argument_group('optional arguments')
     setup.add_argument("--server-listen-ip", type=str,  default='0.0.0.0', help="The GUI will listen on this interface")
     setup.add_argument("--server-listen-port", type=int, default=51246, help="The GUI will listen on this port")
+    setup.add_argument("--stream-address", type=str, default='tcp://0.0.0.0:51247', help="tcp://interface:port or unix:///path to listen on for binary measurement data streams, 'none' to only accept XML-RPC")
+    setup.add_argument("--hub-address", type=str, default='none', help="tcp://host:port or unix:///path of a hub (see mutovis-control-hub) to get measurement data from, 'none' for no hub")
+    setup.add_argument("--hub-rig", type=str, default=None, help="Only show data from this rig when following a hub")
+    setup.add_argument("--hub-run", type=str, default=None, help="Only show data from this run when following a hub")
+    setup.add_argument("--hub-substrate", type=str, default=None, help="Only show data from this substrate when following a hub")
   
     return parser.parse_args()
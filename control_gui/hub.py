@@ -0,0 +1,285 @@
+import socket
+import threading
+import json
+import time
+import argparse
+import statistics
+from collections import deque
+import numpy
+
+from control_gui import stream_server
+
+class hub(stream_server):
+  """
+  publish/subscribe hub so that any number of dashboards can watch any number of rigs
+  publishers (the control software of each rig, see mutovis_control.gui_publisher) connect and send the usual ROI stream frames,
+  tagged with their rig, run and substrate
+  a connection whose first frame has a 'subscribe' dict of topic filters in its header (eg. {'rig': 'rig1'}) is a subscriber,
+  every frame whose topics match its filters is passed on to it unchanged (a filter only applies to frames that carry that topic)
+  every subscriber has its own bounded buffer, one that's too slow to keep up only loses its own oldest frames
+  """
+  topics = ('rig', 'run', 'substrate')
+
+  class subscriber:
+    """a subscribed connection and the frames waiting to be sent over it"""
+    def __init__(self, sock, filters, max_buffer):
+      self.sock = sock
+      self.filters = {}
+      for topic, name in filters.items():
+        if (topic in hub.topics) and (name is not None):
+          self.filters[topic] = str(name)
+      self.max_buffer = max_buffer
+      self.buffer = deque()
+      self.cond = threading.Condition()
+      self.closed = False
+      self.sent = 0
+      self.dropped = 0
+
+    def wants(self, header):
+      for topic, name in self.filters.items():
+        if (topic in header) and (str(header[topic]) != name):
+          return False
+      return True
+
+    def offer(self, frame):
+      """buffers a frame for sending, never blocks on the subscriber"""
+      with self.cond:
+        if self.closed:
+          return
+        if len(self.buffer) >= self.max_buffer:
+          self.buffer.popleft()
+          self.dropped += 1
+        self.buffer.append(frame)
+        self.cond.notify()
+
+    def run(self):
+      """sends buffered frames until the connection closes"""
+      while True:
+        with self.cond:
+          while (len(self.buffer) == 0) and not self.closed:
+            self.cond.wait()
+          if self.closed:
+            return
+          frame = self.buffer.popleft()
+        try:
+          self.sock.sendall(frame)
+        except OSError:
+          self.close()
+          return
+        self.sent += 1
+
+    def close(self):
+      with self.cond:
+        self.closed = True
+        self.cond.notify()
+
+  def __init__(self, address, max_buffer=256):
+    """
+    address is tcp://interface:port or unix:///path/to/socket to listen on
+    max_buffer is how many frames can wait for each subscriber
+    """
+    stream_server.__init__(self, address, None)
+    self.max_buffer = max_buffer
+    self.subscribers = []
+    self.lock = threading.Lock()
+    self.publishers = 0
+    self.sent = 0  # by subscribers that have gone
+    self.dropped = 0
+
+  def recvFrame(self, sock):
+    """returns (header dict, whole frame bytes) for the next frame from sock, or None if the connection is done"""
+    head = stream_server.recv_exactly(sock, self.frame_header.size)
+    if head is None:
+      return None
+    header_length, payload_length = self.frame_header.unpack(head)
+    if header_length + payload_length > self.max_frame:
+      print("WARNING: Got a {:d} byte frame, closing the connection".format(header_length + payload_length))
+      return None
+    body = stream_server.recv_exactly(sock, header_length + payload_length)
+    if body is None:
+      return None
+    try:
+      header = json.loads(bytes(body[:header_length]).decode())
+    except ValueError as e:
+      print("WARNING: Could not decode frame header ({:}), closing the connection".format(e))
+      return None
+    return header, bytes(head) + bytes(body)
+
+  def serve(self, sock):
+    """handles one connection, a publisher or a subscriber, until it closes"""
+    frame = self.recvFrame(sock)
+    if frame is None:
+      return
+    if 'subscribe' in frame[0]:
+      self.serveSubscriber(sock, frame[0]['subscribe'])
+      return
+    with self.lock:
+      self.publishers += 1
+    try:
+      while frame is not None:
+        self.publish(*frame)
+        frame = self.recvFrame(sock)
+    finally:
+      with self.lock:
+        self.publishers -= 1
+
+  def serveSubscriber(self, sock, filters):
+    sub = hub.subscriber(sock, filters, self.max_buffer)
+    with self.lock:
+      self.subscribers.append(sub)
+    writer = threading.Thread(target=sub.run, name='hub_subscriber', daemon=True)
+    writer.start()
+    try:
+      while sock.recv(4096):
+        pass  # subscribers have nothing more to say, this is how we notice they've gone
+    except OSError:
+      pass
+    sub.close()
+    writer.join()
+    with self.lock:
+      self.subscribers.remove(sub)
+      self.sent += sub.sent
+      self.dropped += sub.dropped
+
+  def publish(self, header, frame):
+    """passes a frame on to the subscribers that want it"""
+    with self.lock:
+      self.frames_received += 1
+      self.bytes_received += len(frame)
+      subscribers = list(self.subscribers)
+    for sub in subscribers:
+      if sub.wants(header):
+        sub.offer(frame)
+
+  def printStats(self):
+    with self.lock:
+      sent = self.sent + sum(sub.sent for sub in self.subscribers)
+      dropped = self.dropped + sum(sub.dropped for sub in self.subscribers)
+      print("Hub: {:d} publishers, {:d} subscribers, {:d} frames ({:.1f} MB) in, {:d} frames out, {:d} dropped for slow subscribers".format(self.publishers, len(self.subscribers), self.frames_received, self.bytes_received/1e6, sent, dropped))
+
+  def loadTest(publishers=4, subscribers=4, slow_subscribers=1, rate=20.0, points=1000, duration=10.0, max_buffer=256):
+    """
+    runs a hub on localhost with synthetic rigs publishing ROIs of points measurements rate times a second each
+    and subscribers that want everything, one rig, or everything but read slowly, then prints how each of them fared
+    """
+    h = hub('tcp://127.0.0.1:0', max_buffer=max_buffer)
+    h.start()
+    address = 'tcp://127.0.0.1:{:d}'.format(h.server.server_address[1])
+    dtype = numpy.dtype({'names': ['voltage', 'current', 'time', 'status'], 'formats': ['<f8', '<f8', '<f8', '<u4']})
+    payload = numpy.zeros(points, dtype=dtype).tobytes()
+    stopping = threading.Event()  # for the publishers
+    done = threading.Event()  # for the subscribers
+
+    def publisher(rig, results):
+      sock = stream_server.connect(address)
+      n = 0
+      next_time = time.time()
+      while not stopping.is_set():
+        header = {'rig': rig, 'run': 'load-test', 'substrate': 'ABCDEFGH'[n % 8], 'message': 'Sweep', 'area': 0.1, 'live': False, 'time': time.time()}
+        header.update({'names': list(dtype.names), 'formats': [dtype.fields[name][0].str for name in dtype.names], 'length': points})
+        header_bytes = json.dumps(header).encode()
+        sock.sendall(hub.frame_header.pack(len(header_bytes), len(payload)) + header_bytes + payload)
+        n += 1
+        next_time += 1 / rate
+        stopping.wait(max(0, next_time - time.time()))
+      sock.close()
+      results.append(n)
+
+    def subscriber(filters, delay, latencies):
+      sock = stream_server.connect(address)
+      request = json.dumps({'subscribe': filters}).encode()
+      sock.sendall(hub.frame_header.pack(len(request), 0) + request)
+      try:
+        frame = h.recvFrame(sock)
+        while (frame is not None) and not done.is_set():
+          latencies.append(time.time() - frame[0]['time'])
+          if delay > 0:
+            time.sleep(delay)
+          frame = h.recvFrame(sock)
+      except OSError:
+        pass
+      sock.close()
+
+    subscriber_setups = []  # (description, filters, seconds spent on each frame)
+    for i in range(subscribers):
+      if i == 0:
+        subscriber_setups.append(('everything', {}, 0))
+      else:
+        rig = 'rig{:d}'.format((i - 1) % publishers)
+        subscriber_setups.append(('rig ' + rig, {'rig': rig}, 0))
+    for i in range(slow_subscribers):
+      subscriber_setups.append(('everything, slowly', {}, 2 / (rate * publishers)))  # can only keep up with half the data
+
+    subscriber_latencies = []
+    subscriber_threads = []
+    for description, filters, delay in subscriber_setups:
+      subscriber_latencies.append([])
+      subscriber_threads.append(threading.Thread(target=subscriber, args=(filters, delay, subscriber_latencies[-1]), daemon=True))
+      subscriber_threads[-1].start()
+      while len(h.subscribers) < len(subscriber_threads):  # one at a time so h.subscribers is in the same order
+        time.sleep(0.01)
+
+    sent = []
+    publisher_threads = [threading.Thread(target=publisher, args=('rig{:d}'.format(i), sent), daemon=True) for i in range(publishers)]
+    t0 = time.time()
+    for thread in publisher_threads:
+      thread.start()
+    stopping.wait(duration)
+    stopping.set()
+    for thread in publisher_threads:
+      thread.join()
+    elapsed = time.time() - t0
+    time.sleep(0.5)  # let the fast subscribers catch up
+    done.set()
+    with h.lock:
+      dropped = [sub.dropped for sub in h.subscribers]
+      subs = list(h.subscribers)
+    for sub in subs:
+      try:
+        sub.sock.shutdown(socket.SHUT_RDWR)
+      except OSError:
+        pass
+    for thread in subscriber_threads:
+      thread.join(timeout=5)
+
+    print("{:d} rigs published {:d} ROIs of {:d} points in {:.1f} s ({:.0f} ROIs/s, {:.1f} MB/s)".format(publishers, sum(sent), points, elapsed, sum(sent)/elapsed, h.bytes_received/elapsed/1e6))
+    for (description, filters, delay), latencies, n_dropped in zip(subscriber_setups, subscriber_latencies, dropped):
+      if len(latencies) > 0:
+        latencies = sorted(latencies)
+        print("Subscriber wanting {:s}: got {:d} ROIs, {:d} dropped, latency median {:.1f} ms, 99th percentile {:.1f} ms".format(description, len(latencies), n_dropped, statistics.median(latencies)*1000, latencies[int(0.99*(len(latencies)-1))]*1000))
+      else:
+        print("Subscriber wanting {:s}: got nothing, {:d} dropped".format(description, n_dropped))
+    h.stop()
+
+  def main():
+    parser = argparse.ArgumentParser(description='Publish/subscribe hub between mutovis control software instances and dashboards')
+    parser.add_argument("--address", type=str, default='tcp://0.0.0.0:51248', help="tcp://interface:port or unix:///path to listen on for publishers and subscribers")
+    parser.add_argument("--max-buffer", type=int, default=256, help="Number of frames that can wait for each subscriber before its oldest are dropped")
+    parser.add_argument("--stats-interval", type=float, default=60, help="Print traffic stats this often [s], 0 for never")
+    load = parser.add_argument_group('load test')
+    load.add_argument("--load-test", default=False, action='store_true', help="Run a load test with synthetic rigs and subscribers on localhost instead of serving")
+    load.add_argument("--publishers", type=int, default=4, help="Number of synthetic rigs")
+    load.add_argument("--subscribers", type=int, default=4, help="Number of subscribers that keep up (one wants everything, the rest one rig each)")
+    load.add_argument("--slow-subscribers", type=int, default=1, help="Number of subscribers that want everything but can only take half of it")
+    load.add_argument("--rate", type=float, default=20, help="ROIs published per second by each rig")
+    load.add_argument("--points", type=int, default=1000, help="Measurements per ROI")
+    load.add_argument("--duration", type=float, default=10, help="Load test length [s]")
+    args = parser.parse_args()
+
+    if args.load_test:
+      hub.loadTest(publishers=args.publishers, subscribers=args.subscribers, slow_subscribers=args.slow_subscribers, rate=args.rate, points=args.points, duration=args.duration, max_buffer=args.max_buffer)
+      return
+
+    h = hub(args.address, max_buffer=args.max_buffer)
+    h.start()
+    print("Hub listening on {:}".format(args.address))
+    try:
+      while True:
+        if args.stats_interval > 0:
+          time.sleep(args.stats_interval)
+          h.printStats()
+        else:
+          time.sleep(1)
+    except KeyboardInterrupt:
+      h.printStats()
+      h.stop()
@@ -0,0 +1,158 @@
+import socketserver
+import socket
+import threading
+import time
+import struct
+import json
+import os
+import numpy
+
+class stream_server:
+  """
+  receives regions of interest sent as binary frames by the control software (see mutovis_control.roi_stream)
+  each frame is a '!II' header (JSON header length, payload length), the UTF-8 JSON header and then the payload:
+  the ROI's measurements as raw bytes of the numpy structured datatype described by the header's names and formats
+  ROIs can also come from a hub (see control_gui.hub) that's followed
+  """
+  frame_header = struct.Struct('!II')
+  max_frame = 1 << 30  # refuse anything bigger than this many bytes, the connection must be out of sync
+
+  def __init__(self, address, handler):
+    """
+    address is tcp://interface:port or unix:///path/to/socket, or None to not listen (eg. to only follow a hub)
+    handler is called with a dict for every ROI received: message, area and v, i, t, s numpy arrays
+    """
+    self.address = address
+    self.handler = handler
+    self.frames_received = 0
+    self.bytes_received = 0
+    outer = self
+
+    class request_handler(socketserver.BaseRequestHandler):
+      def handle(self):
+        outer.serve(self.request)
+
+    self.server = None
+    if address is None:
+      return
+    protocol, location = address.split('://', 1)
+    if protocol == 'tcp':
+      interface, port = location.rsplit(':', 1)
+      socketserver.ThreadingTCPServer.allow_reuse_address = True
+      self.server = socketserver.ThreadingTCPServer((interface, int(port)), request_handler)
+    elif protocol == 'unix':
+      if os.path.exists(location):
+        os.remove(location)  # left over from a previous run
+      self.server = socketserver.ThreadingUnixStreamServer(location, request_handler)
+    else:
+      raise ValueError("Unknown ROI stream protocol in address {:}".format(address))
+    self.server.daemon_threads = True
+
+  def start(self):
+    """serves in a background thread"""
+    if self.server is None:
+      return
+    self.thread = threading.Thread(target=self.server.serve_forever, name='stream_server', daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    if self.server is None:
+      return
+    self.server.shutdown()
+    self.server.server_close()
+
+  def connect(address, timeout=None):
+    """returns a socket connected to tcp://host:port or unix:///path/to/socket"""
+    protocol, location = address.split('://', 1)
+    if protocol == 'tcp':
+      host, port = location.rsplit(':', 1)
+      return socket.create_connection((host, int(port)), timeout=timeout)
+    elif protocol == 'unix':
+      sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      sock.settimeout(timeout)
+      sock.connect(location)
+      return sock
+    else:
+      raise ValueError("Unknown ROI stream protocol in address {:}".format(address))
+
+  def follow(self, address, filters=None, reconnect_interval=2.0):
+    """
+    subscribes to the hub at address in a background thread and passes the ROIs it forwards to the handler
+    filters is a dict of topic (rig, run or substrate) to name, for only some of the hub's data
+    the subscription is renewed if the hub goes away
+    """
+    self.follower = threading.Thread(target=self.followHub, args=(address, filters or {}, reconnect_interval), name='hub_follower', daemon=True)
+    self.follower.start()
+
+  def followHub(self, address, filters, reconnect_interval):
+    request = json.dumps({'subscribe': filters}).encode()
+    warned = False
+    while True:
+      try:
+        sock = stream_server.connect(address)
+        try:
+          sock.sendall(self.frame_header.pack(len(request), 0) + request)
+          print("Following hub {:}".format(address))
+          warned = False
+          self.serve(sock)
+        finally:
+          sock.close()
+      except OSError as e:
+        if not warned:  # only complain once per outage
+          print("WARNING: Can't follow hub {:} ({:}), will keep trying".format(address, e))
+          warned = True
+      time.sleep(reconnect_interval)
+
+  def recv_exactly(sock, n):
+    """returns n bytes from sock, or None if the connection closes first"""
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+      r = sock.recv_into(view[got:], n - got)
+      if r == 0:
+        return None
+      got += r
+    return buf
+
+  def decode(header_bytes, payload):
+    """
+    returns the ROI dict for a frame's JSON header and payload
+    or None for run events (frames with an 'event' in the header), which are only printed
+    """
+    header = json.loads(header_bytes.decode())
+    if 'event' in header:
+      print("Run event: {:} {:}".format(header['event'], ' '.join(str(header[key]) for key in ('rig', 'run') if key in header)))
+      return None
+    dtype = numpy.dtype({'names': header['names'], 'formats': header['formats']})
+    measurements = numpy.frombuffer(payload, dtype=dtype, count=header['length'])
+    roi = {'message': header['message'], 'area': header['area'], 'live': header.get('live', False)}
+    for topic in ('rig', 'run', 'substrate'):
+      if topic in header:
+        roi[topic] = header[topic]
+    for key, name in zip(('v', 'i', 't', 's'), header['names']):  # voltage, current, time, status
+      roi[key] = measurements[name].astype(float)
+    return roi
+
+  def serve(self, sock):
+    """handles one connection until it closes"""
+    while True:
+      head = stream_server.recv_exactly(sock, self.frame_header.size)
+      if head is None:
+        return
+      header_length, payload_length = self.frame_header.unpack(head)
+      if header_length + payload_length > self.max_frame:
+        print("WARNING: Got a {:d} byte ROI frame, closing the stream connection".format(header_length + payload_length))
+        return
+      body = stream_server.recv_exactly(sock, header_length + payload_length)
+      if body is None:
+        return
+      self.frames_received += 1
+      self.bytes_received += len(head) + len(body)
+      try:
+        roi = stream_server.decode(bytes(body[:header_length]), body[header_length:])
+      except (ValueError, KeyError, TypeError) as e:
+        print("WARNING: Could not decode ROI frame: {:}".format(e))
+        continue
+      if roi is not None:
+        self.handler(roi)
@@ -1,11 +1,53 @@
-from .mppt import mppt
-from .k2400 import k2400
-from .put_ftp import put_ftp
-from .illumination import illumination
-from .motion import motion
-from .pcb import pcb
-from .fabric import fabric
-from . import virt
-from .file_writer import file_writer
-from .cli import cli
+"""
+the classes of mutovis_control are imported from their submodules the first time they're used
+so that starting up doesn't pay for drivers (and their dependencies: h5py, pyvisa, pyftdi, mpmath...) that won't be needed
+"""
+import importlib
+import types
+import sys
 
+# each of these submodules has a class of the same name (virt is used as the module itself)
+_lazy = (
+  'iostats',
+  'session',
+  'mppt',
+  'k2400',
+  'put_ftp',
+  'archive_sync',
+  'illumination',
+  'motion_driver',
+  'motion',
+  'pcb',
+  'pcb_emulator',
+  'wavelabs_emulator',
+  'intensity_logger',
+  'profiler',
+  'clock_sync',
+  'light_scheduler',
+  'route_planner',
+  'roi_stream',
+  'gui_publisher',
+  'fabric',
+  'virt',
+  'file_writer',
+  'cli',
+)
+_modules = ('virt',)
+
+class _package(types.ModuleType):
+  def __setattr__(self, name, value):
+    """importing a submodule sets the package attribute of the same name to the module, keep the class there instead"""
+    if (name in _lazy) and (name not in _modules) and isinstance(value, types.ModuleType):
+      value = getattr(value, name)
+    super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = _package
+
+def __getattr__(name):
+  if name not in _lazy:
+    raise AttributeError("module {:} has no attribute {:}".format(__name__, name))
+  importlib.import_module('.' + name, __name__)
+  return globals()[name]
+
+def __dir__():
+  return sorted(set(globals()) | set(_lazy))
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 import serial
+import json
+import os
+import time
+from mutovis_control.motion_driver import motion_driver
 
-class afms:
+class afms(motion_driver):
   """interface to an arduino with an adafruit motor shield connected via a USB virtual serial port, custom sketch"""
   protocol = 'afms'
   steps_per_mm = 10
@@ -15,14 +19,28 @@ class afms:
   minimum_position = 50 / steps_per_mm  #  in mm
   maximum_position = 330  # mm
 
-  def __init__(self, address="afms:///dev/ttyACM0"):
+  # what the sketch's stepper settings give
+  velocity = 10.0  # mm/s
+  acceleration = 50.0  # mm/s^2
+  settle = 0.1  # s
+
+  state_file = None  # json file the position is remembered in between sessions so we don't have to home every time
+  rehome_interval = 0  # [s] home again before the next move once this long has passed since homing, 0 for never
+  last_home = None  # time of the last homing
+
+  def __init__(self, address="afms:///dev/ttyACM0", state_file=None, rehome_interval=0, always_home=False):
     """
     sets up the afms object
     address is a string of the format:
     afms://serial_port_location
     for example "afms:///dev/ttyACM0"
+    state_file is where the stage position is remembered, connect() only homes when there's no trustworthy position there
+    (or always if always_home)
     """
     self.protocol, self.com_port = address.split('://')
+    self.state_file = state_file
+    self.rehome_interval = rehome_interval
+    self.always_home = always_home
     
   def __del__(self):
     try:
@@ -40,36 +58,81 @@ class afms:
       self.connection = serial.Serial(self.com_port)
       # might need to purge read buffer here
       self.connection.timeout = 30  # moving should never take longer than this many seconds
-      ret = self.home()
+      state = None if self.always_home else self.loadState()
+      if (state is not None) and state['clean']:
+        self.current_position = state['position']
+        self.last_home = state['last_home']
+        print('Using remembered stage position {:} mm, skipping homing'.format(self.current_position))
+        ret = 0
+      else:
+        ret = self.home()
     else:
       print("WRNING: Got unexpected afms motion controller comms protocol: {:}".format(self.protocol))
       ret = -3
     return ret
 
 
+  def loadState(self):
+    """
+    returns the remembered {'position', 'clean', 'last_home', 'timestamp'} for this port, or None if there's nothing usable
+    clean is False if the last session ended in the middle of a move (or never finished one), then the position can't be trusted
+    """
+    if (self.state_file is None) or (not os.path.exists(self.state_file)):
+      return None
+    try:
+      with open(self.state_file, 'r') as f:
+        state = json.load(f)[self.com_port]
+      float(state['position'])
+      state['clean']
+      state['last_home']
+    except (ValueError, KeyError, TypeError):
+      return None
+    return state
+
+  def saveState(self, clean):
+    """
+    remembers the current position, clean=False marks it as untrustworthy (eg. while moving)
+    """
+    if self.state_file is None:
+      return
+    states = {}
+    if os.path.exists(self.state_file):
+      try:
+        with open(self.state_file, 'r') as f:
+          states = json.load(f)
+      except ValueError:
+        states = {}
+    states[self.com_port] = {'position': self.current_position, 'clean': clean, 'last_home': self.last_home, 'timestamp': time.time()}
+    tmp_file = self.state_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+      json.dump(states, f)
+    os.replace(tmp_file, self.state_file)  # so that a crash never leaves a half written state file
+
   def home(self):
     """
     homes to the negative limit switch
     """
-    ret = self.move(-10000000)  # home (aka try to move 10 km in reverse, hitting that limit switch)
+    ret = self.move(-10000000, limits=False)  # home (aka try to move 10 km in reverse, hitting that limit switch)
     if ret == 0:
       self.current_position = 50 / self.steps_per_mm  # set position to be limit backoff
+      self.last_home = time.time()
+      self.saveState(clean=True)
     else:
       print('WARNING: homing failure: {:}'.format(ret))
     return ret
     
       
-  def move(self, mm):
+  def move(self, mm, limits=True):
     """
     moves mm mm, blocks until movement complete, mm can be positive or negative to indicate movement direction
-    rejects movements outside limits
+    rejects movements outside limits (unless limits=False, for homing)
     returns 0 upon sucessful move
     """
     sc = self.connection
     
-    steps = round(mm*steps_per_mm)
-    new_position = self.current_position + steps * self.steps_per_mm
-    if (new_position < self.minimum_position) or (new_position > self.maximum_position):
+    steps = round(mm*self.steps_per_mm)
+    new_position = self.current_position + steps / self.steps_per_mm
+    if limits and ((new_position < self.minimum_position) or (new_position > self.maximum_position)):
       print("WARNING: Movement request rejected because requested position {:} is outside software limits".format(new_position))
       return -1  # failed movement
     
@@ -81,13 +144,15 @@ class afms:
       direction = None
     
     if direction != None:
+      self.saveState(clean=False)  # if we don't hear back from this move we won't know where we are
       # send movement command
       sc.write('step,{:},{:}'.format(abs(steps), direction).encode())
-      # read five bytes
-      idle_message = sc.read(1) + sc.read(1) + sc.read(1) + sc.read(1) + sc.read(1)
-      idle_message = idle_message.decode()
+      # read five bytes (returns early only if the timeout runs out)
+      idle_message = sc.read(5)
+      idle_message = idle_message.decode(errors='replace')
       if idle_message.startswith('idle'):
         self.current_position = new_position  # store new position on successful movement
+        self.saveState(clean=True)
       else:
         print("WARNING: Expected idle message after movement, insted: {:}".format(idle_message))
         return -2  # failed movement
@@ -97,7 +162,13 @@ class afms:
   def goto(self, new_position):
     """
     goes to an absolute mm position, blocking, returns 0 on success
+    homes first if it's been rehome_interval since the last homing
     """
+    if (self.rehome_interval > 0) and (self.last_home is not None) and (time.time() - self.last_home > self.rehome_interval):
+      print('Re-homing the stage ({:.0f} s since the last homing)'.format(time.time() - self.last_home))
+      ret = self.home()
+      if ret != 0:
+        return ret
     return self.move(new_position-self.current_position)
     
   def close(self):
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import os
+import pty
+import tty
+import select
+import threading
+import re
+import math
+import argparse
+import time
+
+class afms_emulator:
+  """
+  emulates the afms arduino sketch's serial protocol on a pseudo terminal so that afms can be used without hardware
+  'step,<n>,<forward|backward>' moves n steps and answers 'idle' once the move would be done
+  the move takes as long as the velocity/acceleration profile says (times time_scale), backward moves stop at the home limit switch
+  """
+  command = re.compile(rb'step,(\d+),(forward|backward)')
+  idle_message = b'idle\n'
+
+  def __init__(self, steps_per_mm=10, velocity=10.0, acceleration=50.0, limit_backoff=50, travel=340, time_scale=1.0):
+    """
+    velocity [mm/s], acceleration [mm/s^2] shape the move times, time_scale < 1 makes moves faster than real life
+    limit_backoff [steps] is where the sketch leaves the stage after hitting the home limit switch
+    travel [mm] is where the far end of the rail is
+    """
+    self.steps_per_mm = steps_per_mm
+    self.velocity = velocity
+    self.acceleration = acceleration
+    self.limit_backoff = limit_backoff
+    self.travel = travel
+    self.time_scale = time_scale
+
+    self.position = limit_backoff  # [steps]
+    self.n_moves = 0
+    self.steps_moved = 0
+    self.time_moving = 0.0
+    self.master = None
+    self.slave = None
+    self.stopping = threading.Event()
+    self.thread = None
+
+  def start(self):
+    """starts serving in a background thread, returns the address string to give to afms()"""
+    self.master, self.slave = pty.openpty()
+    tty.setraw(self.slave)  # no echo or line buffering, like a real serial port
+    self.port = os.ttyname(self.slave)
+    self.stopping.clear()
+    self.thread = threading.Thread(target=self.serve, name='afms_emulator', daemon=True)
+    self.thread.start()
+    return self.address
+
+  @property
+  def address(self):
+    return 'afms://{:s}'.format(self.port)
+
+  def stop(self):
+    self.stopping.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+    for fd in (self.master, self.slave):
+      try:
+        os.close(fd)
+      except (OSError, TypeError):
+        pass
+
+  def serve(self):
+    rx = b''
+    while not self.stopping.is_set():
+      ready, w, x = select.select([self.master], [], [], 0.1)
+      if not ready:
+        continue
+      try:
+        data = os.read(self.master, 1024)
+      except OSError:
+        break
+      rx = rx + data
+      m = self.command.search(rx)
+      while m is not None:
+        rx = rx[m.end():]
+        self.step(int(m.group(1)), m.group(2) == b'forward')
+        os.write(self.master, self.idle_message)
+        m = self.command.search(rx)
+
+  def move_time(self, steps):
+    """[s] a move of steps takes with a trapezoidal velocity profile"""
+    d = steps / self.steps_per_mm
+    if d == 0:
+      return 0
+    if d < self.velocity**2 / self.acceleration:
+      return 2 * math.sqrt(d / self.acceleration)
+    return d / self.velocity + self.velocity / self.acceleration
+
+  def step(self, steps, forward):
+    """carries out a move, blocking for as long as it would take"""
+    if forward:
+      target = min(self.position + steps, self.travel * self.steps_per_mm)
+      distance = target - self.position
+    else:
+      target = self.position - steps
+      distance = steps
+      if target < 0:  # the limit switch stops us, then the sketch backs off
+        target = self.limit_backoff
+        distance = self.position + self.limit_backoff
+    t = self.move_time(distance)
+    self.stopping.wait(t * self.time_scale)
+    self.n_moves += 1
+    self.steps_moved += distance
+    self.time_moving += t
+    self.position = target
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Emulates the afms motion controller on a pseudo terminal')
+  parser.add_argument('--velocity', type=float, default=10.0, help="Stage speed [mm/s]")
+  parser.add_argument('--acceleration', type=float, default=50.0, help="Stage acceleration [mm/s^2]")
+  parser.add_argument('--time-scale', type=float, default=1.0, help="Multiply move times by this (eg. 0.01 for quick benchmarks)")
+  args = parser.parse_args()
+
+  emulator = afms_emulator(velocity=args.velocity, acceleration=args.acceleration, time_scale=args.time_scale)
+  address = emulator.start()
+  print('Emulating afms motion controller on {:s} (use --motion-address {:s})'.format(emulator.port, address))
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    print('{:d} moves, {:.0f} mm, {:.1f} s moving'.format(emulator.n_moves, emulator.steps_moved/emulator.steps_per_mm, emulator.time_moving))
+    emulator.stop()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+
+from mutovis_control.put_ftp import put_ftp
+
+import argparse
+import concurrent.futures
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import threading
+
+class archive_sync:
+  """
+  mirrors a local data directory to a passwordless ftp archive
+  a manifest of content hashes is kept in the local directory so that only new or changed files get uploaded
+  """
+  manifest_file_name = '.archive_manifest.json'
+  hash_block_size = 1024 * 1024  # bytes read at a time while hashing
+  verbose = False
+
+  def __init__(self, local_dir, address, pasv=True, n_connections=4, patterns=['*.h5']):
+    """
+    local_dir is the directory tree to mirror
+    address is the complete ftp server address and remote path to mirror to, eg "ftp://epozz:21/drop/"
+    n_connections is the number of concurrent ftp connections to use for uploading
+    patterns is a list of filename patterns to consider for archiving
+    """
+    self.local_dir = os.path.abspath(os.path.expanduser(local_dir))
+    if not address.endswith('/'):
+      address = address + '/'
+    self.address = address
+    self.pasv = pasv
+    self.n_connections = n_connections
+    self.patterns = patterns
+    self.manifest_file = os.path.join(self.local_dir, self.manifest_file_name)
+
+    self.known_dirs = set()  # remote directories known to exist, shared by all the connections
+    self.lock = threading.Lock()
+    self.local = threading.local()
+    self.connections = []
+
+    self.manifest = self.loadManifest()
+
+  def loadManifest(self):
+    """
+    returns the manifest entries for this archive address
+    entries are keyed by path relative to local_dir and hold size, mtime and sha256
+    """
+    entries = {}
+    if os.path.exists(self.manifest_file):
+      try:
+        with open(self.manifest_file, 'r') as f:
+          entries = json.load(f).get(self.address, {})
+      except ValueError:
+        print("WARNING: Could not read archive manifest {:}, all files will be treated as new".format(self.manifest_file))
+    return entries
+
+  def saveManifest(self):
+    """writes the manifest back to disk, keeping entries for other archive addresses"""
+    everything = {}
+    if os.path.exists(self.manifest_file):
+      try:
+        with open(self.manifest_file, 'r') as f:
+          everything = json.load(f)
+      except ValueError:
+        pass
+    with self.lock:
+      everything[self.address] = dict(self.manifest)
+    tmp_file = self.manifest_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+      json.dump(everything, f, indent=1, sort_keys=True)
+    os.replace(tmp_file, self.manifest_file)
+
+  def hashFile(self, path):
+    """returns the sha256 hex digest of a file's contents"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+      block = f.read(self.hash_block_size)
+      while block:
+        h.update(block)
+        block = f.read(self.hash_block_size)
+    return h.hexdigest()
+
+  def localFiles(self):
+    """generates paths (relative to local_dir) of files matching our patterns"""
+    for root, dirs, files in os.walk(self.local_dir):
+      dirs.sort()
+      for name in sorted(files):
+        if name == self.manifest_file_name:
+          continue
+        if any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns):
+          yield os.path.relpath(os.path.join(root, name), self.local_dir)
+
+  def needsUpload(self, rel_path):
+    """
+    returns (needed, entry) where entry is the manifest entry describing the file's current state
+    files whose size and mtime match the manifest are not re-hashed
+    """
+    st = os.stat(os.path.join(self.local_dir, rel_path))
+    old = self.manifest.get(rel_path)
+    if old is not None and old['size'] == st.st_size and old['mtime'] == st.st_mtime:
+      return False, old
+    entry = {'size': st.st_size, 'mtime': st.st_mtime, 'sha256': self.hashFile(os.path.join(self.local_dir, rel_path))}
+    needed = (old is None) or (old['sha256'] != entry['sha256'])
+    if not needed:  # contents unchanged, just remember the new stat info
+      with self.lock:
+        self.manifest[rel_path] = entry
+    return needed, entry
+
+  def connection(self):
+    """returns this thread's ftp connection, opening one if needed"""
+    ftp = getattr(self.local, 'ftp', None)
+    if ftp is None:
+      ftp = put_ftp(self.address, pasv=self.pasv, known_dirs=self.known_dirs)
+      ftp.verbose = self.verbose
+      self.local.ftp = ftp
+      with self.lock:
+        self.connections.append(ftp)
+    return ftp
+
+  def upload(self, rel_path, entry):
+    """uploads one file (from a worker thread) and records it in the manifest"""
+    ftp = self.connection()
+    rel_dir = os.path.dirname(rel_path)
+    remote_path = ftp.remote_path
+    if rel_dir != '':
+      remote_path = remote_path + rel_dir.replace(os.path.sep, '/') + '/'
+    with open(os.path.join(self.local_dir, rel_path), 'rb') as fp:
+      ftp.uploadFile(fp, remote_path=remote_path)
+    with self.lock:
+      self.manifest[rel_path] = entry
+    return rel_path
+
+  def sync(self):
+    """
+    uploads new or changed files over a pool of ftp connections
+    returns (number uploaded, number skipped, number failed)
+    """
+    todo = []
+    n_skipped = 0
+    for rel_path in self.localFiles():
+      needed, entry = self.needsUpload(rel_path)
+      if needed:
+        todo.append((rel_path, entry))
+      else:
+        n_skipped = n_skipped + 1
+
+    n_uploaded = 0
+    n_failed = 0
+    if len(todo) > 0:
+      n_workers = max(1, min(self.n_connections, len(todo)))
+      try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=n_workers) as pool:
+          futures = {pool.submit(self.upload, rel_path, entry): rel_path for rel_path, entry in todo}
+          for future in concurrent.futures.as_completed(futures):
+            try:
+              future.result()
+              n_uploaded = n_uploaded + 1
+            except Exception as e:
+              n_failed = n_failed + 1
+              print('WARNING: Failed to archive {:}: {:}'.format(futures[future], e))
+      finally:
+        self.saveManifest()
+        self.close()
+    else:
+      self.saveManifest()
+
+    print('Archive sync: {:} uploaded, {:} already archived, {:} failed'.format(n_uploaded, n_skipped, n_failed))
+    return n_uploaded, n_skipped, n_failed
+
+  def close(self):
+    for ftp in self.connections:
+      try:
+        ftp.close()
+      except:
+        pass
+    self.connections = []
+    self.local = threading.local()
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Mirror a local data directory to a passwordless FTP server, uploading only new or changed files')
+  parser.add_argument('address', type=str, help='complete ftp server address and remote path to upload to, eg "ftp://epozz:21/drop/"')
+  parser.add_argument('directory', type=str, help="Local directory to mirror")
+  parser.add_argument('-a', '--active', action='store_true', default=False, help="Use active transfer mode instead of passive")
+  parser.add_argument('-j', '--connections', type=int, default=4, help="Number of concurrent FTP connections")
+  parser.add_argument('-p', '--pattern', type=str, action='append', default=None, help="Filename pattern to archive, can be given more than once (default *.h5)")
+  parser.add_argument('-v', '--verbose', action='store_true', default=False, help="Be verbose")
+
+  args = parser.parse_args()
+
+  if not os.path.isdir(args.directory):
+    print("{:} is not a directory".format(args.directory))
+    sys.exit(-1)
+
+  patterns = args.pattern if args.pattern is not None else ['*.h5']
+  syncer = archive_sync(args.directory, args.address, pasv=not args.active, n_connections=args.connections, patterns=patterns)
+  syncer.verbose = args.verbose
+  n_uploaded, n_skipped, n_failed = syncer.sync()
+  if n_failed > 0:
+    sys.exit(-1)
@@ -3,21 +3,21 @@
 
 # written by grey@mutovis.com
 
-from mutovis_control import fabric
+import mutovis_control as mc  # fabric (and with it h5py and the drivers) is only imported once we need it
+from mutovis_control import light_scheduler
+from mutovis_control import route_planner
+from mutovis_control import gui_publisher
 
 import sys
 import argparse
 import time
 import os
-import distutils.util
+import socket
 
 import appdirs
 import configparser
 import ast
 import pathlib
-import inspect
-
-import xmlrpc.client  # here's how we get measurement data out as it's collected
 
 from collections import deque
 
@@ -30,10 +30,12 @@ class cli:
   config_section = 'PREFERENCES'
   prefs_file_name = 'prefs.ini'
   config_file_fullpath = appdirs.user_config_dir(appname) + os.path.sep + prefs_file_name
+  topology_cache_fullpath = appdirs.user_cache_dir(appname) + os.path.sep + 'pcb_topology.json'  # remembers what's connected to the PCB
+  stage_state_fullpath = appdirs.user_cache_dir(appname) + os.path.sep + 'stage_position.json'  # remembers where the stage is
   
   layouts_file_name = 'layouts.ini'  # this file holds the device layout definitions
   system_layouts_file_fullpath = sys.prefix + os.path.sep + 'etc' + os.path.sep + layouts_file_name
-  module_layouts_file_fullpath = os.path.split(os.path.split(inspect.getfile(fabric))[0])[0] + os.path.sep + 'etc' + os.path.sep + layouts_file_name
+  module_layouts_file_fullpath = os.path.split(os.path.dirname(os.path.abspath(__file__)))[0] + os.path.sep + 'etc' + os.path.sep + layouts_file_name
   
   layouts_file_used = ''
   
@@ -101,7 +103,7 @@ class cli:
     if not os.path.exists(self.layouts_file_used):
       self.layouts_file_used = self.system_layouts_file_fullpath
       if not os.path.exists(self.layouts_file_used):
-        self.layouts_file_used = module_layouts_file_fullpath
+        self.layouts_file_used = self.module_layouts_file_fullpath
         if not os.path.exists(self.layouts_file_used):
           raise ValueError("{:} must be in the current working directory ({:}), or in the system config file location ({:}), or in {:}".format(self.layouts_file_name, os.getcwd(), os.path.split(self.system_layouts_file_fullpath)[0], os.path.split(self.module_layouts_file_fullpath)[0]))
     
@@ -133,6 +135,9 @@ class cli:
       
     if self.args.motion_address.upper() == 'NONE':
       self.args.motion_address = None
+
+    if (self.args.auto_intensity is not None) and (self.args.calibrate_diodes or self.args.ignore_diodes):
+      raise ValueError("--auto-intensity can't be used with --calibrate-diodes or --ignore-diodes")
       
     if self.args.layout_index == []:
       self.args.layout_index = [None]
@@ -158,161 +163,302 @@ class cli:
     args = self.args
   
     # create the control entity
-    l = fabric(saveDir = args.destination, archive_address=self.archive_address)
+    l = mc.fabric(saveDir = args.destination, archive_address=self.archive_address)
+    l.timing_trace = args.timing_trace
+    l.intensity_log_rate = args.intensity_log_rate
+    l.intensity_log_channels = args.intensity_log_channels
     self.l = l
     
-    # connect update gui function to the gui server's "drop" function
-    s = xmlrpc.client.ServerProxy(args.gui_address)
-    try:
-      server_methods = s.system.listMethods()
-      if 'drop' in server_methods:
-        l.update_gui = s.drop
-    except:
-      pass  # there's probably just no server gui running
-    
-    # connect to PCB and sourcemeter
-    l.connect(dummy=args.dummy, visa_lib=args.visa_lib, visaAddress=args.sm_address, visaTerminator=args.sm_terminator, visaBaud=args.sm_baud, lightAddress=args.light_address, motionAddress=args.motion_address, pcbAddress=args.pcb_address, ignore_adapter_resistors=args.ignore_adapter_resistors)
+    # ROIs go to the gui in the background, over its binary data stream when it's there, otherwise to its XML-RPC "drop" function
+    stream_address = None if args.gui_stream_address.upper() == 'NONE' else args.gui_stream_address
+    l.gui_publisher = gui_publisher(stream_address=stream_address, xmlrpc_address=args.gui_address, max_queue=args.gui_queue_length, policy=args.gui_drop_policy)
+    l.gui_publisher.start()
+    try:  # the gui publisher gets stopped (and what's queued sent) however the run ends
+      l.gui_publisher.topic['rig'] = args.rig_name
+      l.live_rate = args.gui_live_rate
+
+      if args.pcb_topology_cache:
+        pathlib.Path(self.topology_cache_fullpath).parent.mkdir(parents = True, exist_ok = True)
+        topology_cache = self.topology_cache_fullpath
+      else:
+        topology_cache = None
+
+      if args.remember_stage_position:
+        pathlib.Path(self.stage_state_fullpath).parent.mkdir(parents = True, exist_ok = True)
+        stage_state = self.stage_state_fullpath
+      else:
+        stage_state = None
+
+      # connect to PCB and sourcemeter
+      l.connect(dummy=args.dummy, visa_lib=args.visa_lib, visaAddress=args.sm_address, visaTerminator=args.sm_terminator, visaBaud=args.sm_baud, lightAddress=args.light_address, motionAddress=args.motion_address, pcbAddress=args.pcb_address, ignore_adapter_resistors=args.ignore_adapter_resistors, io_stats=args.io_stats, pcbTopologyCache=topology_cache, motionStateFile=stage_state, motionRehomeInterval=args.rehome_interval, motionAlwaysHome=args.home)
     
-    if args.dummy:
-      args.pixel_address = 'A1'
-    else:
-      if args.rear == False:
-        l.sm.setTerminals(front=True)
-      if args.four_wire == False:
-        l.sm.setWires(twoWire=True)
+      if args.dummy:
+        args.pixel_address = 'A1'
+      else:
+        if args.rear == False:
+          l.sm.setTerminals(front=True)
+        if args.four_wire == False:
+          l.sm.setWires(twoWire=True)
     
-    # build up the queue of pixels to run through
-    if args.pixel_address is not None:
-      pixel_que = self.buildQ(args.pixel_address)
-    else:
-      pixel_que = []
+      # when resuming, the measurement plan comes from the interrupted run's checkpoint
+      if args.resume is not None:
+        plan = mc.fabric.readCheckpoint(args.resume)['plan']
+        args.pixel_address = plan['pixel_address']
+        args.layout_index = plan['layout_index']
+        args.area = plan['area']
+        args.dark_sweep = plan.get('dark_sweep')
+        args.light_soak = plan.get('light_soak', 0.0)
+        args.intensity_checks = plan.get('intensity_checks', False)
+        exps = {}
+        for key, values in plan['experimental_parameter'].items():
+          pq = deque(values)
+          pq.reverse()
+          exps[key] = pq
+        args.experimental_parameter = exps
 
-    if args.test_hardware:
-      if pixel_que is []:
-        holders_to_test = l.pcb.substratesConnected
+      # build up the queue of pixels to run through
+      if args.pixel_address is not None:
+        pixel_que = self.buildQ(args.pixel_address)
       else:
-        #turn the address que into a string of substrates
-        mash = ''
-        for pix in pixel_que:
-          mash = mash + pix[0][0]
-        # delete the numbers
-        # mash = mash.translate({48:None,49:None,50:None,51:None,52:None,53:None,54:None,55:None,56:None})
-        holders_to_test = ''.join(sorted(set(mash))) # remove dupes
-      l.hardwareTest(holders_to_test.upper())
-    else:  # if we do the hardware test, don't then scan pixels
-      #  do run setup things now like diode calibration and opening the data storage file
-      if args.calibrate_diodes == True:
-        diode_cal = True
-      else:
-        diode_cal = args.diode_calibration_values
-      intensity = l.runSetup(args.operator, diode_cal, ignore_diodes=args.ignore_diodes, run_description=args.run_description)
-      if args.calibrate_diodes == True:
-        d1_cal = intensity[0]
-        d2_cal = intensity[1]
-        print('Setting present intensity diode readings to be used as future 1.0 sun refrence values: [{:}, {:}]'.format(d1_cal, d2_cal))
-        # save the newly read diode calibraion values to the prefs file
-        config = configparser.ConfigParser()
-        config.read(self.config_file_fullpath)
-        config[self.config_section]['diode_calibration_values'] = str([d1_cal, d2_cal])
-        with open(self.config_file_fullpath, 'w') as configfile:
-          config.write(configfile)
+        pixel_que = []
 
-      if args.sweep or args.snaith or args.mppt > 0:
-        last_substrate = None
-        # scan through the pixels and do the requested measurements
+      if args.test_hardware:
+        if pixel_que is []:
+          holders_to_test = l.pcb.substratesConnected
+        else:
+          #turn the address que into a string of substrates
+          mash = ''
+          for pix in pixel_que:
+            mash = mash + pix[0][0]
+          # delete the numbers
+          # mash = mash.translate({48:None,49:None,50:None,51:None,52:None,53:None,54:None,55:None,56:None})
+          holders_to_test = ''.join(sorted(set(mash))) # remove dupes
+        l.hardwareTest(holders_to_test.upper())
+      else:  # if we do the hardware test, don't then scan pixels
+        #  do run setup things now like diode calibration and opening the data storage file
+        if args.calibrate_diodes == True:
+          diode_cal = True
+        else:
+          diode_cal = args.diode_calibration_values
+        if args.resume is not None:
+          intensity = l.runResume(args.resume, diode_cal, ignore_diodes=args.ignore_diodes)
+        else:
+          intensity = l.runSetup(args.operator, diode_cal, ignore_diodes=args.ignore_diodes, run_description=args.run_description)
+          l.checkpoint['plan'] = {'pixel_address': args.pixel_address, 'layout_index': args.layout_index, 'area': args.area}
+          l.checkpoint['plan'].update({'dark_sweep': args.dark_sweep, 'light_soak': args.light_soak, 'intensity_checks': args.intensity_checks})
+          l.checkpoint['plan']['experimental_parameter'] = {key: list(reversed(value)) for key, value in args.experimental_parameter.items()}
+          l.writeCheckpoint()
+        if args.auto_intensity is not None:
+          intensity = l.calibrateIntensity(diode_cal, target=args.auto_intensity, tolerance=args.auto_intensity_tolerance)
+        if args.calibrate_diodes == True:
+          d1_cal = intensity[0]
+          d2_cal = intensity[1]
+          print('Setting present intensity diode readings to be used as future 1.0 sun refrence values: [{:}, {:}]'.format(d1_cal, d2_cal))
+          # save the newly read diode calibraion values to the prefs file
+          config = configparser.ConfigParser()
+          config.read(self.config_file_fullpath)
+          config[self.config_section]['diode_calibration_values'] = str([d1_cal, d2_cal])
+          with open(self.config_file_fullpath, 'w') as configfile:
+            config.write(configfile)
+
+        # the experimental parameter values for each substrate, in the order the substrates were given
+        # when resuming, the ones a substrate was actually given (recorded in the checkpoint by substrateSetup) take precedence
+        assignments = {}
         for pixel in pixel_que:
           substrate = pixel[0][0].upper()
-          pix = pixel[0][1]
-          print('\nOperating on substrate {:s}, pixel {:s}...'.format(substrate, pix))
-          if last_substrate != substrate:  # we have a new substrate
-            print('New substrate using "{:}" layout!'.format(pixel[3]))
-            last_substrate = substrate
-            variable_pairs = []
-            for key, value in self.args.experimental_parameter.items():
-              variable_pairs.append([key, value.pop()])
+          if substrate not in assignments:
+            pairs = [[key, value.pop()] for key, value in self.args.experimental_parameter.items()]
+            assignments[substrate] = l.checkpoint['assignments'].get(substrate, pairs)
 
-            substrate_ready = l.substrateSetup(position=substrate, variable_pairs=variable_pairs, layout_name=pixel[3])
+        # now that the experimental parameters are tied to substrates, visit the pixels in whatever order is quickest
+        if args.route_pixels:
+          planner = route_planner(start=l.me.photodiode_location, move_time=l.me.move_time)
+          routed_que = planner.plan(pixel_que)
+          print('Pixel route: {:.0f} mm of stage travel (vs. {:.0f} mm in address order)'.format(planner.travel([pixel[2] for pixel in routed_que]), planner.travel([pixel[2] for pixel in pixel_que])))
+          pixel_que = routed_que
+
+        if args.sweep or args.snaith or args.mppt > 0 or args.dark_sweep is not None:
+          try:
+            self.scheduleMeasurements(pixel_que, assignments, diode_cal)
+          except BaseException:
+            l.runAbort()
+            raise
+        l.runDone()
+      l.sm.outOn(on=False)
+    finally:
+      l.gui_publisher.stop()
+      l.gui_publisher.printSummary()
+    print("Program complete.")
+
+  def scheduleMeasurements(self, pixel_que, assignments, diode_cal):
+    """
+    plans each substrate's light measurements, dark sweeps and intensity checks
+    and then does them in an order that switches the light as little as possible
+    """
+    args = self.args
+    l = self.l
+    schedule = light_scheduler(*l.lightCosts())
+    pixel_time = 2*args.t_prebias + args.mppt  # [s] rough time per pixel for the light measurements
+    substrates = []
+    for pixel in pixel_que:
+      substrate = pixel[0][0].upper()
+      if substrate not in substrates:
+        substrates.append(substrate)
+    for substrate in substrates:
+      substrate_que = [pixel for pixel in pixel_que if pixel[0][0].upper() == substrate]
+      checks = []
+      if args.intensity_checks and not args.ignore_diodes:
+        checks.append(schedule.add(substrate + ' intensity', True, action=lambda substrate=substrate: l.intensityCheck(substrate, diode_cal), duration=1))
+      if args.sweep or args.snaith or args.mppt > 0:
+        schedule.add(substrate + ' light', True, action=lambda q=substrate_que: self.measurePixels(q, assignments), duration=pixel_time*len(substrate_que), soak=args.light_soak, after=checks)
+      if args.dark_sweep is not None:
+        schedule.add(substrate + ' dark', False, action=lambda q=substrate_que: self.measureDark(q, assignments), duration=len(substrate_que))
+    schedule.run(l.setLight, light_on=l.light_on)
+
+  def measureDark(self, pixel_que, assignments):
+    """
+    sweeps the pixels in the dark, each one's dark sweep goes in its own <pixel>_dark group
+    pixels already dark swept in the run's checkpoint are skipped
+    """
+    args = self.args
+    l = self.l
+    last_substrate = None
+    for i, pixel in enumerate(pixel_que):
+      substrate = pixel[0][0].upper()
+      pix = pixel[0][1]
+      if substrate + pix + '_dark' in l.checkpoint['completed']:
+        print('\nSkipping dark sweep of substrate {:s}, pixel {:s} (already completed)'.format(substrate, pix))
+        continue
+      print('\nDark sweeping substrate {:s}, pixel {:s}...'.format(substrate, pix))
+      if last_substrate != substrate:  # we have a new substrate
+        last_substrate = substrate
+        substrate_ready = l.substrateSetup(position=substrate, variable_pairs=assignments[substrate], layout_name=pixel[3])
+
+      pixel_ready = l.pixelSetup(pixel, t_dwell_voc=1, group_suffix='_dark')
+      if pixel_ready and substrate_ready:
+        if type(args.current_compliance_override) == float:
+          compliance = args.current_compliance_override
+        else:
+          compliance = l.compliance_guess
+        start, end = args.dark_sweep
+        message = 'Dark sweeping voltage from {:.0f} mV to {:.0f} mV'.format(start*1000, end*1000)
+        sv = l.sweep(sourceVoltage=True, compliance=compliance, senseRange='a', nPoints=args.scan_points, start=start, end=end, NPLC=args.scan_nplc, message=message)
+        l.registerMeasurements(sv, 'Dark sweep')
+        l.pixelDeselect()
+        self.moveToNext(pixel_que, i, '_dark')
+        l.pixelComplete()
+
+  def measurePixels(self, pixel_que, assignments):
+    """
+    scans through the pixels and does the requested measurements
+    pixels already completed in the run's checkpoint are skipped
+    """
+    args = self.args
+    l = self.l
+    last_substrate = None
+    for i, pixel in enumerate(pixel_que):
+      substrate = pixel[0][0].upper()
+      pix = pixel[0][1]
+      if substrate + pix in l.checkpoint['completed']:
+        print('\nSkipping substrate {:s}, pixel {:s} (already completed)'.format(substrate, pix))
+        continue
+      print('\nOperating on substrate {:s}, pixel {:s}...'.format(substrate, pix))
+      if last_substrate != substrate:  # we have a new substrate
+        print('New substrate using "{:}" layout!'.format(pixel[3]))
+        last_substrate = substrate
+        substrate_ready = l.substrateSetup(position=substrate, variable_pairs=assignments[substrate], layout_name=pixel[3])
       
-          pixel_ready = l.pixelSetup(pixel, t_dwell_voc = args.t_prebias)  #  steady state Voc measured here
-          if pixel_ready and substrate_ready:
-            
-            if type(args.current_compliance_override) == float:
-              compliance = args.current_compliance_override
-            else:
-              compliance = l.compliance_guess  # we have to just guess what the current complaince should be here
-              # TODO: probably need the user to tell us when it's a dark scan to get the sensativity we need in that case
-            l.mppt.current_compliance = compliance
-              
-            if args.sweep:
-              # now sweep from Voc --> Isc
-              if type(args.scan_high_override) == float:
-                start = args.scan_high_override
-              else:
-                start = l.Voc
-              if type(args.scan_low_override) == float:
-                end = args.scan_low_override
-              else:
-                end = 0
+      pixel_ready = l.pixelSetup(pixel, t_dwell_voc = args.t_prebias)  #  steady state Voc measured here
+      if pixel_ready and substrate_ready:
+        
+        if type(args.current_compliance_override) == float:
+          compliance = args.current_compliance_override
+        else:
+          compliance = l.compliance_guess  # we have to just guess what the current complaince should be here
+          # TODO: probably need the user to tell us when it's a dark scan to get the sensativity we need in that case
+        l.mppt.current_compliance = compliance
+          
+        if args.sweep:
+          # now sweep from Voc --> Isc
+          if type(args.scan_high_override) == float:
+            start = args.scan_high_override
+          else:
+            start = l.Voc
+          if type(args.scan_low_override) == float:
+            end = args.scan_low_override
+          else:
+            end = 0
       
-              message = 'Sweeping voltage from {:.0f} mV to {:.0f} mV'.format(start*1000, end*1000)
-              sv = l.sweep(sourceVoltage=True, compliance=compliance, senseRange='a', nPoints=args.scan_points, start=start, end=end, NPLC=args.scan_nplc, message=message)
-              l.registerMeasurements(sv, 'Sweep')
-              
-              (Pmax, Vmpp, Impp, maxIndex) = l.mppt.which_max_power(sv)
-              l.mppt.Vmpp = Vmpp
-              
-              if type(args.current_compliance_override) == float:
-                compliance = args.current_compliance_override
-              else:
-                compliance = abs(sv[-1][1] * 2)  # take the last measurement*2 to be our compliance limit
-              l.mppt.current_compliance = compliance
+          message = 'Sweeping voltage from {:.0f} mV to {:.0f} mV'.format(start*1000, end*1000)
+          sv = l.sweep(sourceVoltage=True, compliance=compliance, senseRange='a', nPoints=args.scan_points, start=start, end=end, NPLC=args.scan_nplc, message=message)
+          l.registerMeasurements(sv, 'Sweep')
+          
+          (Pmax, Vmpp, Impp, maxIndex) = l.mppt.which_max_power(sv)
+          l.mppt.Vmpp = Vmpp
+          
+          if type(args.current_compliance_override) == float:
+            compliance = args.current_compliance_override
+          else:
+            compliance = abs(sv[-1][1] * 2)  # take the last measurement*2 to be our compliance limit
+          l.mppt.current_compliance = compliance
       
-            # steady state Isc measured here
-            iscs = l.steadyState(t_dwell=args.t_prebias, NPLC = 10, sourceVoltage=True, compliance=compliance, senseRange ='a', setPoint=0)
-            l.registerMeasurements(iscs, 'I_sc dwell')
+        # steady state Isc measured here
+        iscs = l.steadyState(t_dwell=args.t_prebias, NPLC = 10, sourceVoltage=True, compliance=compliance, senseRange ='a', setPoint=0, live='I_sc dwell')
+        l.registerMeasurements(iscs, 'I_sc dwell')
       
-            l.Isc = iscs[-1][1]  # take the last measurement to be Isc
-            l.f[l.position+'/'+l.pixel].attrs['Isc'] = l.Isc 
-            l.mppt.Isc = l.Isc
-            
-            if type(args.current_compliance_override) == float:
-              compliance = args.current_compliance_override
-            else:
-              # if the measured steady state Isc was below 5 microamps, set the compliance to 10uA (this is probaby a dark curve)
-              # we don't need the accuracy of the lowest current sense range (I think) and we'd rather have the compliance headroom
-              # otherwise, set it to be 2x of Isc            
-              if abs(l.Isc) < 0.000005:
-                compliance = 0.00001
-              else:
-                compliance = abs(l.Isc * 2)          
-            l.mppt.current_compliance = compliance
+        l.Isc = iscs[-1][1]  # take the last measurement to be Isc
+        l.f[l.position+'/'+l.pixel].attrs['Isc'] = l.Isc 
+        l.mppt.Isc = l.Isc
+        
+        if type(args.current_compliance_override) == float:
+          compliance = args.current_compliance_override
+        else:
+          # if the measured steady state Isc was below 5 microamps, set the compliance to 10uA (this is probaby a dark curve)
+          # we don't need the accuracy of the lowest current sense range (I think) and we'd rather have the compliance headroom
+          # otherwise, set it to be 2x of Isc            
+          if abs(l.Isc) < 0.000005:
+            compliance = 0.00001
+          else:
+            compliance = abs(l.Isc * 2)          
+        l.mppt.current_compliance = compliance
         
-            if args.snaith:
-              # "snaithing" is a sweep from Isc --> Voc * (1+ l.percent_beyond_voc)
-              if type(args.scan_low_override) == float:
-                start = args.scan_low_override
-              else:
-                start = 0
-              if type(args.scan_high_override) == float:
-                end = args.scan_high_override
-              else:
-                end = l.Voc * ((100 + l.percent_beyond_voc) / 100)
+        if args.snaith:
+          # "snaithing" is a sweep from Isc --> Voc * (1+ l.percent_beyond_voc)
+          if type(args.scan_low_override) == float:
+            start = args.scan_low_override
+          else:
+            start = 0
+          if type(args.scan_high_override) == float:
+            end = args.scan_high_override
+          else:
+            end = l.Voc * ((100 + l.percent_beyond_voc) / 100)
       
-              message = 'Snaithing voltage from {:.0f} mV to {:.0f} mV'.format(start*1000, end*1000)
+          message = 'Snaithing voltage from {:.0f} mV to {:.0f} mV'.format(start*1000, end*1000)
         
-              sv = l.sweep(sourceVoltage=True, senseRange='f', compliance=compliance, nPoints=args.scan_points, start=start, end=end, NPLC=args.scan_nplc, message=message)
-              l.registerMeasurements(sv, 'Snaith')
-              (Pmax, Vmpp, Impp, maxIndex) = l.mppt.which_max_power(sv)
-              l.mppt.Vmpp = Vmpp
+          sv = l.sweep(sourceVoltage=True, senseRange='f', compliance=compliance, nPoints=args.scan_points, start=start, end=end, NPLC=args.scan_nplc, message=message)
+          l.registerMeasurements(sv, 'Snaith')
+          (Pmax, Vmpp, Impp, maxIndex) = l.mppt.which_max_power(sv)
+          l.mppt.Vmpp = Vmpp
         
-            if (args.mppt > 0):
-              message = 'Tracking maximum power point for {:} seconds'.format(args.mppt)
-              l.track_max_power(args.mppt, message, extra=args.mppt_params)
+        if (args.mppt > 0):
+          message = 'Tracking maximum power point for {:} seconds'.format(args.mppt)
+          l.track_max_power(args.mppt, message, extra=args.mppt_params)
   
-            l.pixelComplete()
-      l.runDone()
-    l.sm.outOn(on=False)
-    print("Program complete.")
+        l.pixelDeselect()
+        self.moveToNext(pixel_que, i)
+        l.pixelComplete()
+
+  def moveToNext(self, pixel_que, i, group_suffix=''):
+    """
+    starts the stage moving to the next pixel after pixel_que[i] that still needs measuring
+    so that the move happens while this pixel's data is saved and the next pixel is set up
+    call it once the pixel has been deselected
+    """
+    completed = self.l.checkpoint['completed']
+    for pixel in list(pixel_que)[i+1:]:
+      if pixel[0][0].upper() + pixel[0][1] + group_suffix not in completed:
+        self.l.moveAhead(pixel[2])
+        break
         
   def get_args(self):
     """Get CLI arguments and options"""
@@ -332,11 +478,19 @@ class cli:
     measure.add_argument('--mppt-params', type=str, action=self.RecordPref, default='basic://7:10', help="*Extra configuration parameters for the maximum power point tracker, see https://git.io/fjfrZ")
     measure.add_argument('-i', '--layout-index', type=int, nargs='*', action=self.RecordPref, default=[], help="*Substrate layout(s) to use for finding pixel areas, read from layouts.ini file in CWD or {:}".format(self.system_layouts_file_fullpath))
     measure.add_argument('--area', type=float, nargs='*', default=[], help="Override pixel areas taken from layout (given in cm^2)")
+    measure.add_argument('--route-pixels', type=self.str2bool, default=True, action=self.RecordPref, const = True, help="*Visit the pixels in the order that needs the least stage travel (each substrate's pixels are still measured together) instead of address order")
+    measure.add_argument('--dark-sweep', type=float, nargs=2, default=None, metavar=('START', 'END'), help="Also sweep every pixel in the dark from START to END volts, these are stored in <pixel>_dark groups and done together to keep light switching to a minimum")
+    measure.add_argument('--light-soak', type=float, action=self.RecordPref, default=0.0, help="*Number of seconds the light must have been on before light measurements on a substrate start")
+    measure.add_argument('--intensity-checks', default=False, action='store_true', help="Measure the light intensity before each substrate's light measurements and store it with the substrate")
+    measure.add_argument('--resume', type=str, default=None, help="Continue an interrupted run by giving the path to its RunN.h5 file, the pixels and experimental parameters of the original run are used")
     
     setup = parser.add_argument_group('optional arguments for setup configuration')
     setup.add_argument("--ignore-adapter-resistors", type=self.str2bool, default=True, action=self.RecordPref, const = True, help="*Don't consider the resistor value of adapter boards when determining device layouts")
     setup.add_argument("--light-address", type=str, action=self.RecordPref, default='wavelabs-relay://localhost:3335', help="*protocol://hostname:port for communication with the solar simulator, 'none' for no light, 'wavelabs://0.0.0.0:3334' for starting a wavelabs server on port 3334, 'wavelabs-relay://127.0.0.1:3335' for connecting to a wavelabs-relay server")
     setup.add_argument("--motion-address", type=str, action=self.RecordPref, default='none', help="*protocol://hostname:port for communication with the motion controller, 'none' for no motion, 'afms:///dev/ttyAMC0' for an Adafruit Arduino motor shield on /dev/ttyAMC0, 'env://FTDI_DEVICE' to read the address from an environment variable named FTDI_DEVICE")
+    setup.add_argument("--remember-stage-position", type=self.str2bool, default=True, action=self.RecordPref, help="*Remember the stage position between runs and only home when it might have been lost (eg. the last run died mid-move)")
+    setup.add_argument("--rehome-interval", type=float, action=self.RecordPref, default=0.0, help="*Home the stage again between pixels when this many seconds have passed since it was last homed, for long runs, 0 disables this")
+    setup.add_argument("--home", default=False, action='store_true', help="Home the stage on connect even if its position is remembered")
     setup.add_argument("--rear", type=self.str2bool, default=True, action=self.RecordPref, help="*Use the rear terminals")
     setup.add_argument("--four-wire", type=self.str2bool, default=True, action=self.RecordPref, help="*Use four wire mode (the default)")
     setup.add_argument("--current-compliance-override", type=float, help="Override current compliance value used during I-V scans")
@@ -348,15 +502,27 @@ class cli:
     setup.add_argument("--sm-baud", type=int, action=self.RecordPref, default=57600, help="*Visa serial comms baud rate")
     setup.add_argument("--sm-address", default='GPIB0::24::INSTR', type=str, action=self.RecordPref, help="*VISA resource name for sourcemeter")
     setup.add_argument("--pcb-address", type=str, default='10.42.0.54:23', action=self.RecordPref, help="*host:port for PCB comms")
+    setup.add_argument("--pcb-topology-cache", type=self.str2bool, default=True, action=self.RecordPref, help="*Remember the adapter boards found on the PCB and skip re-reading their resistors when the same MUX boards are found again, turn off after swapping adapter boards")
     setup.add_argument("--calibrate-diodes", default=False, action='store_true', help="Read diode ADC counts now and store those as corresponding to 1.0 sun intensity")    
     setup.add_argument("--diode-calibration-values", type=int, nargs=2, action=self.RecordPref, default=(1,1), help="*Calibration ADC counts for diodes D1 and D2 that correspond to 1.0 sun intensity")
+    setup.add_argument('--intensity-log-rate', type=float, action=self.RecordPref, default=0.0, help="*Sample the intensity diodes this many times per second during the whole run and store them in the run file, 0 disables this")
+    setup.add_argument('--intensity-log-channels', type=int, nargs='*', default=[], help="Extra PCB ADC channels (0-7) to sample along with the intensity diodes")
+    setup.add_argument('--auto-intensity', type=float, default=None, help="Adjust the solar simulator's intensity setting until the intensity diodes read this many suns (needs diode calibration values)")
+    setup.add_argument('--auto-intensity-tolerance', type=float, action=self.RecordPref, default=0.01, help="*How close to the --auto-intensity target [suns] is close enough")
     setup.add_argument('--ignore-diodes', default=False, action='store_true', help="Ignore intensity diode readings and assume 1.0 sun illumination")
     setup.add_argument('--visa-lib', type=str, action=self.RecordPref, default='@py', help="*Path to visa library in case pyvisa can't find it, try C:\\Windows\\system32\\visa64.dll")
+    setup.add_argument('--gui-stream-address', type=str, default='tcp://127.0.0.1:51247', action=self.RecordPref, help="*tcp://host:port or unix:///path of the gui's binary measurement data stream (faster than XML-RPC, which is used if this doesn't work), 'none' to always use XML-RPC")
     setup.add_argument('--gui-address', type=str, default='http://127.0.0.1:51246', action=self.RecordPref, help='*protocol://host:port for the gui server')
+    setup.add_argument('--gui-queue-length', type=int, default=64, action=self.RecordPref, help="*Number of ROIs that can wait to be sent to the gui before some are dropped, measurements never wait on the gui")
+    setup.add_argument('--gui-drop-policy', type=str, default='drop-oldest', choices=gui_publisher.policies, action=self.RecordPref, help="*What to do with new ROIs when the gui queue is full: drop the oldest queued ROI or coalesce new live data into the newest queued live chunk of the same ROI")
+    setup.add_argument('--gui-live-rate', type=float, default=2.0, action=self.RecordPref, help="*How many times a second to send the newest samples of dwells and MPPT to the gui while they're being measured, 0 to only send whole ROIs")
+    setup.add_argument('--rig-name', type=str, default=socket.gethostname(), action=self.RecordPref, help="*Name this setup's data is tagged with, so dashboards watching several rigs through a hub (see mutovis-control-hub) can tell them apart")
     
     testing = parser.add_argument_group('optional arguments for debugging/testing')
     testing.add_argument('--dummy', default=False, action='store_true', help="Run in dummy mode (doesn't need sourcemeter, generates simulated device data)")
     testing.add_argument("--scan", default=False, action='store_true', help="Scan for obvious VISA resource names, print them and exit")
+    testing.add_argument('--timing-trace', default=False, action='store_true', help="Also export the run's per-phase timing as a Chrome trace (RunN.trace.json next to the run file, view with chrome://tracing)")
+    testing.add_argument('--io-stats', default=False, action='store_true', help="Record per-command latency histograms for the sourcemeter, PCB and light engine comms and store them in the run file")
     testing.add_argument('--test-hardware', default=False, action='store_true', help="Exercises all the hardware, used to check for and debug issues")
     
     args = parser.parse_args()
@@ -422,7 +588,7 @@ class cli:
         for key, value in self.layouts.items():
           targets = value['adapterboardresistor']
           for target in targets:
-            if fabric.isWithinPercent(target, r_value) or self.args.ignore_adapter_resistors or target == 0:
+            if mc.fabric.isWithinPercent(target, r_value) or self.args.ignore_adapter_resistors or target == 0:
               valid_layouts[key] = value
               break
         user_layout = user_layouts[0]  # here's the layout the user selected for this substrate
@@ -466,7 +632,14 @@ class cli:
       return dirname
     
   def str2bool(self, v):
-    return bool(distutils.util.strtobool(v))
+    """what distutils.util.strtobool does, without the time it takes to import distutils"""
+    v = v.lower()
+    if v in ('y', 'yes', 't', 'true', 'on', '1'):
+      return True
+    elif v in ('n', 'no', 'f', 'false', 'off', '0'):
+      return False
+    else:
+      raise ValueError("invalid truth value {:}".format(v))
   
 if __name__ == "__main__":
   cli = cli()
@@ -0,0 +1,75 @@
+import numpy as np
+import time
+
+class clock_sync:
+  """
+  relates the sourcemeter's clock (the timebase of measurement timestamps) to the host's time.time() clock
+  which is used for status messages, intensity logs and light events
+  host time = (1 + drift) * instrument time + offset
+  """
+  # this is the datatype for the paired clock readings in the h5py file
+  pair_datatype = np.dtype({'names': ['host', 'instrument', 'rtt'], 'formats': ['f8', 'f8', 'f8'], 'titles': ['Host time [s]', 'Instrument time [s]', 'Round trip time [s]']})
+
+  def __init__(self, sm):
+    self.sm = sm
+    self.reset()
+
+  def reset(self):
+    self.pairs = []
+
+  def sample(self, n=3):
+    """
+    makes n paired readings of the two clocks and keeps the one with the shortest round trip
+    the host time of a pairing is taken to be the middle of the query
+    """
+    best = None
+    try:
+      for i in range(n):
+        t0 = time.time()
+        t_instrument = self.sm.getTime()
+        t1 = time.time()
+        pair = ((t0 + t1) / 2, t_instrument, t1 - t0)
+        if (best is None) or (pair[2] < best[2]):
+          best = pair
+    except Exception as e:
+      print('WARNING: Could not read the sourcemeter clock: {:}'.format(e))
+    if best is not None:
+      self.pairs.append(best)
+    return best
+
+  def fit(self):
+    """
+    returns (offset, drift), pairings with short round trips count more
+    drift is only estimated once there are pairings spread over more than a second
+    """
+    if len(self.pairs) == 0:
+      return None, None
+    p = np.array(self.pairs, dtype=self.pair_datatype)
+    weights = 1 / np.maximum(p['rtt'], 1e-6)
+    if len(p) < 2 or np.ptp(p['instrument']) < 1:
+      offset = np.average(p['host'] - p['instrument'], weights=weights)
+      return float(offset), 0.0
+    slope, offset = np.polyfit(p['instrument'], p['host'], 1, w=weights)
+    return float(offset), float(slope - 1)
+
+  def toHost(self, t_instrument):
+    """converts instrument clock readings (scalar or array) to host time"""
+    offset, drift = self.fit()
+    return (1 + drift) * np.asarray(t_instrument) + offset
+
+  def store(self, f):
+    """
+    writes the pairings and the fitted mapping into an h5py file or group
+    """
+    name = 'clock_sync'
+    n = 1
+    while name in f:  # don't clobber the data from an earlier session of a resumed run
+      name = 'clock_sync_{:d}'.format(n)
+      n += 1
+    d = f.create_dataset(name, data=np.array(self.pairs, dtype=self.pair_datatype))
+    offset, drift = self.fit()
+    if offset is not None:
+      d.attrs['Offset [s]'] = offset
+      d.attrs['Drift'] = drift
+      d.attrs['Mapping'] = np.bytes_('host time = (1 + Drift) * instrument time + Offset')
+      print('Sourcemeter clock offset = {:.6f} s, drift = {:.3g}'.format(offset, drift))
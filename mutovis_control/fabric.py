@@ -5,7 +5,9 @@ import re
 import os
 import time
 import tempfile
-import inspect
+import sys
+import linecache
+import json
 from collections import deque
 
 import mutovis_control as mc
@@ -38,8 +40,50 @@ class fabric:
   s = np.array([], dtype=status_datatype)  # status list: columns = corresponding measurement index, status message
   r = np.array([], dtype=roi_datatype)  # list defining regions of interest in the measurement list
   
-  # function to use when sending ROIs to the GUI
-  update_gui = None
+  # gui_publisher that sends ROIs to the GUI in the background, None for no GUI
+  gui_publisher = None
+  live_rate = 2.0  # [Hz] how often new samples from long measurements (dwells, MPPT) are sent to the GUI, 0 to only send whole ROIs
+
+  # run progress, kept next to the run file so an interrupted run can be resumed
+  checkpoint = None
+  checkpoint_suffix = '.checkpoint'
+
+  # export the run's per-phase timing as a Chrome trace next to the run file
+  timing_trace = False
+
+  # background light intensity sampling during runs, 0 samples per second disables it
+  intensity_log_rate = 0
+  intensity_log_channels = []  # extra PCB ADC channels to sample along with the photodiodes
+  intensity_logger = None
+
+  # what we know about the light, None until it's first switched
+  light_on = None
+  light_on_since = None
+
+  # [s] guesses at how long switching the light takes, used until we've timed it
+  light_on_cost = 3.0
+  light_off_cost = 1.0
+
+  # (position, future) of a stage move started ahead of the pixel that needs it
+  pending_move = None
+
+  # the run file attrs holding the intensity measured at the start of this session (the run's or its latest resume's)
+  intensity_attrs = None
+
+  # range the light source's intensity setting [%] is kept in during automatic intensity calibration
+  intensity_setting_limits = (1.0, 100.0)
+
+  # this is the datatype for the automatic intensity calibration tries in the h5py file
+  intensity_calibration_datatype = np.dtype({'names': ['setting', 'diode_1', 'diode_2'], 'formats': ['f8', 'f8', 'f8'], 'titles': ['Intensity setting [%]', 'Diode 1 intensity [suns]', 'Diode 2 intensity [suns]']})
+
+  # this is the datatype for light on/off events in the h5py file
+  light_event_datatype = np.dtype({'names': ['requested', 'done', 'on'], 'formats': ['f8', 'f8', 'u1'], 'titles': ['Requested [s]', 'Done [s]', 'Light on']})
+
+  # iostats object with the time spent waiting for each instrument session
+  session_stats = None
+
+  # iostats object holding the instruments' command latency histograms, None unless connect() was asked for them
+  io_stats = None
 
   def __init__(self, saveDir, archive_address=None):
     self.saveDir = saveDir
@@ -48,6 +92,8 @@ class fabric:
     self.software_revision = fabric.getMyHash()
     print('Software revision: {:s}'.format(self.software_revision))
 
+    self.profiler = mc.profiler()
+
   def __setattr__(self, attr, value):
     """here we can override what happends when we set an attribute"""
     if attr == 'Voc':
@@ -63,84 +109,122 @@ class fabric:
     else:
       self.__dict__[attr] = value
 
-  def connect(self, dummy=False, visa_lib='@py', visaAddress='GPIB0::24::INSTR', pcbAddress='10.42.0.54:23', motionAddress=None, lightAddress=None, visaTerminator='\n', visaBaud=57600, ignore_adapter_resistors=False):
+  def connect(self, dummy=False, visa_lib='@py', visaAddress='GPIB0::24::INSTR', pcbAddress='10.42.0.54:23', motionAddress=None, lightAddress=None, visaTerminator='\n', visaBaud=57600, ignore_adapter_resistors=False, io_stats=False, pcbTopologyCache=None, motionStateFile=None, motionRehomeInterval=0, motionAlwaysHome=False):
     """Forms a connection to the PCB, the sourcemeter and the light engine
     will form connections to dummy instruments if dummy=true
+    if io_stats=True, command latency histograms are recorded for the instruments and stored with each run
+    pcbTopologyCache is an optional file for remembering the PCB's connected boards between connections
+    motionStateFile is an optional file for remembering the stage position between connections so that it needn't home every time,
+    motionRehomeInterval [s] re-references the stage that often (0 for never) and motionAlwaysHome forces homing on connect
     """
+    if io_stats:
+      self.io_stats = mc.iostats()
 
     if dummy:
       self.sm = mc.virt.k2400()
       self.pcb = mc.virt.pcb()
     else:
-      self.sm = mc.k2400(visa_lib=visa_lib, terminator=visaTerminator, addressString=visaAddress, serialBaud=visaBaud)
-      self.pcb = mc.pcb(address=pcbAddress, ignore_adapter_resistors=ignore_adapter_resistors)
+      self.sm = mc.k2400(visa_lib=visa_lib, terminator=visaTerminator, addressString=visaAddress, serialBaud=visaBaud, stats=self.io_stats)
+      self.pcb = mc.pcb(address=pcbAddress, ignore_adapter_resistors=ignore_adapter_resistors, stats=self.io_stats, topology_cache=pcbTopologyCache)
     self.sm_idn = self.sm.idn
-      
-    self.mppt = mc.mppt(self.sm)
 
     if lightAddress == None:
       self.le = mc.virt.illumination()
     else:
       self.le = mc.illumination(address = lightAddress)
+      if hasattr(self.le.light_engine, 'stats'):
+        self.le.light_engine.stats = self.io_stats
       self.le.connect()
       
     if motionAddress == None:
       self.me = mc.virt.motion()
     else:
-      self.me = mc.motion(address = motionAddress)
+      self.me = mc.motion(address = motionAddress, state_file=motionStateFile, rehome_interval=motionRehomeInterval, always_home=motionAlwaysHome)
       self.me.connect()
 
+    # from here on the instruments are only used through sessions so that they can be shared between threads
+    self.session_stats = mc.iostats()  # how long callers waited for each device
+    self.sm = mc.session(self.sm, name='sm', stats=self.session_stats)
+    self.pcb = mc.session(self.pcb, name='pcb', stats=self.session_stats)
+    self.le = mc.session(self.le, name='le', stats=self.session_stats)
+    self.me = mc.session(self.me, name='me', stats=self.session_stats)
+
+    self.mppt = mc.mppt(self.sm)
+    self.clock = mc.clock_sync(self.sm)
+    self.light_events = []
+    self.light_on = None
+
   def getMyHash(short=True):
+    """
+    returns the control software's revision: the git commit we're running from, the one in commit_hash.txt
+    or the version setuptools launched us with
+    only reads a file or two, this runs on every startup
+    """
     thisPath = os.path.dirname(os.path.abspath(__file__))
     projectPath = os.path.join(thisPath, os.path.pardir)
-    HEADFile = os.path.join(projectPath, '.git', 'HEAD')
+    gitPath = os.path.join(projectPath, '.git')
+    HEADFile = os.path.join(gitPath, 'HEAD')
     commit_hashFile = os.path.join(projectPath, 'commit_hash.txt')
-    prefix = "load_entry_point('mutovis-control=="
     prefix = "load_entry_point"
     splitter = '=='
-    top_stack_code_context = inspect.stack()[-1].code_context[0]
 
     myHash = 'Unknown'
     if os.path.exists(HEADFile): # are we in a git repo?
-      f = open(HEADFile)
-      hashFileLocation = f.readline().splitlines()[0].split()[1].split('/')
-      f.close()
-      f = open(os.path.join(projectPath, '.git', *hashFileLocation))
-      myHash = f.readline().splitlines()[0]
-      f.close()
+      with open(HEADFile) as f:
+        head = f.readline().strip()
+      if head.startswith('ref: '):
+        ref = head[len('ref: '):]
+        refFile = os.path.join(gitPath, *ref.split('/'))
+        if os.path.exists(refFile):
+          with open(refFile) as f:
+            myHash = f.readline().strip()
+        elif os.path.exists(os.path.join(gitPath, 'packed-refs')):  # refs get packed by git gc
+          with open(os.path.join(gitPath, 'packed-refs')) as f:
+            for line in f:
+              if line.strip().endswith(' ' + ref):
+                myHash = line.split()[0]
+                break
+      else:  # detached HEAD
+        myHash = head
     elif os.path.exists(commit_hashFile):  # no git repo? check in commit_hash.txt
       f = open(commit_hashFile)
       contents = f.readline().splitlines()[0].split()
       f.close()
       if len(contents) != 3:  # the length will be 3 here if it doesn't contain the hash as position [1]
         myHash = contents[1]
-    elif (prefix in top_stack_code_context) and (splitter in top_stack_code_context):
-      myHash = "v"+top_stack_code_context.strip().lstrip(prefix).split("==")[1].split("'")[0]
+    else:  # maybe setuptools' launcher script started us, its load_entry_point('mutovis-control==version', ...) line has our version
+      frame = sys._getframe()
+      while frame.f_back is not None:
+        frame = frame.f_back
+      top_stack_code_context = linecache.getline(frame.f_code.co_filename, frame.f_lineno)
+      if (prefix in top_stack_code_context) and (splitter in top_stack_code_context):
+        myHash = "v"+top_stack_code_context.strip().lstrip(prefix).split("==")[1].split("'")[0]
 
     if short:
       myHash = myHash[:7]
     return myHash
 
   def hardwareTest(self, substrates_to_test):
-    self.le.on()
+    self.lightOn()
     
     n_adc_channels = 8
     
+    all_counts = [int(c) for c in self.pcb.getMany(['ADC'+str(chan) for chan in range(n_adc_channels)])]
     for chan in range(n_adc_channels):
-      print('ADC channel {:} Counts: {:}'.format(chan,self.pcb.getADCCounts(chan)))
+      print('ADC channel {:} Counts: {:}'.format(chan, all_counts[chan]))
       
     chan = 2
-    counts = self.pcb.getADCCounts(chan)
+    counts = all_counts[chan]
     print('{:d}\t<-- D1 Diode ADC counts (TP3, AIN{:d})'.format(counts, chan))
 
     chan = 3
-    counts = self.pcb.getADCCounts(chan)
+    counts = all_counts[chan]
     print('{:d}\t<-- D2 Diode ADC counts (TP4, AIN{:d})'.format(counts, chan))
 
     chan = 0
-    for substrate in substrates_to_test:
-      r = self.pcb.get('d'+substrate)
-      print('{:s}\t<-- Substrate {:s} adapter resistor value in ohms (AIN{:d})'.format(r, substrate, chan))
+    resistors = self.pcb.getMany(['d'+substrate for substrate in substrates_to_test])
+    for substrate, r in zip(substrates_to_test, resistors):
+      print('{:}\t<-- Substrate {:s} adapter resistor value in ohms (AIN{:d})'.format(r, substrate, chan))
 
     print("LED test mode active on substrate(s) {:s}".format(substrates_to_test))
     print("Every pixel should get an LED pulse IV sweep now, plus the light should turn on")    
@@ -151,7 +235,7 @@ class fabric:
       ready_to_sweep = False
       
       # move to center of substrate
-      self.me.goto(self.me.substrate_centers[ord(substrate)-ord('A')])
+      self.goto(self.me.substrate_centers[ord(substrate)-ord('A')])
       
       for pix in range(8):
         pixel_addr = substrate+str(pix+1) 
@@ -181,7 +265,79 @@ class fabric:
       # deselect all pixels
       self.pcb.pix_picker(substrate, 0)
 
+    self.lightOff()
+
+  def lightOn(self):
+    """turns the light on (unless it already is), recording when that happened in host time"""
+    if self.light_on == True:
+      return
+    t = time.time()
+    self.le.on()
+    self.light_on_since = time.time()
+    self.light_on = True
+    self.light_events.append((t, self.light_on_since, 1))
+
+  def lightOff(self, force=False):
+    """turns the light off (unless it already is or force), recording when that happened in host time"""
+    if (self.light_on == False) and not force:
+      return
+    t = time.time()
     self.le.off()
+    self.light_on = False
+    self.light_events.append((t, time.time(), 0))
+
+  def setLight(self, on, soak=0):
+    """
+    gets the light into the state a measurement step needs, on=None means either is fine
+    with the light on, waits until it has been on for at least soak seconds
+    """
+    if on == True:
+      with self.profiler.phase('le.on'):
+        self.lightOn()
+      wait = soak - (time.time() - self.light_on_since)
+      if wait > 0:
+        print('Light soaking for {:.1f} more seconds'.format(wait))
+        with self.profiler.phase('light soak'):
+          time.sleep(wait)
+    elif on == False:
+      with self.profiler.phase('le.off'):
+        self.lightOff()
+
+  def lightCosts(self):
+    """returns how long (on, off) switching the light takes [s], from this run's switching if there was any"""
+    costs = []
+    for state, guess in ((1, self.light_on_cost), (0, self.light_off_cost)):
+      times = [done - requested for requested, done, on in self.light_events if on == state]
+      costs.append(sum(times)/len(times) if len(times) > 0 else guess)
+    return tuple(costs)
+
+  def intensityCheck(self, position, diode_cal):
+    """
+    measures the light intensity and stores it with the substrate at position
+    """
+    self.goto(self.me.photodiode_location)
+    with self.profiler.phase('intensity'):
+      intensity = self.measureIntensity(diode_cal)
+    print("Intensity before substrate {:s} = [{:0.4f} {:0.4f}] suns".format(position, float(intensity[2]), float(intensity[3])))
+    g = self.f.require_group(position)
+    g.attrs['Diode 1 intensity [ADC counts]'] = int(intensity[0])
+    g.attrs['Diode 2 intensity [ADC counts]'] = int(intensity[1])
+    g.attrs['Diode 1 intensity [suns]'] = float(intensity[2])
+    g.attrs['Diode 2 intensity [suns]'] = float(intensity[3])
+    return intensity
+
+  def storeTimebase(self):
+    """
+    stores what's needed to put everything on the host's timeline: the sourcemeter clock mapping and the light events
+    """
+    self.clock.sample()
+    self.clock.store(self.f)
+    name = 'light_events'
+    n = 1
+    while name in self.f:  # don't clobber the events from an earlier session of a resumed run
+      name = 'light_events_{:d}'.format(n)
+      n += 1
+    self.f.create_dataset(name, data=np.array(self.light_events, dtype=self.light_event_datatype))
 
   def measureIntensity(self, diode_cal):
     """
@@ -189,7 +345,7 @@ class fabric:
     takes diode calibration values in diode_cal
     if diode_cal is not a tuple with valid calibration values, sets intensity to 1.0 sun for both diodes
     """
-    ret = [self.pcb.get('p1'), self.pcb.get('p2'), 1.0, 1.0]
+    ret = self.pcb.getMany(['p1', 'p2']) + [1.0, 1.0]
     
     if type(diode_cal) == list or type(diode_cal) == tuple:
       if diode_cal[0] <= 1:
@@ -204,6 +360,85 @@ class fabric:
     
     return ret
   
+  def calibrateIntensity(self, diode_cal, target=1.0, tolerance=0.01, max_iterations=8):
+    """
+    adjusts the light source's intensity setting until the photodiodes read target suns (within tolerance suns)
+    uses the secant method, the first step assumes intensity is proportional to the setting
+    each try is logged in the run file's intensity_calibration dataset and the session's intensity attrs are updated
+    to the calibrated intensity, the ones read before calibrating are kept as 'Diode n intensity before calibration [...]'
+    if it doesn't converge within max_iterations the setting that came closest to target is used
+    returns the intensity tuple (see runSetup) measured at the final setting
+    """
+    if not ((type(diode_cal) == list or type(diode_cal) == tuple) and diode_cal[0] > 1 and diode_cal[1] > 1):
+      raise ValueError("Automatic intensity calibration needs valid diode calibration values")
+    lo, hi = self.intensity_setting_limits
+
+    def suns_at(setting):
+      with self.profiler.phase('le.off'):
+        self.lightOff()
+      with self.profiler.phase('le.setIntensity'):
+        self.le.setIntensity(setting)
+      with self.profiler.phase('le.on'):
+        self.lightOn()
+      if type(mc.session.unwrap(self.le)) == mc.illumination:
+        time.sleep(0.5)  # let a real solar sim settle before measuring
+      with self.profiler.phase('intensity'):
+        intensity = self.measureIntensity(diode_cal)
+      tries.append((setting, intensity[2], intensity[3]))
+      print("Intensity setting {:.2f}% gives [{:0.4f} {:0.4f}] suns".format(setting, float(intensity[2]), float(intensity[3])))
+      return intensity
+
+    tries = []
+    self.goto(self.me.photodiode_location)
+    x0 = self.le.getIntensity()
+    if self.light_on:
+      with self.profiler.phase('intensity'):
+        intensity = self.measureIntensity(diode_cal)
+      tries.append((x0, intensity[2], intensity[3]))
+    else:
+      intensity = suns_at(x0)
+    y0 = (intensity[2] + intensity[3]) / 2 - target
+    x1 = min(max(x0 * target / (y0 + target), lo), hi) if (y0 + target) > 0 else hi
+    converged = abs(y0) <= tolerance
+    while not converged and len(tries) < max_iterations:
+      intensity = suns_at(x1)
+      y1 = (intensity[2] + intensity[3]) / 2 - target
+      converged = abs(y1) <= tolerance
+      if converged or (y1 == y0) or (x1 == x0):
+        break
+      x0, y0, x1 = x1, y1, min(max(x1 - y1 * (x1 - x0) / (y1 - y0), lo), hi)
+    setting = tries[-1][0]
+    if not converged:  # the last try isn't necessarily the best one (eg. clamped at a limit), go back to the closest
+      best = min(tries, key=lambda t: abs((t[1] + t[2]) / 2 - target))
+      if best[0] != setting:
+        setting = best[0]
+        intensity = suns_at(setting)
+
+    if 'intensity_calibration' in self.f:  # left over from a previous session of a resumed run
+      del self.f['intensity_calibration']
+    d = self.f.create_dataset('intensity_calibration', data=np.array(tries, dtype=self.intensity_calibration_datatype))
+    d.attrs['Target [suns]'] = target
+    d.attrs['Tolerance [suns]'] = tolerance
+    d.attrs['Final intensity setting [%]'] = setting
+    d.attrs['Converged'] = converged
+    if self.intensity_attrs is not None:
+      attrs = self.intensity_attrs
+      for n in (1, 2):
+        for unit in ('ADC counts', 'suns'):
+          key = 'Diode {:d} intensity [{:s}]'.format(n, unit)
+          if key in attrs:
+            attrs['Diode {:d} intensity before calibration [{:s}]'.format(n, unit)] = attrs[key]
+      attrs['Diode 1 intensity [ADC counts]'] = int(intensity[0])
+      attrs['Diode 2 intensity [ADC counts]'] = int(intensity[1])
+      attrs['Diode 1 intensity [suns]'] = float(intensity[2])
+      attrs['Diode 2 intensity [suns]'] = float(intensity[3])
+      attrs['Intensity setting [%]'] = float(setting)
+    if converged:
+      print("Intensity calibrated to [{:0.4f} {:0.4f}] suns with setting {:.2f}% in {:d} tries".format(float(intensity[2]), float(intensity[3]), setting, len(tries)))
+    else:
+      print("WARNING: Intensity calibration did not reach {:} suns within {:} suns, using setting {:.2f}%".format(target, tolerance, setting))
+    return intensity
+
   def isWithinPercent(target, value, percent=10):
     """
     returns true if value is within percent percent of target, otherwise returns false
@@ -236,6 +471,13 @@ class fabric:
     if not os.path.exists(destinationDir):
       os.makedirs(destinationDir)
 
+    self.profiler.reset()
+    self.session_stats.reset()
+    self.clock.reset()
+    self.clock.sample()
+    self.light_events = []
+    if self.io_stats is not None:
+      self.io_stats.reset()
     i = 0
     genFullpath = lambda a: os.path.join(destinationDir,"Run{:d}.h5".format(a))
     while os.path.exists(genFullpath(i)):
@@ -249,15 +491,10 @@ class fabric:
     self.f.attrs['Format Revision'] = np.string_(self.outputFormatRevision)
     self.f.attrs['Run Description'] = np.string_(run_description)
     self.f.attrs['Sourcemeter'] = np.string_(self.sm_idn)
-    if not ignore_diodes:
-      self.me.goto(self.me.photodiode_location)
-    self.le.on()
-    if type(self.le) == mc.illumination:
-      time.sleep(0.5) # if this is a real solar sim (not a virtual one), wait half a sec before measuring intensity
-    if ignore_diodes == True:
-      intensity = (1, 1, 1.0, 1.0)
-    else:
-      intensity = self.measureIntensity(diode_cal)
+    self.checkpoint = {'completed': [], 'assignments': {}, 'plan': {}}
+    self.writeCheckpoint()
+    self.runEvent('run_start')
+    intensity = self.illuminate(diode_cal, ignore_diodes=ignore_diodes)
     self.f.attrs['Diode 1 intensity [ADC counts]'] = np.int(intensity[0])
     self.f.attrs['Diode 2 intensity [ADC counts]'] = np.int(intensity[1])
     if type(diode_cal) == list:
@@ -268,27 +505,195 @@ class fabric:
       self.f.attrs['Diode 2 calibration [ADC counts]'] = np.int(intensity[1])
     self.f.attrs['Diode 1 intensity [suns]'] = np.float(intensity[2])
     self.f.attrs['Diode 2 intensity [suns]'] = np.float(intensity[3])
+    self.intensity_attrs = self.f.attrs
+    self.startIntensityLog(diode_cal, intensity)
+    return intensity
+
+  def runResume(self, run_file, diode_cal, ignore_diodes=False):
+    """
+    reopens the file of an interrupted run so that measurements can continue where they stopped
+    pixel groups that were started but never completed are removed so they can be measured again
+    returns the intensity tuple (see runSetup), the new intensity values are stored in the run file's Resumes group
+    """
+    self.profiler.reset()
+    self.session_stats.reset()
+    self.clock.reset()
+    self.clock.sample()
+    self.light_events = []
+    if self.io_stats is not None:
+      self.io_stats.reset()
+    self.checkpoint = fabric.readCheckpoint(run_file)
+    run_file = os.path.abspath(run_file)
+    self.run_dir = os.path.basename(os.path.dirname(run_file))
+    self.f = h5py.File(run_file, 'r+')
+    print("Resuming file {:}".format(self.f.filename))
+
+    completed = self.checkpoint['completed']
+    for substrate in list(self.f.keys()):
+      if len(substrate) != 1:  # not a substrate group
+        continue
+      for pixel in list(self.f[substrate].keys()):
+        if substrate + pixel not in completed:
+          print("Discarding partial data for substrate {:s}, pixel {:s}".format(substrate, pixel))
+          del self.f[substrate + '/' + pixel]
+    print("{:d} pixel(s) were already completed".format(len(completed)))
+    self.runEvent('run_resume')
+
+    resumes = self.f.require_group('Resumes')
+    resume = resumes.create_group(str(len(resumes)))
+    resume.attrs['Timestamp'] = time.time()
+    resume.attrs['Control Software Revision'] = np.bytes_(self.software_revision)
+    intensity = self.illuminate(diode_cal, ignore_diodes=ignore_diodes)
+    resume.attrs['Diode 1 intensity [ADC counts]'] = int(intensity[0])
+    resume.attrs['Diode 2 intensity [ADC counts]'] = int(intensity[1])
+    resume.attrs['Diode 1 intensity [suns]'] = float(intensity[2])
+    resume.attrs['Diode 2 intensity [suns]'] = float(intensity[3])
+    self.intensity_attrs = resume.attrs
+    self.startIntensityLog(diode_cal, intensity)
+    return intensity
+
+  def startIntensityLog(self, diode_cal, intensity):
+    """
+    starts sampling the light intensity in the background if that's been asked for
+    """
+    if self.intensity_log_rate > 0:
+      if type(diode_cal) == list or type(diode_cal) == tuple:
+        self.intensity_log_cal = diode_cal
+      else:  # we re-calibrated this run
+        self.intensity_log_cal = (intensity[0], intensity[1])
+      self.intensity_logger = mc.intensity_logger(self.pcb.withPriority(mc.session.TELEMETRY), rate=self.intensity_log_rate, adc_channels=self.intensity_log_channels)
+      self.intensity_logger.start()
+
+  def stopIntensityLog(self):
+    """
+    stops background intensity sampling and stores the samples in the run file
+    """
+    if self.intensity_logger is not None:
+      self.intensity_logger.stop()
+      self.intensity_logger.store(self.f, diode_cal=self.intensity_log_cal)
+      self.intensity_logger = None
+
+  def illuminate(self, diode_cal, ignore_diodes=False):
+    """
+    turns on the light and measures its intensity, returns the intensity tuple (see runSetup)
+    """
+    if not ignore_diodes:
+      self.moveAhead(self.me.photodiode_location)  # the light comes on while the stage moves
+    with self.profiler.phase('le.on'):
+      self.lightOn()
+    self.waitForMove()
+    if type(mc.session.unwrap(self.le)) == mc.illumination:
+      time.sleep(0.5) # if this is a real solar sim (not a virtual one), wait half a sec before measuring intensity
+    if ignore_diodes == True:
+      intensity = (1, 1, 1.0, 1.0)
+    else:
+      with self.profiler.phase('intensity'):
+        intensity = self.measureIntensity(diode_cal)
     print("Intensity = [{:0.4f} {:0.4f}] suns".format(np.float(intensity[2]), np.float(intensity[3])))
     return intensity
 
+  def readCheckpoint(run_file):
+    """
+    returns the checkpoint dict stored next to run_file
+    """
+    checkpoint_file = run_file + fabric.checkpoint_suffix
+    if not os.path.exists(checkpoint_file):
+      raise ValueError("No checkpoint found for {:}, can not resume this run".format(run_file))
+    with open(checkpoint_file, 'r') as f:
+      return json.load(f)
+
+  def writeCheckpoint(self):
+    """
+    saves the run's progress next to the run file
+    """
+    checkpoint_file = self.f.filename + self.checkpoint_suffix
+    tmp_file = checkpoint_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+      json.dump(self.checkpoint, f, indent=1)
+    os.replace(tmp_file, checkpoint_file)  # so that a crash never leaves a half written checkpoint
+
+  def runEvent(self, event):
+    """tells the GUI (or the dashboards subscribed to this rig through a hub) what's happening with the run"""
+    if self.gui_publisher is not None:
+      self.gui_publisher.topic['run'] = self.run_dir + '/' + os.path.basename(self.f.filename)
+      self.gui_publisher.event(event)
+
+  def runAbort(self):
+    """
+    call this when a run can't continue, leaves things so that the run can be resumed later
+    """
+    try:
+      self.waitForMove()
+    except:
+      pass
+    try:
+      self.lightOff(force=True)
+    except:
+      pass
+    try:
+      self.sm.outOn(on=False)
+    except:
+      pass
+    try:
+      self.runEvent('run_abort')
+    except:
+      pass
+    try:
+      self.stopIntensityLog()
+    except:
+      pass
+    try:
+      self.storeTimebase()
+    except:
+      pass
+    this_filename = self.f.filename
+    self.f.close()
+    print("\nRun interrupted. Continue it later with: --resume {:}".format(this_filename))
+
   def runDone(self):
-    self.le.off()
+    self.waitForMove()
+    self.stopIntensityLog()
+    with self.profiler.phase('le.off'):
+      self.lightOff()
+    self.storeTimebase()
+    if 'timing' in self.f:  # left over from a previous session of a resumed run
+      del self.f['timing']
+    self.profiler.store(self.f.create_group('timing'))
+    if self.io_stats is not None:
+      if 'io_latency' in self.f:
+        del self.f['io_latency']
+      self.io_stats.store(self.f.create_group('io_latency'))
+    if 'session_waits' in self.f:
+      del self.f['session_waits']
+    self.session_stats.store(self.f.create_group('session_waits'))
+    self.runEvent('run_done')
     print("\nClosing {:s}".format(self.f.filename))
     this_filename = self.f.filename
     self.f.close()
+    if os.path.exists(this_filename + self.checkpoint_suffix):
+      os.remove(this_filename + self.checkpoint_suffix)  # the run is complete, there's nothing to resume
     if self.archive_address is not None:
       if self.archive_address.startswith('ftp://'):
-        with mc.put_ftp(self.archive_address+self.run_dir + '/', pasv=True) as ftp:
-          with open(this_filename,'rb') as fp:
-            ftp.uploadFile(fp)
+        with self.profiler.phase('ftp upload'):
+          with mc.put_ftp(self.archive_address+self.run_dir + '/', pasv=True) as ftp:
+            with open(this_filename,'rb') as fp:
+              ftp.uploadFile(fp)
 
       else:
         print('WARNING: Could not understand archive url')
+    self.profiler.printSummary()
+    if self.io_stats is not None:
+      self.io_stats.printSummary()
+      self.session_stats.printSummary(title='Instrument wait times')
+    if self.timing_trace:
+      self.profiler.exportChromeTrace(os.path.splitext(this_filename)[0] + '.trace.json')
     
   def substrateSetup (self, position, suid='', variable_pairs=[], layout_name=''):
     self.position = position
-    if self.pcb.pix_picker(position, 0):
-      self.f.create_group(position)
+    with self.profiler.phase('pcb.pix_picker'):
+      substrate_ok = self.pcb.pix_picker(position, 0)
+    if substrate_ok:
+      self.f.require_group(position)  # might exist already if we're resuming
   
       self.f[position].attrs['Sample Unique Identifier'] = np.string_(suid)
   
@@ -298,22 +703,58 @@ class fabric:
         parameter_name = pair[0]
         parameter_value = pair[1]
         self.f[position].attrs['User_'+parameter_name] = np.string_(parameter_value)
+      self.checkpoint['assignments'][position] = variable_pairs
+      self.writeCheckpoint()
 
       return True
     else:
       return False
 
-  def pixelSetup(self, pixel, t_dwell_voc=10):
-    """Call this to switch to a new pixel"""
-    self.pixel = str(pixel[0][1])
-    if self.pcb.pix_picker(pixel[0][0], pixel[0][1]):
-      self.me.goto(pixel[2])  # move stage here
+  def goto(self, position):
+    """
+    moves the stage to position and waits for it to get there
+    """
+    self.moveAhead(position)
+    self.waitForMove()
+
+  def moveAhead(self, position):
+    """
+    starts moving the stage to position without waiting, the pixelSetup() that needs the stage there waits for it to arrive before selecting the pixel
+    """
+    if (self.pending_move is None) or (self.pending_move[0] != position):
+      self.waitForMove()
+      self.pending_move = (position, self.me.goto_async(position))
+
+  def waitForMove(self):
+    """
+    blocks until any move started with moveAhead() is done
+    """
+    if self.pending_move is not None:
+      position, arrival = self.pending_move
+      self.pending_move = None
+      with self.profiler.phase('me.goto'):
+        ret = arrival.result()
+      if (ret is not None) and (ret != 0):
+        print("WARNING: Stage move to {:} mm failed: {:}".format(position, ret))
+
+  def pixelSetup(self, pixel, t_dwell_voc=10, group_suffix=''):
+    """Call this to switch to a new pixel
+    group_suffix is added to the name of the pixel's group in the run file, for measurements kept apart from the pixel's main ones
+    contacts are never live while the stage moves: the pixel is only selected (and the sourcemeter set up) once the stage has arrived,
+    a move started early with moveAhead() overlaps only with the previous pixel's data saving and the GUI
+    """
+    self.pixel = str(pixel[0][1]) + group_suffix
+    self.profiler.pixel = pixel[0]
+    self.goto(pixel[2])  # move stage here
+    with self.profiler.phase('pcb.pix_picker'):
+      pixel_ok = self.pcb.pix_picker(pixel[0][0], pixel[0][1])
+    if pixel_ok:
       self.area = pixel[1]
   
       self.f[self.position].create_group(self.pixel)
       self.f[self.position+'/'+self.pixel].attrs['area'] = self.area * 1e-4  # in m^2
   
-      vocs = self.steadyState(t_dwell=t_dwell_voc, NPLC=10, sourceVoltage=False, compliance=2, senseRange='a', setPoint=0)
+      vocs = self.steadyState(t_dwell=t_dwell_voc, NPLC=10, sourceVoltage=False, compliance=2, senseRange='a', setPoint=0, live='V_oc dwell')
       self.registerMeasurements(vocs, 'V_oc dwell')
   
       self.Voc = vocs[-1][0]  # take the last measurement to be Voc
@@ -324,13 +765,22 @@ class fabric:
     else:
       return False
 
+  def pixelDeselect(self):
+    """Call this when all measurements for a pixel are done, before the stage starts moving to the next one"""
+    with self.profiler.phase('pcb.pix_picker'):
+      self.pcb.pix_picker(self.position, 0)
+
   def pixelComplete (self):
-    """Call this when all measurements for a pixel are complete"""
-    self.pcb.pix_picker(self.position, 0)
-    m = self.f[self.position+'/'+self.pixel].create_dataset('all_measurements', data=self.m, compression="gzip")
-    for i in range(len(self.r)):
-      m.attrs[self.r[i][2]] = m.regionref[self.r[i][0]:self.r[i][1]]
-    self.f[self.position+'/'+self.pixel].create_dataset('status_list', data=self.s, compression="gzip")
+    """Call this after pixelDeselect() to save the pixel's measurements"""
+    with self.profiler.phase('hdf5 write'):
+      m = self.f[self.position+'/'+self.pixel].create_dataset('all_measurements', data=self.m, compression="gzip")
+      for i in range(len(self.r)):
+        m.attrs[self.r[i][2]] = m.regionref[self.r[i][0]:self.r[i][1]]
+      self.f[self.position+'/'+self.pixel].create_dataset('status_list', data=self.s, compression="gzip")
+      self.f.flush()
+    self.clock.sample()  # keeps the clock mapping fresh over long runs
+    self.checkpoint['completed'].append(self.position + self.pixel)
+    self.writeCheckpoint()
     self.m = np.array([], dtype=self.measurement_datatype)  # reset measurement storage
     self.s = np.array([], dtype=self.status_datatype)  # reset status storage
     self.r = np.array([], dtype=self.roi_datatype)  # reset region of interest
@@ -361,17 +811,9 @@ class fabric:
   def registerMeasurements(self, measurements, description):
     """adds an array of measurements to the master list and creates an ROI for them
     takes new measurement numpy array and description of them"""
-    roi = {}
-    roi['v'] = [float(e[0]) for e in measurements]
-    roi['i'] = [float(e[1]) for e in measurements]
-    roi['t'] = [float(e[2]) for e in measurements]
-    roi['s'] = [float(e[3]) for e in measurements]
-    roi['message'] =  description
-    roi['area'] =  self.area
-    try:
-      self.update_gui(roi)  # send the new region of interest data to the GUI
-    except:
-      pass  # probably no gui server to send data to, NBD
+    if self.gui_publisher is not None:
+      with self.profiler.phase('update_gui'):
+        self.gui_publisher.publish(measurements, description, self.area, substrate=self.position, pixel=self.pixel)
     self.m = np.append(self.m, measurements)
     length = len(measurements)
     if length > 0:
@@ -383,17 +825,45 @@ class fabric:
     else:
       print("WARNING: Non-positive ROI length")
 
-  def steadyState(self, t_dwell=10, NPLC=10, sourceVoltage=True, compliance=0.04, setPoint=0, senseRange='f'):
+  def liveFeed(self, description):
+    """
+    returns a callback for measureUntil or the MPPT that sends the measurements it's given to the GUI
+    in chunks, at most live_rate times a second, as the live trace of the ROI that will be registered as description
+    returns None when there's nothing to send to
+    """
+    if (self.gui_publisher is None) or (self.live_rate <= 0):
+      return None
+    chunk = []
+    last_sent = [time.time()]
+
+    def cb(measurement):
+      chunk.append(tuple(measurement))
+      now = time.time()
+      if now - last_sent[0] >= 1 / self.live_rate:
+        last_sent[0] = now
+        self.gui_publisher.publish(np.array(chunk, dtype=self.measurement_datatype), description, self.area, live=True, substrate=self.position, pixel=self.pixel)
+        chunk.clear()
+
+    return cb
+
+  def steadyState(self, t_dwell=10, NPLC=10, sourceVoltage=True, compliance=0.04, setPoint=0, senseRange='f', live=None):
     """ makes steady state measurements for t_dwell seconds
     set NPLC to -1 to leave it unchanged
+    live is the description the measurements will be registered with, to show them in the GUI as they're made
     returns array of measurements
     """
     self.insertStatus('Measuring steady state {:s} at {:.0f} m{:s}'.format('current' if sourceVoltage else 'voltage', setPoint*1000, 'V' if sourceVoltage else 'A'))
     if NPLC != -1:
       self.sm.setNPLC(NPLC)
-    self.sm.setupDC(sourceVoltage=sourceVoltage, compliance=compliance, setPoint=setPoint, senseRange=senseRange)
-    self.sm.write(':arm:source immediate') # this sets up the trigger/reading method we'll use below
-    q = self.sm.measureUntil(t_dwell=t_dwell)
+    with self.profiler.phase('setupDC'):
+      self.sm.setupDC(sourceVoltage=sourceVoltage, compliance=compliance, setPoint=setPoint, senseRange=senseRange)
+      self.sm.write(':arm:source immediate') # this sets up the trigger/reading method we'll use below
+    cb = None if live is None else self.liveFeed(live)
+    with self.profiler.phase('dwell'):
+      if cb is None:
+        q = self.sm.measureUntil(t_dwell=t_dwell)
+      else:
+        q = self.sm.measureUntil(t_dwell=t_dwell, cb=cb)
     qa = np.array([tuple(s) for s in q], dtype=self.measurement_datatype)
     return qa
 
@@ -401,15 +871,17 @@ class fabric:
     """ make a series of measurements while sweeping the sourcemeter along linearly progressing voltage or current setpoints
     """
 
-    self.sm.setNPLC(NPLC)
-    self.sm.setupSweep(sourceVoltage=sourceVoltage, compliance=compliance, nPoints=nPoints, stepDelay=stepDelay, start=start, end=end, senseRange=senseRange)
+    with self.profiler.phase('setupSweep'):
+      self.sm.setNPLC(NPLC)
+      self.sm.setupSweep(sourceVoltage=sourceVoltage, compliance=compliance, nPoints=nPoints, stepDelay=stepDelay, start=start, end=end, senseRange=senseRange)
 
     if message == None:
       word ='current' if sourceVoltage else 'voltage'
       abv = 'V' if sourceVoltage else 'A'
       message = 'Sweeping {:s} from {:.0f} m{:s} to {:.0f} m{:s}'.format(word, start, abv, end, abv)
     self.insertStatus(message)
-    raw = self.sm.measure()
+    with self.profiler.phase('sweep'):
+      raw = self.sm.measure()
     sweepValues = np.array(list(zip(*[iter(raw)]*4)), dtype=self.measurement_datatype)
 
     return sweepValues
@@ -418,8 +890,8 @@ class fabric:
     if message == None:
       message = 'Tracking maximum power point for {:} seconds'.format(duration)
     self.insertStatus(message)
-    raw = self.mppt.launch_tracker(duration=duration, NPLC=NPLC, extra=extra)
-    # raw = self.mppt.launch_tracker(duration=duration, callback=fabric.mpptCB, NPLC=NPLC)
+    with self.profiler.phase('mppt'):
+      raw = self.mppt.launch_tracker(duration=duration, callback=self.liveFeed('MPPT'), NPLC=NPLC, extra=extra)
     qa = np.array([tuple(s) for s in raw], dtype=self.measurement_datatype)
     self.registerMeasurements(qa, 'MPPT')
     
@@ -429,10 +901,3 @@ class fabric:
       self.f[self.position+'/'+self.pixel].attrs['Impp'] = self.mppt.Impp
     if (self.mppt.Impp != None) and (self.mppt.Vmpp != None):
       self.f[self.position+'/'+self.pixel].attrs['ssPmax'] = abs(self.mppt.Impp * self.mppt.Vmpp)
-
-  def mpptCB(measurement):
-    """Callback function for max power point tracker
-    (for live tracking)
-    """
-    [v, i, t, status] = measurement
-    print('At {:.6f}\t{:.6f}\t{:.6f}\t{:d}'.format(t, v, i, int(status)))
@@ -0,0 +1,171 @@
+import threading
+import time
+from collections import deque
+
+import mutovis_control as mc
+
+class gui_publisher:
+  """
+  sends ROIs to the GUI from a background thread so that measuring never waits on visualization
+  ROIs wait in a bounded queue, when it's full either the oldest queued ROI is dropped (policy='drop-oldest')
+  or a new live chunk is merged into the newest queued chunk of the same ROI (policy='coalesce', falling back to dropping the oldest)
+  live chunks (pieces of an ROI that's still being measured) are dropped before whole ROIs, whole ROIs are never merged
+  everything is tagged with topic (rig and run names) and, for ROIs, the substrate and pixel, so a hub can route it to dashboards
+  run events only go over the binary stream, the XML-RPC GUI doesn't take them
+  the binary roi_stream is tried first and XML-RPC drop() second, if both fail the ROI is retried after reconnect_interval seconds
+  """
+  policies = ('drop-oldest', 'coalesce')
+
+  def __init__(self, stream_address=None, xmlrpc_address=None, max_queue=64, policy='drop-oldest', reconnect_interval=2.0):
+    """
+    stream_address is tcp://host:port or unix:///path of the GUI's binary stream server (None to not use it)
+    xmlrpc_address is the http://host:port of the GUI's XML-RPC server (None to not use it)
+    """
+    if policy not in self.policies:
+      raise ValueError("Unknown GUI drop policy {:}, use one of {:}".format(policy, self.policies))
+    self.stream = None if stream_address is None else mc.roi_stream(stream_address)
+    self.xmlrpc_address = xmlrpc_address
+    self.proxy = None
+    self.max_queue = max_queue
+    self.policy = policy
+    self.reconnect_interval = reconnect_interval
+
+    self.topic = {}  # rig and run names
+    self.queue = deque()  # of [measurements, description, area, live, topic], measurements is None for run events
+    self.cond = threading.Condition()
+    self.stopping = False
+    self.connected = None  # None until the first send attempt, then whether the last one worked
+    self.thread = None
+
+    # counters
+    self.published = 0
+    self.sent = 0
+    self.dropped = 0
+    self.coalesced = 0
+    self.failures = 0
+
+  def start(self):
+    self.stopping = False
+    self.thread = threading.Thread(target=self.run, name='gui_publisher', daemon=True)
+    self.thread.start()
+
+  def stop(self, timeout=2.0):
+    """stops the publisher, giving it up to timeout seconds to send what's queued"""
+    deadline = time.time() + timeout
+    with self.cond:
+      while (len(self.queue) > 0) and (self.connected != False) and (time.time() < deadline):
+        self.cond.wait(max(0, deadline - time.time()))
+      self.stopping = True
+      self.cond.notify_all()
+    if self.thread is not None:
+      self.thread.join(timeout=max(0, deadline - time.time()) + self.reconnect_interval)
+      self.thread = None
+    if self.stream is not None:
+      self.stream.close()
+
+  def publish(self, measurements, description, area, live=False, substrate=None, pixel=None):
+    """
+    queues an ROI (a measurement_datatype array) for the GUI, never blocks on the GUI
+    live=True marks a chunk of new samples from an ROI that's still being measured
+    """
+    topic = dict(self.topic)
+    if substrate is not None:
+      topic['substrate'] = substrate
+    if pixel is not None:
+      topic['pixel'] = pixel
+    self.enqueue([measurements, description, area, live, topic])
+
+  def event(self, event):
+    """queues a run event (eg. 'run_start'), never blocks on the GUI"""
+    self.enqueue([None, event, None, False, dict(self.topic)])
+
+  def enqueue(self, item):
+    measurements, description, area, live, topic = item
+    with self.cond:
+      self.published += 1
+      if len(self.queue) >= self.max_queue:
+        if (self.policy == 'coalesce') and (measurements is not None) and live:
+          import numpy as np  # not at the top, the cli imports this module before it needs numpy
+          for queued in reversed(self.queue):  # live chunks of the same ROI have the same description, area and topic (pixel included)
+            if (queued[0] is not None) and (queued[1:] == item[1:]):
+              queued[0] = np.concatenate((queued[0], measurements))
+              self.coalesced += 1
+              return
+        victim = 0
+        for index, queued in enumerate(self.queue):
+          if queued[3]:
+            victim = index  # the oldest live chunk
+            break
+        del self.queue[victim]
+        self.dropped += 1
+      self.queue.append(item)
+      self.cond.notify_all()
+
+  def run(self):
+    while True:
+      with self.cond:
+        while (len(self.queue) == 0) and not self.stopping:
+          self.cond.wait()
+        if self.stopping:
+          return
+        item = self.queue.popleft()
+      if self.send(*item):
+        with self.cond:
+          self.sent += 1
+          self.cond.notify_all()
+      else:
+        with self.cond:
+          if len(self.queue) < self.max_queue:
+            self.queue.appendleft(item)  # retry it first
+          else:
+            self.dropped += 1
+          self.cond.notify_all()  # let stop() know we're not getting through
+          self.cond.wait(self.reconnect_interval)
+
+  def send(self, measurements, description, area, live, topic):
+    """tries to send one ROI or run event, returns True on success"""
+    error = None
+    if self.stream is not None:
+      try:
+        if measurements is None:
+          self.stream.sendEvent(description, topic=topic)
+        else:
+          self.stream.send(measurements, description, area, live=live, topic=topic)
+        return self.sendWorked()
+      except OSError as e:
+        error = e
+    if measurements is None:
+      if self.xmlrpc_address is not None:
+        return True  # nowhere to send run events
+    elif self.xmlrpc_address is not None:
+      import xmlrpc.client  # only when there's no binary stream to use
+      roi = {}
+      roi['v'] = measurements['voltage'].tolist()
+      roi['i'] = measurements['current'].tolist()
+      roi['t'] = measurements['time'].tolist()
+      roi['s'] = measurements['status'].astype(float).tolist()
+      roi['message'] = description
+      roi['area'] = area
+      roi['live'] = live
+      try:
+        if self.proxy is None:
+          self.proxy = xmlrpc.client.ServerProxy(self.xmlrpc_address)
+        self.proxy.drop(roi)
+        return self.sendWorked()
+      except (OSError, xmlrpc.client.Error) as e:
+        self.proxy = None
+        error = e
+    self.failures += 1
+    if self.connected != False:  # only complain once per outage
+      print("WARNING: Can't reach the GUI ({:}), will keep trying in the background".format(error))
+    self.connected = False
+    return False
+
+  def sendWorked(self):
+    if self.connected == False:
+      print("Reconnected to the GUI")
+    self.connected = True
+    return True
+
+  def printSummary(self):
+    print("GUI publishing: {:d} ROIs published, {:d} sent, {:d} dropped, {:d} coalesced, {:d} failed sends, {:d} still queued".format(self.published, self.sent, self.dropped, self.coalesced, self.failures, len(self.queue)))
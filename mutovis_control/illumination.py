@@ -1,5 +1,3 @@
-from mutovis_control.wavelabs import wavelabs
-from mutovis_control.newport import Newport
 import os
 
 class illumination:
@@ -24,9 +22,12 @@ class illumination:
       addr_split = address.split(sep='://', maxsplit=1)
       protocol = addr_split[0]
 
+    # drivers are imported only when they're used, the Newport one needs pyftdi
     if protocol.lower().startswith('wavelabs'):
+      from mutovis_control.wavelabs import wavelabs
       self.light_engine = wavelabs(address=address)
     elif protocol.lower() == ('ftdi'):
+      from mutovis_control.newport import Newport
       self.light_engine = Newport(address=address)
       
   def connect(self):
@@ -46,4 +47,22 @@ class illumination:
     turns light off
     """
     self.light_engine.off()
-      
\ No newline at end of file
+
+  def getIntensity(self):
+    """
+    returns the light source's intensity setting [%]
+    """
+    if not hasattr(self.light_engine, 'getRecipeParam'):
+      raise ValueError("Light source does not support setting its intensity")
+    value = self.light_engine.getRecipeParam(param='Intensity')
+    if value is None:
+      raise ValueError("Could not read the light source's intensity setting")
+    return float(value)
+
+  def setIntensity(self, value):
+    """
+    changes the light source's intensity setting [%], takes effect the next time the light is turned on
+    """
+    if not hasattr(self.light_engine, 'setRecipeParam'):
+      raise ValueError("Light source does not support setting its intensity")
+    self.light_engine.setRecipeParam(param='Intensity', value=value)
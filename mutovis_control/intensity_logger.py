@@ -0,0 +1,74 @@
+import numpy as np
+import threading
+import time
+
+class intensity_logger:
+  """
+  samples the PCB's intensity photodiodes (and optionally other ADC channels) in a background thread
+  so that light intensity drift during a run can be corrected for afterwards
+  the pcb's connection is shared safely with pixel switching because pcb holds its lock for every exchange
+  """
+  def __init__(self, pcb, rate=1.0, adc_channels=[]):
+    """
+    rate is the number of samples per second
+    adc_channels is a list of extra ADC channel numbers to sample along with the photodiodes
+    """
+    self.pcb = pcb
+    self.rate = rate
+    self.adc_channels = list(adc_channels)
+    self.cmds = ['p1', 'p2'] + ['ADC{:d}'.format(chan) for chan in self.adc_channels]
+
+    # this is the datatype for the intensity samples in the h5py file
+    names = ['time', 'diode_1', 'diode_2'] + ['adc_{:d}'.format(chan) for chan in self.adc_channels]
+    titles = ['Time [s]', 'Diode 1 [ADC counts]', 'Diode 2 [ADC counts]'] + ['AIN{:d} [ADC counts]'.format(chan) for chan in self.adc_channels]
+    self.sample_datatype = np.dtype({'names': names, 'formats': ['f8'] + ['i4']*(len(names)-1), 'titles': titles})
+
+    self.samples = []
+    self.n_errors = 0
+    self.stopping = threading.Event()
+    self.thread = None
+
+  def start(self):
+    self.stopping.clear()
+    self.thread = threading.Thread(target=self.run, name='intensity_logger', daemon=True)
+    self.thread.start()
+    print('Logging light intensity {:g} times per second'.format(self.rate))
+
+  def stop(self):
+    self.stopping.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def run(self):
+    period = 1 / self.rate
+    next_t = time.time()
+    while not self.stopping.is_set():
+      t = time.time()
+      try:
+        values = self.pcb.getMany(self.cmds)
+        self.samples.append(tuple([t] + [int(v) for v in values]))
+      except Exception as e:
+        if self.n_errors == 0:
+          print('WARNING: Intensity logging failed: {:}'.format(e))
+        self.n_errors += 1
+      next_t = next_t + period
+      self.stopping.wait(max(0, next_t - time.time()))
+
+  def store(self, f, diode_cal=None):
+    """
+    writes the samples collected so far into an h5py file or group
+    the suns intensity for each sample is diode counts / diode calibration counts
+    """
+    name = 'intensity_log'
+    n = 1
+    while name in f:  # don't clobber the log from an earlier session of a resumed run
+      name = 'intensity_log_{:d}'.format(n)
+      n += 1
+    d = f.create_dataset(name, data=np.array(self.samples, dtype=self.sample_datatype), compression="gzip")
+    d.attrs['Rate [Hz]'] = self.rate
+    d.attrs['Errors'] = self.n_errors
+    if (type(diode_cal) == list) or (type(diode_cal) == tuple):
+      d.attrs['Diode 1 calibration [ADC counts]'] = diode_cal[0]
+      d.attrs['Diode 2 calibration [ADC counts]'] = diode_cal[1]
+    print('Stored {:d} intensity samples'.format(len(self.samples)))
@@ -0,0 +1,123 @@
+import numpy as np
+import time
+import bisect
+import threading
+
+class iostats:
+  """
+  latency histograms for instrument comms, keyed by command verb
+  """
+  # histogram bin edges [s], log spaced by factors of two from 10 us up to ~3 minutes
+  edges = [10e-6 * 2**k for k in range(25)]
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    """forget everything recorded so far"""
+    with self.lock:
+      self.hists = {}  # key: [bin counts, n, total, min, max]
+
+  def record(self, key, seconds):
+    """adds one latency measurement for key"""
+    b = bisect.bisect_right(self.edges, seconds)  # 0 is underflow, len(edges) is overflow
+    with self.lock:
+      h = self.hists.get(key)
+      if h is None:
+        h = [[0]*(len(self.edges)+1), 0, 0.0, seconds, seconds]
+        self.hists[key] = h
+      h[0][b] += 1
+      h[1] += 1
+      h[2] += seconds
+      if seconds < h[3]:
+        h[3] = seconds
+      if seconds > h[4]:
+        h[4] = seconds
+
+  def percentile(self, key, p):
+    """estimates the p-th percentile latency for key from its histogram (upper bin edge)"""
+    counts, n, total, lo, hi = self.hists[key]
+    target = n * p / 100
+    running = 0
+    for b, c in enumerate(counts):
+      running += c
+      if running >= target:
+        if b >= len(self.edges):
+          return hi
+        return min(self.edges[b], hi)
+    return hi
+
+  def printSummary(self, title='Comms latency'):
+    print('{:s}:'.format(title))
+    print('{:>24s}\t{:>6s}\t{:>10s}\t{:>10s}\t{:>10s}\t{:>10s}'.format('command', 'count', 'mean [ms]', 'p50 [ms]', 'p99 [ms]', 'max [ms]'))
+    with self.lock:
+      keys = sorted(self.hists.keys(), key=lambda k: self.hists[k][2], reverse=True)
+      for key in keys:
+        counts, n, total, lo, hi = self.hists[key]
+        print('{:>24s}\t{:6d}\t{:10.3f}\t{:10.3f}\t{:10.3f}\t{:10.3f}'.format(key, n, total/n*1000, self.percentile(key, 50)*1000, self.percentile(key, 99)*1000, hi*1000))
+
+  def store(self, group):
+    """
+    writes the histograms into an h5py group, one dataset of bin counts per command
+    bin i counts latencies between edges[i-1] and edges[i], the first and last bins are under/overflow
+    """
+    group.attrs['Bin edges [s]'] = np.array(self.edges)
+    with self.lock:
+      for key, (counts, n, total, lo, hi) in self.hists.items():
+        d = group.create_dataset(key.replace('/', '|'), data=np.array(counts, dtype='u4'))
+        d.attrs['Command'] = np.bytes_(key)
+        d.attrs['Count'] = n
+        d.attrs['Total [s]'] = total
+        d.attrs['Min [s]'] = lo
+        d.attrs['Max [s]'] = hi
+
+  def scpiVerb(cmd):
+    """':source:voltage 0.1' --> ':source:voltage'"""
+    return cmd.strip().split(' ', 1)[0].lower()
+
+  def pcbVerb(cmd):
+    """'sA3' --> 's<sub><pix>', 'cB' --> 'c<sub>', 'ADC2' --> 'ADC'"""
+    cmd = cmd.strip()
+    if cmd.startswith('ADC'):
+      return 'ADC'
+    elif cmd.startswith('s') and len(cmd) == 3:
+      return 's<sub><pix>'
+    elif cmd[:1] in ('c', 'd') and len(cmd) == 2:
+      return cmd[0] + '<sub>'
+    elif cmd.startswith('p'):
+      return 'p<n>'
+    return cmd
+
+  def wrap(self, target, methods, verb=scpiVerb):
+    """
+    returns a proxy for target (eg. a pyvisa resource) that records the latency of calls to the named methods
+    the key is verb(first argument) or the method name for calls without arguments
+    """
+    return iostats.timed_proxy(target, self, methods, verb)
+
+  class timed_proxy:
+    """forwards everything to its target, timing calls to some of its methods"""
+    def __init__(self, target, stats, methods, verb):
+      self.__dict__['_target'] = target
+      self.__dict__['_stats'] = stats
+      self.__dict__['_methods'] = methods
+      self.__dict__['_verb'] = verb
+
+    def __getattr__(self, name):
+      attr = getattr(self._target, name)
+      if name in self._methods:
+        stats = self._stats
+        verb = self._verb
+        def timed(*args, **kwargs):
+          t = time.perf_counter()
+          try:
+            return attr(*args, **kwargs)
+          finally:
+            key = verb(args[0]) if (len(args) > 0 and type(args[0]) == str) else name
+            stats.record(key, time.perf_counter() - t)
+        return timed
+      return attr
+
+    def __setattr__(self, name, value):
+      setattr(self._target, name, value)
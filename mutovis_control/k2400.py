@@ -5,6 +5,7 @@ from collections import deque
 import visa
 import warnings
 import os
+from mutovis_control.iostats import iostats
 
 class k2400:
   """
@@ -13,8 +14,10 @@ class k2400:
   idnContains = 'KEITHLEY'
   quiet=False
   idn = ''
+  stats = None  # optional iostats object for recording command latencies
+  timed_methods = ['write', 'query', 'query_ascii_values', 'query_binary_values', 'read_binary_values', 'assert_trigger']
 
-  def __init__(self, visa_lib='@py', scan=False, addressString=None, terminator='\n', serialBaud=57600, front=False, twoWire=False, quiet=False):
+  def __init__(self, visa_lib='@py', scan=False, addressString=None, terminator='\n', serialBaud=57600, front=False, twoWire=False, quiet=False, stats=None):
     self.quiet = quiet
     self.readyForAction = False
     self.rm = self._getResourceManager(visa_lib)
@@ -26,6 +29,9 @@ class k2400:
     self.terminator = terminator
     self.serialBaud = serialBaud     
     self.sm = self._getSourceMeter(self.rm)
+    if stats is not None:
+      self.stats = stats
+      self.sm = stats.wrap(self.sm, self.timed_methods, iostats.scpiVerb)
     self._setupSourcemeter(front=front, twoWire=twoWire)
 
   def __del__(self):
@@ -302,6 +308,11 @@ class k2400:
 
     sm.write(':system:azero once')
 
+  def getTime(self):
+    """returns the instrument's clock reading, the timebase for the time element of measurements [s]
+    """
+    return float(self.sm.query(':system:time?'))
+
   def opc(self):
     """returns when all operations are complete
     """
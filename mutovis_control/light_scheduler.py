@@ -0,0 +1,112 @@
+class light_scheduler:
+  """
+  orders the steps of a measurement plan so that steps needing the same light state are done together
+  switching the light (eg. a WaveLabs StartRecipe/CancelRecipe cycle) takes seconds, so each switch is charged as a cost
+  along with any time spent waiting for a step's light soak requirement to be met
+  """
+  class step:
+    def __init__(self, name, light, action, duration, soak, after):
+      self.name = name
+      self.light = light  # True: needs light, False: needs dark, None: doesn't care
+      self.action = action  # called with no arguments to carry out the step
+      self.duration = duration  # [s] estimate of how long the step takes
+      self.soak = soak  # [s] the light must have been on for this long before the step starts
+      self.after = list(after)  # names of steps that must be done before this one
+
+    def __repr__(self):
+      return "step({:}, light={:})".format(self.name, self.light)
+
+  def __init__(self, on_cost=3.0, off_cost=1.0):
+    """
+    on_cost and off_cost [s] are how long turning the light on and off take
+    """
+    self.on_cost = on_cost
+    self.off_cost = off_cost
+    self.steps = []
+
+  def add(self, name, light, action=None, duration=0, soak=0, after=[]):
+    """adds a step to the plan, steps are done in the order they're added unless reordering saves time"""
+    self.steps.append(light_scheduler.step(name, light, action, duration, soak, after))
+    return name
+
+  def advance(self, state, s):
+    """
+    returns (cost, new state) for doing step s from state
+    state is (light on, how long it's been on for)
+    """
+    on, lit = state
+    cost = 0
+    if (s.light is not None) and (s.light != on):
+      if s.light:
+        cost += self.on_cost
+        lit = 0
+      else:
+        cost += self.off_cost
+      on = s.light
+    if on:
+      wait = max(0, s.soak - lit) if s.light else 0
+      cost += wait
+      lit = lit + wait + s.duration
+    return (cost, (on, lit))
+
+  def cost(self, order, light_on=False):
+    """returns the switching and soak waiting time [s] it costs to do the steps in order, starting from light_on"""
+    state = (light_on, 0)
+    total = 0
+    for s in order:
+      c, state = self.advance(state, s)
+      total += c
+    return total
+
+  def plan(self, light_on=False):
+    """
+    returns the steps ordered to keep the cost low, starting with the light on if light_on
+    while any step whose dependencies are done can use the present light state, one of those is done next
+    (the one with the least soak waiting), otherwise the light is switched
+    the order the steps were added in is used instead if that turns out to be cheaper
+    """
+    names = [s.name for s in self.steps]
+    for s in self.steps:
+      for dep in s.after:
+        if dep not in names:
+          raise ValueError("Step {:} depends on unknown step {:}".format(s.name, dep))
+    done = set()
+    todo = list(self.steps)
+    order = []
+    state = (light_on, 0)
+    while len(todo) > 0:
+      ready = [s for s in todo if all(dep in done for dep in s.after)]
+      if len(ready) == 0:
+        raise ValueError("Circular dependencies between steps {:}".format([s.name for s in todo]))
+      same = [s for s in ready if (s.light is None) or (s.light == state[0])]
+      if len(same) > 0:
+        ready = same
+      best = min(ready, key=lambda s: self.advance(state, s)[0])  # min() keeps the earliest of equal cost steps
+      c, state = self.advance(state, best)
+      order.append(best)
+      done.add(best.name)
+      todo.remove(best)
+    if self.cost(self.steps, light_on=light_on) <= self.cost(order, light_on=light_on):
+      order = list(self.steps)
+    return order
+
+  def toggles(self, order, light_on=False):
+    """returns the number of times the light gets switched doing the steps in order"""
+    n = 0
+    on = light_on
+    for s in order:
+      if (s.light is not None) and (s.light != on):
+        n += 1
+        on = s.light
+    return n
+
+  def run(self, set_light, light_on=False):
+    """
+    does the planned steps, set_light(on, soak) is called before each one to get the light into the right state
+    """
+    order = self.plan(light_on=light_on)
+    print('Light schedule: {:d} steps with {:d} light switches, {:.1f} s of switching and soaking (vs. {:.1f} s in the given order)'.format(len(order), self.toggles(order, light_on), self.cost(order, light_on), self.cost(self.steps, light_on)))
+    for s in order:
+      set_light(s.light, s.soak)
+      if s.action is not None:
+        s.action()
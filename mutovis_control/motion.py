@@ -1,4 +1,5 @@
-from mutovis_control.afms import afms
+import concurrent.futures
+import os
 
 class motion:
   """
@@ -10,14 +11,32 @@ class motion:
   substrate_centers = [160, 140, 120, 100, 80, 60, 40, 20]  # mm from home to the centers of A, B, C, D, E, F, G, H substrates
   photodiode_location = 180  # mm  
 
-  def __init__(self, address=''):
+  def __init__(self, address='', state_file=None, rehome_interval=0, always_home=False):
     """
     sets up communication to motion controller
+    state_file is where the controller may remember the stage position between sessions to avoid homing on connect
+    rehome_interval [s] is how often to re-reference the position during long runs, 0 for never
+    env://VARIABLE reads the address from the environment variable VARIABLE
     """
-    if address.startswith('afms'):
-      self.motion_engine = afms(address=address)
-      self.substrate_centers = self.motion_engine.substrate_centers
-      self.photodiode_location = self.motion_engine.photodiode_location
+    addr_split = address.split(sep='://', maxsplit=1)
+    protocol = addr_split[0].lower()
+    if protocol == 'env':
+      env_var = addr_split[1]
+      if env_var in os.environ:
+        address = os.environ.get(env_var)
+      else:
+        raise ValueError("Environment Variable {:} could not be found".format(env_var))
+      protocol = address.split('://')[0].lower()
+    if protocol == 'afms':
+      from mutovis_control.afms import afms  # only import drivers (and pyserial) when they're used
+      self.motion_engine = afms(address=address, state_file=state_file, rehome_interval=rehome_interval, always_home=always_home)
+    else:
+      raise ValueError("Unknown motion controller protocol in address {:}".format(address))
+    self.substrate_centers = self.motion_engine.substrate_centers
+    self.photodiode_location = self.motion_engine.photodiode_location
+
+    # moves are carried out one at a time, in order, by this worker so that other work can go on while the stage moves
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='motion')
       
   def connect(self):
     """
@@ -29,16 +48,34 @@ class motion:
     """
     moves mm mm direction, blocking, returns 0 on successful movement
     """
-    return self.motion_engine.move(mm)
+    return self.move_async(mm).result()
     
   def goto(self, step_value):
     """
     goes to an absolute mm position, blocking, reuturns 0 on success
     """
-    return self.motion_engine.goto(step_value)
+    return self.goto_async(step_value).result()
+
+  def move_async(self, mm):
+    """
+    starts moving mm mm, returns a concurrent.futures.Future whose result() waits for the move and gives its return value
+    """
+    return self.executor.submit(self.motion_engine.move, mm)
+
+  def goto_async(self, step_value):
+    """
+    starts going to an absolute mm position, returns a concurrent.futures.Future whose result() waits for arrival and gives the return value
+    """
+    return self.executor.submit(self.motion_engine.goto, step_value)
     
+  def move_time(self, mm):
+    """
+    predicted time [s] a move of mm mm takes, including settling
+    """
+    return self.motion_engine.move_time(mm)
+
   def home(self, direction):
     """
     homes to a limit switch, blocking, reuturns 0 on success
     """
-    return self.motion_engine.home()
+    return self.executor.submit(self.motion_engine.home).result()
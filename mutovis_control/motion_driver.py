@@ -0,0 +1,56 @@
+import math
+
+class motion_driver:
+  """
+  the interface motion controller drivers implement (see afms)
+  positions are absolute, in mm from the home limit switch
+  the stage geometry and kinematic limits are declared here so that move times can be predicted
+  """
+  protocol = None
+
+  # mm from home to the centers of A, B, C, D, E, F, G, H substrates
+  substrate_centers = [160, 140, 120, 100, 80, 60, 40, 20]
+  photodiode_location = 180  # mm
+
+  # software reject movements that would put us outside these limits
+  minimum_position = 0  # mm
+  maximum_position = 180  # mm
+
+  velocity = 10.0  # [mm/s] top speed
+  acceleration = 50.0  # [mm/s^2] to and from top speed
+  settle = 0.1  # [s] to wait after arriving before the stage is still enough to measure
+
+  current_position = 0  # mm
+
+  def connect(self):
+    """opens the connection to the controller, might home, returns 0 on success"""
+    raise NotImplementedError
+
+  def home(self):
+    """homes to the limit switch, returns 0 on success"""
+    raise NotImplementedError
+
+  def move(self, mm):
+    """moves mm mm (negative for towards home), blocks until movement complete, returns 0 on success"""
+    raise NotImplementedError
+
+  def goto(self, new_position):
+    """goes to an absolute mm position, blocks until movement complete, returns 0 on success"""
+    return self.move(new_position - self.current_position)
+
+  def close(self):
+    pass
+
+  def move_time(self, mm):
+    """
+    predicted time [s] a move of mm mm takes including settling, from a trapezoidal velocity profile
+    (triangular for moves too short to reach top speed)
+    """
+    d = abs(mm)
+    if d == 0:
+      return 0
+    if d < self.velocity**2 / self.acceleration:
+      t = 2 * math.sqrt(d / self.acceleration)
+    else:
+      t = d / self.velocity + self.velocity / self.acceleration
+    return t + self.settle
@@ -13,6 +13,7 @@ class mppt:
   
   currentCompliance = None
   t0 = None  # the time we started the mppt algorithm
+  callback = None  # called with every measurement the tracker makes, see launch_tracker
   
   def __init__(self, sm):
     self.sm = sm
@@ -49,6 +50,7 @@ class mppt:
       print("WARNING: Not doing power point tracking. Voc not known.")
       return []
     self.t0 = time.time()  # start the mppt timer
+    self.callback = callback
 
     if self.Vmpp == None:
       self.Vmpp = 0.7 * self.Voc # start at 70% of Voc if nobody told us otherwise
@@ -71,7 +73,10 @@ class mppt:
     else:
       initial_soak = 10
     print("Soaking @ Mpp (V={:0.2f}[mV]) for {:0.1f} seconds...".format(self.Vmpp*1000, initial_soak))
-    q = self.sm.measureUntil(t_dwell=initial_soak)
+    if callback != None:
+      q = self.sm.measureUntil(t_dwell=initial_soak, cb=callback)
+    else:
+      q = self.sm.measureUntil(t_dwell=initial_soak)
     self.Impp = q[-1][1]  # use most recent current measurement as Impp
     if self.current_compliance == None:
       self.current_compliance = abs(self.Impp * 2)
@@ -101,6 +106,7 @@ class mppt:
       print('WARNING: MPPT algorithm {:} not understood, not doing max power point tracking'.format(algo))
     
     q.extend(pptv)
+    self.callback = None
     run_time = time.time() - self.t0
     print('Final value seen by the max power point tracker after running for {:.1f} seconds is'.format(run_time))
     print('{:0.4f} mW @ {:0.2f} mV and {:0.2f} mA'.format(self.Vmpp*self.Impp*1000*-1, self.Vmpp*1000, self.Impp*1000))    
@@ -157,6 +163,8 @@ class mppt:
     #  self.sm.outOn(False)
     #  print("WARNING: Stopping max power point tracking because the MPPT algorithm wandered out of the power quadrant")
     self.q.append(measurement)
+    if self.callback != None:
+      self.callback(measurement)
     return v, i, abort
 
   def really_dumb_tracker(self, duration, callback = None, dAngleMax = 7, dwell_time = 10):
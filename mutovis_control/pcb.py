@@ -1,5 +1,10 @@
 import socket
 import os
+import time
+import json
+import threading
+from mutovis_control.iostats import iostats
+import mutovis_control as mc
 
 class pcb:
   """
@@ -8,11 +13,22 @@ class pcb:
   write_terminator = '\r'
   read_terminator = b'\r\n'
   prompt = '>>> '
+  recv_size = 4096  # max bytes to pull off the socket at once
   substrateList = 'HGFEDCBA'  # all the possible substrates
   substratesConnected = ''  # the ones we've detected
   adapters = []  # list of tuples of adapter boards: (substrate_letter, resistor_value)
+  stats = None  # optional iostats object for recording command latencies
 
-  def __init__(self, address, ignore_adapter_resistors=False):
+  def __init__(self, address, ignore_adapter_resistors=False, stats=None, topology_cache=None):
+    """
+    connects to the PCB and discovers which MUX boards and adapter boards are connected
+    topology_cache is an optional json file path, if given the discovered topology is remembered there (keyed by PCB address)
+    so that on later connections the adapter resistors we expect to find can be read in the same batch as the MUX board search,
+    they're checked against the cached values and the cache is updated when anything has changed
+    """
+    self.stats = stats
+    self.address = address
+    self.lock = threading.RLock()  # held for each command/response exchange so the connection can be shared between threads
     timeout = 10  # pcb has this many seconds to respond
     s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     ipAddress, port = address.split(':')
@@ -20,20 +36,31 @@ class pcb:
     s.settimeout(timeout)
     if os.name != 'nt':
       pcb.set_keepalive_linux(s) # let's try to keep our connection alive!
-    sf = s.makefile("rwb", buffering=0)
 
     self.s = s
-    self.sf = sf
+    self.rx = bytearray()  # receive buffer, holds bytes from the PCB we haven't parsed yet
 
-    self.write('v') # check on switch
-    answer, win = self.getResponse()
+    cached = None
+    expected = ''  # substrates we expect to find adapter boards on
+    if not ignore_adapter_resistors:
+      cached = self.loadTopology(topology_cache)
+      if cached is not None:
+        expected = ''.join(cached['resistors'].keys())
+
+    # check on switch, look for MUX boards and read the adapter resistors we expect to find all in one go
+    search = ["c" + substrate for substrate in self.substrateList]
+    reads = ['d' + substrate for substrate in expected]
+    responses = self.pipeline(['v'] + search + reads)
+    answer, win = responses[0]
 
     if not win:
       raise ValueError('Got bad response from switch')
     else:
       print('Connected to control PCB with ' + answer)
+    self.firmware = answer
 
-    substrates = self.substrateSearch()
+    substrates = self.substrateBitmask(responses[1:1+len(search)])
+    read_responses = dict(zip(expected, responses[1+len(search):]))
     resistors = {}  # dict of measured resistor values where the key is the associated substrate
 
     if substrates == 0x00:
@@ -45,14 +72,76 @@ class pcb:
         mask = 0x01 << (7-i)
         if (mask & substrates) != 0x00:
           self.substratesConnected = self.substratesConnected + substrate
-          if ignore_adapter_resistors:
-            resistors[substrate] = 0
-          else:
-            resistors[substrate] = self.get('d'+substrate)
           found = found + substrate
       print(found)
+      if ignore_adapter_resistors:
+        for substrate in self.substratesConnected:
+          resistors[substrate] = 0
+      else:
+        missing = ''
+        for substrate in self.substratesConnected:
+          if substrate in read_responses:
+            answer, ready = read_responses[substrate]
+            resistors[substrate] = self.parse('d' + substrate, answer, ready)
+          else:
+            missing = missing + substrate
+        if len(missing) > 0:  # ask for the rest of the resistor values at once
+          values = self.getMany(['d'+substrate for substrate in missing])
+          resistors.update(zip(missing, values))
+        if (cached is not None) and self.topologyMatches(cached, substrates, resistors):
+          print('Adapter boards match the cached topology')
+        else:
+          if cached is not None:
+            print('Adapter boards have changed since they were cached, updating the PCB topology cache')
+          self.saveTopology(topology_cache, substrates, resistors)
     self.resistors = resistors
 
+  def topologyKey(self):
+    return self.address
+
+  def topologyMatches(self, cached, substrates, resistors):
+    """
+    returns True if the cached topology is what we've found: same firmware, MUX boards and adapter resistors (within 10%)
+    """
+    if (cached.get('firmware') != self.firmware) or (cached['substrates'] != substrates):
+      return False
+    for substrate, value in resistors.items():
+      if (value is None) or (substrate not in cached['resistors']) or not mc.fabric.isWithinPercent(cached['resistors'][substrate], value):
+        return False
+    return True
+
+  def loadTopology(self, topology_cache):
+    """
+    returns the cached topology dict (with keys 'substrates' and 'resistors') for this PCB or None
+    """
+    ret = None
+    if (topology_cache is not None) and os.path.exists(topology_cache):
+      try:
+        with open(topology_cache, 'r') as f:
+          ret = json.load(f).get(self.topologyKey())
+      except ValueError:
+        print("WARNING: Ignoring unreadable PCB topology cache {:}".format(topology_cache))
+    return ret
+
+  def saveTopology(self, topology_cache, substrates, resistors):
+    """
+    remembers the discovered topology for this PCB
+    """
+    if topology_cache is None:
+      return
+    everything = {}
+    if os.path.exists(topology_cache):
+      try:
+        with open(topology_cache, 'r') as f:
+          everything = json.load(f)
+      except ValueError:
+        pass
+    everything[self.topologyKey()] = {'firmware': self.firmware, 'substrates': substrates, 'resistors': resistors, 'timestamp': time.time()}
+    tmp_file = topology_cache + '.tmp'
+    with open(tmp_file, 'w') as f:
+      json.dump(everything, f, indent=1)
+    os.replace(tmp_file, topology_cache)
+
   def __del__(self):
     self.disconnect_all()
     self.disconnect()
@@ -60,18 +149,19 @@ class pcb:
   def substrateSearch(self):
     """Returns bitmask of connected MUX boards
     """
-    substrates = self.substrateList
+    responses = self.pipeline(["c" + substrate for substrate in self.substrateList])
+    return self.substrateBitmask(responses)
+
+  def substrateBitmask(self, responses):
+    """Turns the responses to the cH..cA queries into a bitmask of connected MUX boards
+    """
     found = 0x00
-    win = False
-    for i in range(len(substrates)):
-      cmd = "c" + substrates[i]
-      answer, win = self.query(cmd)
+    for i, (answer, win) in enumerate(responses):
       if answer == "MUX OK":
         found |= 0x01 << (7-i)
     return found
 
   def disconnect(self):
-    self.sf.close()
     try:
       self.s.shutdown(socket.SHUT_RDWR)
     except:
@@ -84,8 +174,8 @@ class pcb:
     try:
       cmd = "s" + substrate + str(pixel)
       answer, ready = self.query(cmd)
-    except:
-      raise (ValueError, "Failure while talking to PCB")
+    except Exception as e:
+      raise ValueError("Failure while talking to PCB: {:}".format(e))
 
     if ready:
       if answer == '':
@@ -93,67 +183,94 @@ class pcb:
       else:
         print('WARNING: Got unexpected response form PCB to "{:s}": {:s}'.format(cmd, answer))
     else:
-      raise (ValueError, "Comms are out of sync with the PCB")
+      raise ValueError("Comms are out of sync with the PCB")
 
     return win
 
+  def readUntilPrompt(self):
+    """
+    returns the index of the next prompt in the receive buffer, receiving more data from the PCB until there is one
+    """
+    prompt = self.prompt.encode()
+    start = 0
+    i = self.rx.find(prompt)
+    while i < 0:
+      start = max(0, len(self.rx) - len(prompt) + 1)  # no need to search old data again
+      data = self.s.recv(self.recv_size)
+      if not data:
+        raise ConnectionError("PCB closed the connection")
+      self.rx.extend(data)
+      i = self.rx.find(prompt, start)
+    return i
+
   # returns string, bool
   # the string is the response
   # the bool tells us if the read completed successfully
   def getResponse(self):
-    sf = self.sf
+    """
+    reads one prompt terminated response out of the receive buffer
+    if the PCB sent more than one line before the prompt, the last line is the response
+    """
     line = None
     win = False
     try:
-      line = sf.readline()
-      if line.endswith(self.read_terminator):
-        line = line[:-len(self.read_terminator)].decode() # strip off the terminator and decode
+      i = self.readUntilPrompt()
+      chunk = bytes(self.rx[:i])
+      del self.rx[:i+len(self.prompt)]
+      if chunk.endswith(self.read_terminator):
+        line = chunk[:-len(self.read_terminator)].split(self.read_terminator)[-1].decode() # strip off the terminator and decode
+        win = True
       else:
         print("WARNING: Didn't find expected terminator during read")
-      maybePrompt = sf.read(1) + sf.read(1) + sf.read(1) + sf.read(1)  # a prompt has length 4
-      if maybePrompt.decode() == self.prompt:
-        win = True
-      else: # it's not the prompt, so let's finish the line
-        theRest = sf.readline()
-        line = maybePrompt + theRest
-        if line.endswith(self.read_terminator):
-          line = line[:-len(self.read_terminator)].decode() # strip off the terminator and decode
-          maybePrompt = sf.read(1) +  sf.read(1) + sf.read(1) + sf.read(1)  # a prompt has length 4
-          if maybePrompt.decode() == self.prompt:
-            win = True
-          else:
-            print("WARNING: Expected this to be a prompt:")
-            print(maybePrompt)
-        else:
-          print("WARNING: Didn't find expected terminator during read")
-
+        print(chunk)
     except:
       pass
     return line, win
 
   def write(self, cmd):
-    sf = self.sf
     if not cmd.endswith(self.write_terminator):
       cmd = cmd + self.write_terminator
 
-    sf.write(cmd.encode())
-    sf.flush()
+    self.s.sendall(cmd.encode())
 
   def query(self, query):
-    self.write(query)
-    return self.getResponse()
+    with self.lock:
+      if self.stats is None:
+        self.write(query)
+        return self.getResponse()
+      t = time.perf_counter()
+      self.write(query)
+      ret = self.getResponse()
+    self.stats.record(iostats.pcbVerb(query), time.perf_counter() - t)
+    return ret
 
-  def get(self, cmd):
-    """sends cmd to the pcb and returns the relevant command response
+  def pipeline(self, cmds):
     """
-    ready = False
-    ret = None
-
-    try:
-      answer, ready = self.query(cmd)
-    except:
-      raise (ValueError, "Failure while talking to PCB")
+    sends all the commands in cmds at once and then reads their responses in order
+    returns a list of (string, bool) tuples, one per command, like query() does
+    """
+    payload = ''
+    for cmd in cmds:
+      if not cmd.endswith(self.write_terminator):
+        cmd = cmd + self.write_terminator
+      payload = payload + cmd
+    ret = []
+    with self.lock:
+      t = time.perf_counter()
+      self.s.sendall(payload.encode())
+      for cmd in cmds:
+        ret.append(self.getResponse())
+        if self.stats is not None:  # each command gets the time its own response took, not the time since the batch started
+          now = time.perf_counter()
+          self.stats.record(iostats.pcbVerb(cmd), now - t)
+          t = now
+    return ret
 
+  def parse(self, cmd, answer, ready):
+    """
+    returns the relevant part of the PCB's response to cmd
+    """
+    ret = None
     if ready:
       if answer.startswith('AIN'):
         ret = answer.split(' ')[1]
@@ -166,10 +283,30 @@ class pcb:
       else:
         print('WARNING: Got unexpected response form PCB to "{:s}": {:s}'.format(cmd, answer))
     else:
-      raise (ValueError, "Comms are out of sync with the PCB")
+      raise ValueError("Comms are out of sync with the PCB")
 
     return ret
 
+  def get(self, cmd):
+    """sends cmd to the pcb and returns the relevant command response
+    """
+    try:
+      answer, ready = self.query(cmd)
+    except Exception as e:
+      raise ValueError("Failure while talking to PCB: {:}".format(e))
+
+    return self.parse(cmd, answer, ready)
+
+  def getMany(self, cmds):
+    """pipelined version of get(), returns a list with the relevant response to each command in cmds
+    """
+    try:
+      responses = self.pipeline(cmds)
+    except Exception as e:
+      raise ValueError("Failure while talking to PCB: {:}".format(e))
+
+    return [self.parse(cmd, answer, ready) for cmd, (answer, ready) in zip(cmds, responses)]
+
   def getADCCounts(self, chan):
     """makes adc readings.
     chan can be 0-7 to directly read the corresponding adc channel
@@ -184,8 +321,8 @@ class pcb:
   def disconnect_all(self):
     """ Opens all the switches
     """
-    for substrate in self.substratesConnected:
-      self.pix_picker(substrate, 0)
+    if len(self.substratesConnected) > 0:
+      self.pipeline(["s" + substrate + "0" for substrate in self.substratesConnected])
 
   def set_keepalive_linux(sock, after_idle_sec=1, interval_sec=3, max_fails=5):
     """Set TCP keepalive on an open socket.
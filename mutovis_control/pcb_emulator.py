@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+
+import socketserver
+import threading
+import random
+import argparse
+import time
+
+class pcb_emulator:
+  """
+  emulates the control PCB's line protocol on a TCP port so that the pcb class can be used without hardware
+  supports the v, c<sub>, d<sub>, s<sub><pix>, ADC<n> and p1/p2 commands
+  response latency and faults (dropped responses, missing prompts, garbage, disconnects) can be injected
+  """
+  read_terminator = b'\r'
+  write_terminator = '\r\n'
+  prompt = '>>> '
+  substrateList = 'HGFEDCBA'
+
+  def __init__(self, host='127.0.0.1', port=0, firmware='0000000', boards={'A': 1000, 'B': 2000}, adc_counts=[0]*8, photodiodes=(30000, 30000), latency=0, jitter=0, seed=None):
+    """
+    port=0 picks a free port, see address after start()
+    boards maps the letters of connected MUX boards to their adapter resistor values
+    latency and jitter [s] delay every response by latency + uniform(0, jitter)
+    """
+    self.host = host
+    self.port = port
+    self.firmware = firmware
+    self.boards = dict(boards)
+    self.adc_counts = list(adc_counts)
+    self.photodiodes = list(photodiodes)
+    self.latency = latency
+    self.jitter = jitter
+    self.random = random.Random(seed)
+
+    # fault injection, rates are probabilities per command
+    self.drop_rate = 0  # no response at all
+    self.no_prompt_rate = 0  # response line without a prompt after it
+    self.garble_rate = 0  # response replaced with garbage
+    self.disconnect_after = None  # drop the connection after this many commands
+
+    self.selected = {}  # substrate --> selected pixel (0 for none)
+    self.n_commands = 0
+    self.lock = threading.Lock()
+    self.server = None
+
+  def start(self):
+    """starts serving in a background thread, returns the address string to give to pcb()"""
+    emulator = self
+    class handler(socketserver.BaseRequestHandler):
+      def handle(self):
+        emulator.serve(self.request)
+
+    socketserver.ThreadingTCPServer.allow_reuse_address = True
+    self.server = socketserver.ThreadingTCPServer((self.host, self.port), handler)
+    self.server.daemon_threads = True
+    self.port = self.server.server_address[1]
+    self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+    self.thread.start()
+    return self.address
+
+  @property
+  def address(self):
+    return '{:s}:{:d}'.format(self.host, self.port)
+
+  def stop(self):
+    if self.server is not None:
+      self.server.shutdown()
+      self.server.server_close()
+      self.server = None
+
+  def serve(self, conn):
+    """handles one client connection until it closes"""
+    rx = b''
+    n_this_connection = 0
+    while True:
+      data = conn.recv(4096)
+      if not data:
+        break
+      rx = rx + data
+      while self.read_terminator in rx:
+        line, rx = rx.split(self.read_terminator, 1)
+        cmd = line.decode(errors='replace').strip()
+        if cmd == '':
+          continue
+        n_this_connection += 1
+        if (self.disconnect_after is not None) and (n_this_connection > self.disconnect_after):
+          conn.close()
+          return
+        response = self.respond(cmd)
+        if response is None:
+          continue
+        if self.latency > 0 or self.jitter > 0:
+          time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        try:
+          conn.sendall(response.encode())
+        except OSError:
+          return
+
+  def respond(self, cmd):
+    """returns the bytes (as a string) the PCB sends back for cmd, or None to send nothing"""
+    with self.lock:
+      self.n_commands += 1
+      roll = self.random.random()
+      if roll < self.drop_rate:
+        return None
+      roll = roll - self.drop_rate
+      answer = self.answer(cmd)
+      if roll < self.garble_rate:
+        answer = ''.join(chr(self.random.randint(33, 126)) for i in range(len(answer) + 1))
+        return answer + self.write_terminator + self.prompt
+      roll = roll - self.garble_rate
+      if roll < self.no_prompt_rate:
+        return answer + self.write_terminator
+      return answer + self.write_terminator + self.prompt
+
+  def answer(self, cmd):
+    """returns the response line for cmd"""
+    if cmd == 'v':
+      return 'Firmware Hash: {:s}'.format(self.firmware)
+    elif cmd.startswith('ADC') and cmd[3:].isdigit():
+      chan = int(cmd[3:])
+      if chan < len(self.adc_counts):
+        return 'AIN{:d} {:d}'.format(chan, self.adc_counts[chan])
+    elif cmd in ('p1', 'p2'):
+      n = int(cmd[1])
+      return 'Photodiode {:d} counts: {:d}'.format(n, self.photodiodes[n-1])
+    elif len(cmd) == 2 and cmd[0] == 'c' and cmd[1] in self.substrateList:
+      if cmd[1] in self.boards:
+        return 'MUX OK'
+      return 'MUX not found'
+    elif len(cmd) == 2 and cmd[0] == 'd' and cmd[1] in self.substrateList:
+      if cmd[1] in self.boards:
+        return 'Board {:s} adapter resistor value: {:d}'.format(cmd[1], self.boards[cmd[1]])
+      return 'MUX not found'
+    elif len(cmd) == 3 and cmd[0] == 's' and cmd[1] in self.substrateList and cmd[2].isdigit():
+      if cmd[1] not in self.boards:
+        return 'MUX not found'
+      pixel = int(cmd[2])
+      if pixel > 8:
+        return 'Bad pixel number'
+      self.selected[cmd[1]] = pixel
+      return ''
+    return 'Unrecognized command: {:s}'.format(cmd)
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Emulates the control PCB on a TCP port')
+  parser.add_argument('--host', type=str, default='127.0.0.1', help="Interface to listen on")
+  parser.add_argument('--port', type=int, default=2323, help="Port to listen on")
+  parser.add_argument('--boards', type=str, default='A:1000,B:2000', help="Connected MUX boards and their adapter resistor values, eg. A:1000,B:2000")
+  parser.add_argument('--latency', type=float, default=0, help="Response latency [s]")
+  parser.add_argument('--jitter', type=float, default=0, help="Random extra response latency, up to this many seconds")
+  parser.add_argument('--drop-rate', type=float, default=0, help="Probability of not responding to a command")
+  parser.add_argument('--no-prompt-rate', type=float, default=0, help="Probability of leaving the prompt off a response")
+  parser.add_argument('--garble-rate', type=float, default=0, help="Probability of responding with garbage")
+  parser.add_argument('--disconnect-after', type=int, default=None, help="Close the connection after this many commands")
+  args = parser.parse_args()
+
+  boards = {}
+  for board in args.boards.split(','):
+    if board != '':
+      substrate, resistor = board.split(':')
+      boards[substrate.upper()] = int(resistor)
+
+  emulator = pcb_emulator(host=args.host, port=args.port, boards=boards, latency=args.latency, jitter=args.jitter)
+  emulator.drop_rate = args.drop_rate
+  emulator.no_prompt_rate = args.no_prompt_rate
+  emulator.garble_rate = args.garble_rate
+  emulator.disconnect_after = args.disconnect_after
+  print('Emulating control PCB on {:s} (use --pcb-address {:s})'.format(emulator.start(), emulator.address))
+  try:
+    while True:
+      time.sleep(1)
+  except KeyboardInterrupt:
+    emulator.stop()
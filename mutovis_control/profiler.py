@@ -0,0 +1,75 @@
+import h5py
+import numpy as np
+import time
+import json
+import threading
+import contextlib
+
+class profiler:
+  """
+  records how long each phase of a run takes using a high resolution timer
+  """
+  # this is the datatype for the timing records in the h5py file
+  timing_datatype = np.dtype({'names': ['phase', 'pixel', 'start', 'duration'], 'formats': [h5py.special_dtype(vlen=str), h5py.special_dtype(vlen=str), 'f8', 'f8'], 'titles': ['Phase', 'Pixel', 'Start [s]', 'Duration [s]']})
+
+  def __init__(self):
+    self.reset()
+
+  def reset(self):
+    """forget everything recorded so far and restart the clock"""
+    self.events = []  # (phase, pixel, start, duration, thread id)
+    self.pixel = ''  # label attached to the phases recorded from now on
+    self.t0 = time.perf_counter()
+    self.wall_t0 = time.time()
+
+  @contextlib.contextmanager
+  def phase(self, name):
+    """
+    context manager that times the code it wraps and records it under name
+    """
+    start = time.perf_counter()
+    try:
+      yield
+    finally:
+      end = time.perf_counter()
+      self.events.append((name, self.pixel, start - self.t0, end - start, threading.get_ident()))
+
+  def summary(self):
+    """
+    returns a dict keyed by phase name of (count, total, mean, max) durations in seconds, ordered by total time
+    """
+    durations = {}
+    for name, pixel, start, duration, tid in self.events:
+      durations.setdefault(name, []).append(duration)
+    ret = {}
+    for name, d in sorted(durations.items(), key=lambda item: sum(item[1]), reverse=True):
+      ret[name] = (len(d), sum(d), sum(d)/len(d), max(d))
+    return ret
+
+  def printSummary(self):
+    elapsed = time.perf_counter() - self.t0
+    print('Run timing summary ({:.1f} s total):'.format(elapsed))
+    print('{:>16s}\t{:>6s}\t{:>10s}\t{:>10s}\t{:>10s}\t{:>6s}'.format('phase', 'count', 'total [s]', 'mean [s]', 'max [s]', '%'))
+    for name, (count, total, mean, maximum) in self.summary().items():
+      print('{:>16s}\t{:6d}\t{:10.3f}\t{:10.4f}\t{:10.4f}\t{:6.1f}'.format(name, count, total, mean, maximum, total/elapsed*100 if elapsed > 0 else 0))
+
+  def store(self, group):
+    """
+    writes the timing records into an h5py group
+    """
+    records = np.array([e[0:4] for e in self.events], dtype=self.timing_datatype)
+    group.create_dataset('phases', data=records, compression="gzip")
+    group.attrs['Start Timestamp'] = self.wall_t0
+    for name, (count, total, mean, maximum) in self.summary().items():
+      group.attrs[name + ' total [s]'] = total
+
+  def exportChromeTrace(self, filename):
+    """
+    writes the timing records as a Chrome trace event file (load it in chrome://tracing or https://ui.perfetto.dev)
+    """
+    trace_events = []
+    for name, pixel, start, duration, tid in self.events:
+      trace_events.append({'name': name, 'cat': 'run', 'ph': 'X', 'ts': start*1e6, 'dur': duration*1e6, 'pid': 1, 'tid': tid, 'args': {'pixel': pixel}})
+    with open(filename, 'w') as f:
+      json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, f)
+    print('Wrote timing trace to {:}'.format(filename))
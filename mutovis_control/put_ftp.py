@@ -10,6 +10,7 @@ import sys
 class put_ftp:
   verbose = False
   remote_path = None
+  known_dirs = None  # remote directories we know exist (may be shared between connections)
   
   # need __enter__ and exit for use with "with"
   def __enter__(self):
@@ -18,8 +19,11 @@ class put_ftp:
   def __exit__(self, *a):
     self.close()
     
-  def __init__(self, address, pasv=True):
-    
+  def __init__(self, address, pasv=True, known_dirs=None):
+    if known_dirs is None:
+      known_dirs = set()
+    self.known_dirs = known_dirs
+
      # sanitize address input
     protocol, address = address.split('://')
     host, remote_path = address.split('/', 1)
@@ -55,10 +59,19 @@ class put_ftp:
     file_name = os.path.basename(file_pointer.name)
     if self.verbose:
       print('Uploading {:}...'.format(file_pointer.name))
-    # so maybe we need to create an arbitrary number of nested remote directories
+    self.makeDirs(remote_path)
+    self.ftp.storbinary('STOR {:}{:}'.format(remote_path, file_name), file_pointer) #upload the file
+    if self.verbose:
+      print('Success: uploaded to {:}:{:}{:}{:}'.format(self.ftp.host, self.ftp.port, remote_path, file_name))    
+
+  def makeDirs(self, remote_path):
+    """
+    creates an arbitrary number of nested remote directories
+    directories that are already known to exist are skipped
+    """
     first_part, second_part = os.path.split(remote_path)
     path_list = []
-    while first_part != '/':
+    while first_part not in ('/', '') and first_part not in self.known_dirs:
       path_list.append(first_part)
       first_part, second_part = os.path.split(first_part)
     path_list.reverse()
@@ -67,9 +80,7 @@ class put_ftp:
         self.ftp.mkd(directory)
       except ftplib.error_perm:
         pass # directory probably already exists
-    self.ftp.storbinary('STOR {:}{:}'.format(remote_path, file_name), file_pointer) #upload the file
-    if self.verbose:
-      print('Success: uploaded to {:}:{:}{:}{:}'.format(self.ftp.host, self.ftp.port, remote_path, file_name))    
+      self.known_dirs.add(directory)
 
   def close(self):
     self.ftp.quit()
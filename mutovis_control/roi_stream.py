@@ -0,0 +1,86 @@
+import socket
+import struct
+import json
+import time
+
+class roi_stream:
+  """
+  sends regions of interest to the GUI as binary frames over a TCP or unix socket, much leaner than XML-RPC
+  each frame is a '!II' header (JSON header length, payload length), the UTF-8 JSON header and then the payload:
+  the ROI's measurements as raw bytes of their numpy structured datatype, which is described in the JSON header
+  run events are frames with an 'event' in the header and no payload
+  headers can carry a topic (rig, run, substrate) so that a hub (see control_gui.hub) can route them to the right dashboards
+  """
+  frame_header = struct.Struct('!II')
+
+  def __init__(self, address, timeout=5):
+    """
+    address is tcp://host:port or unix:///path/to/socket
+    """
+    self.address = address
+    self.timeout = timeout
+    self.sock = None
+    self.frames_sent = 0
+    self.bytes_sent = 0
+
+  def connect(self):
+    protocol, location = self.address.split('://', 1)
+    if protocol == 'tcp':
+      host, port = location.rsplit(':', 1)
+      self.sock = socket.create_connection((host, int(port)), timeout=self.timeout)
+      self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    elif protocol == 'unix':
+      self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+      self.sock.settimeout(self.timeout)
+      self.sock.connect(location)
+    else:
+      raise ValueError("Unknown ROI stream protocol in address {:}".format(self.address))
+
+  def close(self):
+    if self.sock is not None:
+      try:
+        self.sock.close()
+      except OSError:
+        pass
+      self.sock = None
+
+  def encode(measurements, header):
+    """
+    returns the frame bytes for a numpy structured array of measurements with a dict of extra header fields
+    """
+    fields = measurements.dtype.fields
+    header = dict(header)
+    header['names'] = list(measurements.dtype.names)
+    header['formats'] = [fields[name][0].str for name in measurements.dtype.names]
+    header['length'] = len(measurements)
+    header_bytes = json.dumps(header).encode()
+    payload = measurements.tobytes()
+    return roi_stream.frame_header.pack(len(header_bytes), len(payload)) + header_bytes + payload
+
+  def send(self, measurements, message, area, live=False, topic=None):
+    """
+    sends an ROI, (re)connecting first if need be, raises OSError (after closing the connection) if that fails
+    live marks a chunk of an ROI that's still being measured, the GUI adds it to that ROI's live trace
+    topic is a dict of rig, run, substrate and pixel names to tag the ROI with
+    """
+    header = dict(topic or {})
+    header.update({'message': message, 'area': area, 'live': live})
+    self.sendFrame(roi_stream.encode(measurements, header))
+
+  def sendEvent(self, event, topic=None):
+    """sends a run event (eg. 'run_start'), raises OSError like send"""
+    header = dict(topic or {})
+    header.update({'event': event, 'time': time.time()})
+    header_bytes = json.dumps(header).encode()
+    self.sendFrame(roi_stream.frame_header.pack(len(header_bytes), 0) + header_bytes)
+
+  def sendFrame(self, frame):
+    try:
+      if self.sock is None:
+        self.connect()
+      self.sock.sendall(frame)
+    except OSError:
+      self.close()
+      raise
+    self.frames_sent += 1
+    self.bytes_sent += len(frame)
@@ -0,0 +1,105 @@
+import itertools
+from collections import deque
+
+class route_planner:
+  """
+  orders the pixel queue to keep the time the stage spends moving low
+  each substrate's pixels stay together (so its experimental parameters and setup apply to one block of pixels)
+  and are visited in order of position, either way round, the substrate order and directions are picked by dynamic programming
+  pixels at the same position are visited one after the other so they share a single move
+  """
+  def __init__(self, start=0, velocity=10.0, settle=0.2, move_time=None):
+    """
+    start [mm] is where the stage is before the first pixel (eg. the photodiode location after measuring intensity)
+    velocity [mm/s] and settle [s] are used to estimate how long a move takes
+    unless move_time is given, a function that predicts the time [s] for a move of some mm (eg. motion.move_time)
+    """
+    self.start = start
+    self.velocity = velocity
+    self.settle = settle
+    self.move_time = move_time
+
+  def moveTime(self, a, b):
+    """estimated time [s] to move from a to b"""
+    if a == b:
+      return 0
+    if self.move_time is not None:
+      return self.move_time(b - a)
+    return self.settle + abs(b - a) / self.velocity
+
+  def routeTime(self, positions):
+    """estimated time [s] spent moving to visit positions in order"""
+    total = 0
+    here = self.start
+    for position in positions:
+      total += self.moveTime(here, position)
+      here = position
+    return total
+
+  def travel(self, positions):
+    """total distance [mm] travelled visiting positions in order"""
+    total = 0
+    here = self.start
+    for position in positions:
+      total += abs(position - here)
+      here = position
+    return total
+
+  def plan(self, pixel_que):
+    """
+    returns a new queue with the pixels of pixel_que (elements as made by cli.buildQ) in travel optimized order
+    """
+    blocks = []  # per substrate, pixels sorted by position
+    substrates = []
+    for pixel in pixel_que:
+      substrate = pixel[0][0].upper()
+      if substrate not in substrates:
+        substrates.append(substrate)
+        blocks.append([])
+      blocks[substrates.index(substrate)].append(pixel)
+    if len(blocks) == 0:
+      return deque(pixel_que)
+    blocks = [sorted(block, key=lambda pixel: pixel[2]) for block in blocks]  # stable, so same position pixels keep their order
+    inner = []  # time spent moving within each block
+    for block in blocks:
+      positions = [pixel[2] for pixel in block]
+      inner.append(sum(self.moveTime(a, b) for a, b in zip(positions, positions[1:])))
+    ends = [(block[0][2], block[-1][2]) for block in blocks]  # first and last position when visited forwards
+
+    # best[(visited bitmask, last block, reversed)] = (time, previous state)
+    n = len(blocks)
+    best = {}
+    for b in range(n):
+      for rev in (False, True):
+        first = ends[b][1] if rev else ends[b][0]
+        best[(1 << b, b, rev)] = (self.moveTime(self.start, first) + inner[b], None)
+    for mask in range(1, 1 << n):
+      for b, rev in itertools.product(range(n), (False, True)):
+        state = (mask, b, rev)
+        if state not in best:
+          continue
+        t, prev = best[state]
+        here = ends[b][0] if rev else ends[b][1]
+        for nb, nrev in itertools.product(range(n), (False, True)):
+          if mask & (1 << nb):
+            continue
+          first = ends[nb][1] if nrev else ends[nb][0]
+          nt = t + self.moveTime(here, first) + inner[nb]
+          nstate = (mask | (1 << nb), nb, nrev)
+          if (nstate not in best) or (nt < best[nstate][0]):
+            best[nstate] = (nt, state)
+
+    full = (1 << n) - 1
+    state = min((s for s in best if s[0] == full), key=lambda s: best[s][0])
+    order = []
+    while state is not None:
+      order.append(state)
+      state = best[state][1]
+    order.reverse()
+    q = []
+    for mask, b, rev in order:
+      q.extend(reversed(blocks[b]) if rev else blocks[b])
+
+    if self.routeTime([pixel[2] for pixel in q]) >= self.routeTime([pixel[2] for pixel in pixel_que]):
+      return deque(pixel_que)  # nothing to gain
+    return deque(q)
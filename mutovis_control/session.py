@@ -0,0 +1,125 @@
+import threading
+import heapq
+import itertools
+import time
+import contextlib
+
+class session:
+  """
+  serializing proxy for an instrument driver
+  every method call on the driver is made while holding that device's lock so that threads sharing
+  the device can't interleave their comms, waiting callers get the lock in priority order
+  attributes that aren't methods are passed straight through
+  """
+  # command priorities, lower numbers get the device first
+  URGENT = 0
+  NORMAL = 1  # the measurement loop: pixel switching, sourcing, stage moves
+  TELEMETRY = 2  # background polling
+  priority_names = {URGENT: 'urgent', NORMAL: 'normal', TELEMETRY: 'telemetry'}
+
+  class priority_lock:
+    """
+    a reentrant lock that is handed to waiting threads in priority order (first come first served within a priority)
+    """
+    def __init__(self):
+      self.cond = threading.Condition(threading.Lock())
+      self.owner = None
+      self.depth = 0
+      self.waiting = []  # heap of (priority, ticket)
+      self.tickets = itertools.count()
+
+    def acquire(self, priority):
+      """blocks until the lock is ours, returns the number of seconds spent waiting"""
+      me = threading.get_ident()
+      with self.cond:
+        if self.owner == me:
+          self.depth += 1
+          return 0.0
+        if self.owner is None and len(self.waiting) == 0:  # uncontended
+          self.owner = me
+          self.depth = 1
+          return 0.0
+        t = time.perf_counter()
+        entry = (priority, next(self.tickets))
+        heapq.heappush(self.waiting, entry)
+        try:
+          while (self.owner is not None) or (self.waiting[0] != entry):
+            self.cond.wait()
+        except BaseException:  # eg. KeyboardInterrupt, give up our place in the queue so others aren't stuck behind it
+          self.waiting.remove(entry)
+          heapq.heapify(self.waiting)
+          self.cond.notify_all()
+          raise
+        heapq.heappop(self.waiting)
+        self.owner = me
+        self.depth = 1
+        return time.perf_counter() - t
+
+    def release(self):
+      with self.cond:
+        self.depth -= 1
+        if self.depth == 0:
+          self.owner = None
+          self.cond.notify_all()
+
+  def __init__(self, driver, name='', priority=NORMAL, lock=None, stats=None):
+    """
+    name labels the device in the wait time statistics
+    lock is shared between sessions for the same device, a new one is made if not given
+    stats is an optional iostats object that records how long callers waited for the device
+    """
+    if lock is None:
+      lock = session.priority_lock()
+    self.__dict__['_driver'] = driver
+    self.__dict__['_name'] = name
+    self.__dict__['_priority'] = priority
+    self.__dict__['_lock'] = lock
+    self.__dict__['_stats'] = stats
+    self.__dict__['_wait_key'] = '{:s} {:s}'.format(name, session.priority_names.get(priority, str(priority)))
+    self.__dict__['_methods'] = {}
+
+  def withPriority(self, priority):
+    """returns another session for the same device (sharing its lock) whose calls have the given priority"""
+    return session(self._driver, name=self._name, priority=priority, lock=self._lock, stats=self._stats)
+
+  def unwrap(obj):
+    """returns the driver inside a session, or obj itself if it's not a session"""
+    if isinstance(obj, session):
+      return obj._driver
+    return obj
+
+  @contextlib.contextmanager
+  def hold(self):
+    """context manager that keeps the device for a sequence of calls that must not be interleaved with other threads' calls"""
+    waited = self._lock.acquire(self._priority)
+    if self._stats is not None:
+      self._stats.record(self._wait_key, waited)
+    try:
+      yield self
+    finally:
+      self._lock.release()
+
+  def __getattr__(self, name):
+    method = self._methods.get(name)
+    if method is not None:
+      return method
+    attr = getattr(self._driver, name)
+    if not callable(attr):
+      return attr
+    lock = self._lock
+    priority = self._priority
+    stats = self._stats
+    wait_key = self._wait_key
+    def locked(*args, **kwargs):
+      waited = lock.acquire(priority)
+      if stats is not None:
+        stats.record(wait_key, waited)
+      try:
+        return attr(*args, **kwargs)
+      finally:
+        lock.release()
+    self._methods[name] = locked
+    return locked
+
+  def __setattr__(self, name, value):
+    setattr(self._driver, name, value)
@@ -1,9 +1,11 @@
 import mpmath
+import concurrent.futures
+from mutovis_control.motion_driver import motion_driver
 import time
 import numpy
 from collections import deque
 
-class motion():
+class motion(motion_driver):
   substrate_centers = [300, 260, 220, 180, 140, 100, 60, 20]  # mm from home to the centers of A, B, C, D, E, F, G, H substrates
   photodiode_location = 315  # mm  
   def connect(self):
@@ -12,12 +14,23 @@ class motion():
     print("Virtually moving {:}mm".format(mm))
   def goto(self, mm):
     print("Virtually moving to {:}mm".format(mm))
+  def goto_async(self, mm):
+    self.goto(mm)
+    arrived = concurrent.futures.Future()
+    arrived.set_result(0)
+    return arrived
   def home(self):
     print("Virtually homing")    
 
 class illumination():
+  intensity = 100.0  # [%]
   def connect(self):
     print ("Connected to virtual lightsource")
+  def getIntensity(self):
+    return self.intensity
+  def setIntensity(self, value):
+    print("Virtual light intensity set to {:}%".format(value))
+    self.intensity = value
   def activateRecipe(self, recipe):
     print ("Light engine recipe '{:}' virtually activated.".format(recipe))
   def on(self):
@@ -100,6 +113,9 @@ class k2400():
   def outOn(self, on=True):
     return
 
+  def getTime(self):
+    return time.time() - self.t0
+
   # the device is open circuit
   def openCircuitEvent(self):
     self.I = 0
@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 
 import socketserver
-import xml.etree.cElementTree as ET
+import socket
+import xml.etree.ElementTree as ET
+import collections
 import time
+import re
 
 class wavelabs:
   """interface to the wavelabs LED solar simulator"""
@@ -11,36 +14,35 @@ class wavelabs:
   default_recipe = 'am1_5_1_sun'
   port = 3334  # 3334 for direct connection, 3335 for through relay service
   host = '0.0.0.0'  # 0.0.0.0 for direct connection, localhost for through relay service
+  stats = None  # optional iostats object for recording command latencies
+  timeout = 10  # [s] default time to wait for a response
+  recv_size = 4096  # max bytes to pull off the socket at once
 
-  class XMLHandler:
+  class response:
     """
-    Class for handling the XML responses from the wavelabs software
+    a parsed response from the wavelabs software
     """
-    def __init__(self):
-      self.done_parsing = False
-      self.error = None
+    def __init__(self, element):
+      self.tag = None
+      self.seq = None
+      self.error = 0  # the error code, 0 means no error
       self.error_message = None
       self.run_ID = None
-
-    def start(self, tag, attrib):
-      if 'iEC' in attrib:
-        self.error = int(attrib['iEC'])
-      if 'sError' in attrib:
-        self.error_message = attrib['sError']
-      if 'sRunID' in attrib:
-        self.run_ID = attrib['sRunID']
-      if 'sVal' in attrib:
-        self.paramVal = attrib['sVal']      
-
-    def end(self, tag):
-      if tag == 'WLRC':
-        self.done_parsing = True
-
-    def data(self, data):
-      pass
-
-    def close(self):
-      pass  
+      self.paramVal = None
+      for e in element.iter():
+        attrib = e.attrib
+        if (self.tag is None) and (e is not element):
+          self.tag = e.tag
+        if 'iSeq' in attrib:
+          self.seq = int(attrib['iSeq'])
+        if 'iEC' in attrib:
+          self.error = int(attrib['iEC'])
+        if 'sError' in attrib:
+          self.error_message = attrib['sError']
+        if 'sRunID' in attrib:
+          self.run_ID = attrib['sRunID']
+        if 'sVal' in attrib:
+          self.paramVal = attrib['sVal']
 
   def __init__(self, address="wavelabs://0.0.0.0:3334"):
     """
@@ -54,10 +56,10 @@ class wavelabs:
     self.protocol, location = address.split('://')
     self.host, self.port = location.split(':')
     self.port = int(self.port)
+    self.resetParser()
     
   def __del__(self):
     try:
-      self.sock_file.close()
       self.connection.close()
     except:
       pass
@@ -67,16 +69,111 @@ class wavelabs:
     except:
       pass    
 
-  def recvXML(self):
-    """reads xml object from socket"""
-    target = self.XMLHandler()
-    parser = ET.XMLParser(target=target)
-    while not target.done_parsing:
-      parser.feed(self.connection.recv(1024))
-    parser.close()
-    if target.error != 0:
-      print("Got error number {:} from WaveLabs software: {:}".format(target.error, target.error_message))
-    return target
+  def resetParser(self):
+    """
+    starts a fresh incremental parser for the stream of WLRC documents coming from a new connection
+    the documents get parsed as children of a made up stream element
+    """
+    self.parser = ET.XMLPullParser(events=('start', 'end'))
+    self.parser.feed(b'<stream>')
+    self.stream_root = None
+    self.carry = b''  # received bytes held back from the parser for now
+    self.outstanding = collections.OrderedDict()  # iSeq --> (command tag, time sent) for commands awaiting a response
+    self.responses = {}  # iSeq --> response, for responses nobody has collected yet
+    self.unawaited = set()  # iSeq of commands whose responses will never be collected, only checked for errors
+
+  def feed(self, data):
+    """
+    passes received bytes to the parser and handles every response that completes
+    xml declarations are stripped since they may only appear at the start of our made up stream
+    """
+    data = self.carry + data
+    self.carry = b''
+    i = data.rfind(b'<')
+    if (i >= 0) and (data.find(b'>', i) < 0):  # hold back a tag that might be the start of a declaration
+      self.carry = data[i:]
+      data = data[:i]
+    data = re.sub(rb'<\?xml[^>]*\?>', b'', data)
+    self.parser.feed(data)
+    for event, element in self.parser.read_events():
+      if event == 'start':
+        if self.stream_root is None:
+          self.stream_root = element
+      elif element.tag == 'WLRC':
+        self.handleResponse(self.response(element))
+        self.stream_root.remove(element)  # we're done with it
+
+  def handleResponse(self, response):
+    """matches a response to its command by iSeq (or the oldest outstanding command if there's no iSeq)"""
+    if (response.seq is None) or (response.seq not in self.outstanding):
+      if len(self.outstanding) == 0:
+        print("WARNING: Got an unexpected response from WaveLabs software")
+        return
+      response.seq = next(iter(self.outstanding))
+    tag, t = self.outstanding.pop(response.seq)
+    if self.stats is not None:
+      self.stats.record(tag, time.perf_counter() - t)
+    if response.error != 0:
+      print("Got error number {:} from WaveLabs software: {:}".format(response.error, response.error_message))
+    if response.seq in self.unawaited:
+      self.unawaited.discard(response.seq)
+    else:
+      self.responses[response.seq] = response
+
+  def send(self, tag, await_response=True, **attribs):
+    """
+    sends a command to the wavelabs software without waiting for its response, returns its sequence number
+    if await_response is False, the response will be checked for errors when it comes in but never returned
+    """
+    seq = self.iseq
+    root = ET.Element("WLRC")
+    ET.SubElement(root, tag, iSeq=str(seq), **attribs)
+    self.iseq =  self.iseq + 1
+    self.outstanding[seq] = (tag, time.perf_counter())
+    if not await_response:
+      self.unawaited.add(seq)
+    self.connection.sendall(ET.tostring(root))
+    return seq
+
+  def collect(self, seq, timeout=None):
+    """
+    returns the response to the command with sequence number seq, receiving until it arrives
+    raises ValueError if it doesn't arrive within timeout seconds (default self.timeout)
+    """
+    if timeout is None:
+      timeout = self.timeout
+    deadline = time.time() + timeout
+    while seq not in self.responses:
+      if (seq not in self.outstanding) and (seq not in self.responses):
+        raise ValueError("No response to collect for WaveLabs command {:}".format(seq))
+      self.receive(deadline)
+    return self.responses.pop(seq)
+
+  def receive(self, deadline):
+    """receives and handles whatever the wavelabs software sends before deadline"""
+    remaining = deadline - time.time()
+    if remaining <= 0:
+      raise ValueError("Timed out waiting for a response from WaveLabs software")
+    self.connection.settimeout(remaining)
+    try:
+      data = self.connection.recv(self.recv_size)
+    except socket.timeout:
+      raise ValueError("Timed out waiting for a response from WaveLabs software")
+    if not data:
+      raise ValueError("WaveLabs connection closed")
+    self.feed(data)
+
+  def drain(self, timeout=None):
+    """waits until every command sent so far has been responded to"""
+    if timeout is None:
+      timeout = self.timeout
+    deadline = time.time() + timeout
+    while len(self.outstanding) > 0:
+      self.receive(deadline)
+
+  def query(self, tag, timeout=None, **attribs):
+    """sends a command to the wavelabs software and returns its parsed response"""
+    return self.collect(self.send(tag, **attribs), timeout=timeout)
 
   def startServer(self):
     """define a server which listens for the wevelabs software to connect"""
@@ -108,57 +205,37 @@ class wavelabs:
     while requestNotVerified:
       request, client_address = self.server.get_request()
       if self.server.verify_request(request, client_address):
-        self.sock_file = request.makefile(mode="rwb")
         self.connection = request
+        self.resetParser()
         requestNotVerified = False
         
   def connectToRelay(self):
     """forms connection to the relay server"""
     self.connection = socketserver.socket.socket(socketserver.socket.AF_INET, socketserver.socket.SOCK_STREAM)
     self.connection.connect((self.host, int(self.port)))
-    self.sock_file = self.connection.makefile(mode="rwb")
+    self.resetParser()
 
   def activateRecipe(self, recipe_name=default_recipe):
     """activate a solar sim recipe by name"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'ActivateRecipe', iSeq=str(self.iseq), sRecipe = recipe_name)
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+    response = self.query('ActivateRecipe', sRecipe = recipe_name)
     if response.error != 0:
       print("ERROR: Recipe '{:}' could not be activated, check that it exists".format(recipe_name))
       
   def waitForResultAvailable(self, timeout=10000):
-    """wait for result from a recipe to be available"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'WaitForResultAvailable', iSeq=str(self.iseq), fTimeout = str(timeout))
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+    """wait for result from a recipe to be available, timeout is in ms"""
+    response = self.query('WaitForResultAvailable', timeout=timeout/1000 + self.timeout, fTimeout = str(timeout))
     if response.error != 0:
       print("ERROR: Failed to wait for result")
 
   def waitForRunFinished(self, timeout=10000):
-    """wait for the current run to finish"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'WaitForRunFinished', iSeq=str(self.iseq), fTimeout = str(timeout))
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+    """wait for the current run to finish, timeout is in ms"""
+    response = self.query('WaitForRunFinished', timeout=timeout/1000 + self.timeout, fTimeout = str(timeout))
     if response.error != 0:
       print("ERROR: Failed to wait for run finish")
       
   def getRecipeParam(self, recipe_name=default_recipe, step=1, device="Light", param="Intensity"):
     ret = None
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'GetRecipeParam', iSeq=str(self.iseq), sRecipe = recipe_name, iStep = str(step), sDevice=device, sParam=param)
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+    response = self.query('GetRecipeParam', sRecipe = recipe_name, iStep = str(step), sDevice=device, sParam=param)
     if response.error != 0:
       print("ERROR: Failed to get recipe parameter")
     else:
@@ -166,47 +243,54 @@ class wavelabs:
     return ret
   
   def setRecipeParam(self, recipe_name=default_recipe, step=1, device="Light", param="Intensity", value=100.0):
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'SetRecipeParam', iSeq=str(self.iseq), sRecipe=recipe_name, iStep=str(step), sDevice=device, sParam=param, sVal=str(value))
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
-    if response.error != 0:
-      print("ERROR: Failed to set recipe parameter")
-    else:
-      self.activateRecipe(recipe_name=recipe_name)
+    return self.setRecipeParams({param: value}, recipe_name=recipe_name, step=step, device=device)
 
-  def on(self):
-    """starts the last activated recipe"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'StartRecipe', iSeq=str(self.iseq), sAutomationID = 'justtext')
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+  def setRecipeParams(self, params, recipe_name=default_recipe, step=1, device="Light"):
+    """
+    sets several recipe parameters (pipelined) and then, only if they were all set, re-activates the recipe
+    params is a dict of parameter name --> value
+    returns True if everything worked
+    """
+    seqs = []
+    for param, value in params.items():
+      seqs.append(self.send('SetRecipeParam', sRecipe=recipe_name, iStep=str(step), sDevice=device, sParam=param, sVal=str(value)))
+    win = True
+    for seq in seqs:
+      if self.collect(seq).error != 0:
+        print("ERROR: Failed to set recipe parameter")
+        win = False
+    if win:
+      response = self.query('ActivateRecipe', sRecipe=recipe_name)
+      if response.error != 0:
+        print("ERROR: Recipe '{:}' could not be activated, check that it exists".format(recipe_name))
+        win = False
+    return win
+
+  def on(self, block=True):
+    """starts the last activated recipe
+    with block=False this returns right away, errors get reported when the response is received later
+    """
+    if not block:
+      self.send('StartRecipe', await_response=False, sAutomationID = 'justtext')
+      return
+    response = self.query('StartRecipe', sAutomationID = 'justtext')
     if response.error != 0:
       print("ERROR: Recipe could not be started")
 
-  def off(self):
-    """cancel a currently running recipe"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'CancelRecipe', iSeq=str(self.iseq))
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+  def off(self, block=True):
+    """cancel a currently running recipe
+    with block=False this returns right away, errors get reported when the response is received later
+    """
+    if not block:
+      self.send('CancelRecipe', await_response=False)
+      return
+    response = self.query('CancelRecipe')
     if response.error != 0:
       print("ERROR: Could not cancel recipe, maybe it's not running")
 
   def exitProgram(self):
     """closes the wavelabs solar sim program on the wavelabs PC"""
-    root = ET.Element("WLRC")
-    ET.SubElement(root, 'ExitProgram', iSeq=str(self.iseq))
-    self.iseq =  self.iseq + 1
-    tree = ET.ElementTree(root)
-    tree.write(self.sock_file)
-    response = self.recvXML()
+    response = self.query('ExitProgram')
     if response.error != 0:
       print("ERROR: Could not exit WaveLabs program")     
 
@@ -221,8 +305,7 @@ if __name__ == "__main__":
   new_duration = 5 # in seconds
   if new_duration < 3:
     raise(ValueError("Pick a new duration larger than 3"))
-  wl.setRecipeParam(param="Duration", value=new_duration*1000)
-  wl.setRecipeParam(param="Intensity", value=new_intensity)
+  wl.setRecipeParams({"Duration": new_duration*1000, "Intensity": new_intensity})
   
   duration = wl.getRecipeParam(param="Duration")
   intensity = wl.getRecipeParam(param="Intensity") 
@@ -252,8 +335,7 @@ if __name__ == "__main__":
   wl.waitForResultAvailable()
   #wl.off()
   #wl.activateRecipe()
-  wl.setRecipeParam(param="Intensity", value=old_intensity)
-  wl.setRecipeParam(param="Duration", value=old_duration)
+  wl.setRecipeParams({"Intensity": old_intensity, "Duration": old_duration})
   
   duration = wl.getRecipeParam(param="Duration")
   intensity = wl.getRecipeParam(param="Intensity")
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+import socket
+import threading
+import xml.etree.ElementTree as ET
+import random
+import argparse
+import time
+
+class wavelabs_emulator:
+  """
+  emulates the WaveLabs solar sim PC software's remote control (WLRC) XML protocol
+  like the real software, it connects out to the control software (or relay) and then answers its commands
+  supports ActivateRecipe, StartRecipe, CancelRecipe, GetRecipeParam, SetRecipeParam, WaitForRunFinished,
+  WaitForResultAvailable and ExitProgram
+  response latency, recipe run times and errors can be configured
+  """
+  # error codes the emulator answers with
+  NO_ERROR = 0
+  UNKNOWN_COMMAND = 1
+  UNKNOWN_RECIPE = 2
+  NO_ACTIVE_RECIPE = 3
+  NOT_RUNNING = 4
+  ALREADY_RUNNING = 5
+  UNKNOWN_PARAMETER = 6
+  TIMEOUT = 7
+  INJECTED = 99
+
+  def __init__(self, host='127.0.0.1', port=3334, recipes=None, latency=0, jitter=0, result_delay=0.5, seed=None):
+    """
+    host and port are where the control software (wavelabs://) or relay (its WaveLabs port) listens
+    recipes maps recipe name --> {(step, device, param): value}, a one step am1_5_1_sun recipe is made if not given
+    latency and jitter [s] delay every response by latency + uniform(0, jitter)
+    result_delay [s] is how long after a run finishes its result becomes available
+    """
+    self.host = host
+    self.port = port
+    if recipes is None:
+      recipes = {'am1_5_1_sun': {(1, 'Light', 'Intensity'): 100.0, (1, 'Light', 'Duration'): 5000.0}}
+    self.recipes = {name: dict(params) for name, params in recipes.items()}
+    self.latency = latency
+    self.jitter = jitter
+    self.result_delay = result_delay
+    self.random = random.Random(seed)
+
+    # fault injection
+    self.error_rate = 0  # probability of answering any command with an INJECTED error
+    self.error_commands = {}  # command tag --> (iEC, sError) to always answer that command with
+
+    self.active_recipe = None
+    self.run_start = None  # time the current (or last) run started
+    self.run_end = None  # time the current (or last) run finishes
+    self.n_runs = 0
+    self.n_commands = 0
+    self.reconnect_interval = 1  # [s] between attempts to (re)connect
+    self.stopping = threading.Event()
+    self.connection = None
+    self.thread = None
+
+  def start(self):
+    """connects and serves in a background thread"""
+    self.stopping.clear()
+    self.thread = threading.Thread(target=self.run, name='wavelabs_emulator', daemon=True)
+    self.thread.start()
+
+  def stop(self):
+    self.stopping.set()
+    try:
+      self.connection.shutdown(socket.SHUT_RDWR)
+    except:
+      pass
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def run(self):
+    """keeps (re)connecting to the control software and serving it until stopped"""
+    while not self.stopping.is_set():
+      try:
+        self.connection = socket.create_connection((self.host, self.port))
+      except OSError:
+        self.stopping.wait(self.reconnect_interval)
+        continue
+      try:
+        if self.serve(self.connection) == 'ExitProgram':
+          break
+      except OSError:
+        pass
+      finally:
+        self.connection.close()
+      self.stopping.wait(self.reconnect_interval)
+
+  def serve(self, conn):
+    """answers commands until the connection closes, returns the tag of the last command"""
+    rx = b''
+    tag = None
+    while not self.stopping.is_set():
+      data = conn.recv(4096)
+      if not data:
+        break
+      rx = rx + data
+      while b'</WLRC>' in rx:
+        doc, rx = rx.split(b'</WLRC>', 1)
+        try:
+          command = ET.fromstring(doc + b'</WLRC>')[0]
+        except (ET.ParseError, IndexError):
+          continue
+        tag = command.tag
+        response = self.respond(command)
+        if self.latency > 0 or self.jitter > 0:
+          time.sleep(self.latency + self.random.uniform(0, self.jitter))
+        conn.sendall(response)
+        if tag == 'ExitProgram':
+          return tag
+    return tag
+
+  def respond(self, command):
+    """returns the response bytes for a command element"""
+    self.n_commands += 1
+    attribs = {}
+    if 'iSeq' in command.attrib:
+      attribs['iSeq'] = command.attrib['iSeq']
+    if command.tag in self.error_commands:
+      error, message = self.error_commands[command.tag]
+    elif self.random.random() < self.error_rate:
+      error, message = (self.INJECTED, 'Injected error')
+    else:
+      error, message, extra = self.execute(command.tag, command.attrib)
+      attribs.update(extra)
+    attribs['iEC'] = str(error)
+    attribs['sError'] = message
+    root = ET.Element('WLRC')
+    ET.SubElement(root, command.tag, **attribs)
+    return b'<?xml version="1.0" encoding="utf-8"?>\r\n' + ET.tostring(root)
+
+  def running(self, t=None):
+    if t is None:
+      t = time.time()
+    return (self.run_end is not None) and (self.run_start <= t < self.run_end)
+
+  def execute(self, tag, a):
+    """carries out a command, returns (iEC, sError, dict of extra response attributes)"""
+    if tag == 'ActivateRecipe':
+      if a.get('sRecipe') not in self.recipes:
+        return (self.UNKNOWN_RECIPE, 'Recipe {:} not found'.format(a.get('sRecipe')), {})
+      if self.running():
+        return (self.ALREADY_RUNNING, 'A recipe is running', {})
+      self.active_recipe = a['sRecipe']
+    elif tag == 'StartRecipe':
+      if self.active_recipe is None:
+        return (self.NO_ACTIVE_RECIPE, 'No recipe activated', {})
+      if self.running():
+        return (self.ALREADY_RUNNING, 'A recipe is running', {})
+      duration = sum(v for (step, device, param), v in self.recipes[self.active_recipe].items() if param == 'Duration')
+      self.n_runs += 1
+      self.run_start = time.time()
+      self.run_end = self.run_start + float(duration) / 1000
+      return (self.NO_ERROR, '', {'sRunID': 'emulated_run_{:d}'.format(self.n_runs)})
+    elif tag == 'CancelRecipe':
+      if not self.running():
+        return (self.NOT_RUNNING, 'No recipe is running', {})
+      self.run_end = time.time()
+    elif tag in ('GetRecipeParam', 'SetRecipeParam'):
+      recipe = self.recipes.get(a.get('sRecipe'))
+      if recipe is None:
+        return (self.UNKNOWN_RECIPE, 'Recipe {:} not found'.format(a.get('sRecipe')), {})
+      try:
+        key = (int(a.get('iStep', 1)), a.get('sDevice'), a.get('sParam'))
+      except ValueError:
+        key = None
+      if key not in recipe:
+        return (self.UNKNOWN_PARAMETER, 'Parameter {:} not found'.format(a.get('sParam')), {})
+      if tag == 'GetRecipeParam':
+        return (self.NO_ERROR, '', {'sVal': '{:g}'.format(recipe[key])})
+      try:
+        recipe[key] = float(a.get('sVal'))
+      except (TypeError, ValueError):
+        return (self.UNKNOWN_PARAMETER, 'Bad value {:}'.format(a.get('sVal')), {})
+    elif tag in ('WaitForRunFinished', 'WaitForResultAvailable'):
+      if self.run_end is None:
+        return (self.NOT_RUNNING, 'No recipe has run', {})
+      done = self.run_end if tag == 'WaitForRunFinished' else self.run_end + self.result_delay
+      deadline = time.time() + float(a.get('fTimeout', 10000)) / 1000
+      if done > deadline:
+        self.stopping.wait(max(0, deadline - time.time()))
+        return (self.TIMEOUT, 'Timeout', {})
+      self.stopping.wait(max(0, done - time.time()))
+      if tag == 'WaitForResultAvailable':
+        return (self.NO_ERROR, '', {'sRunID': 'emulated_run_{:d}'.format(self.n_runs)})
+    elif tag != 'ExitProgram':
+      return (self.UNKNOWN_COMMAND, 'Unknown command {:}'.format(tag), {})
+    return (self.NO_ERROR, '', {})
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description='Emulates the WaveLabs solar sim software')
+  parser.add_argument('--host', type=str, default='127.0.0.1', help="Host the control software (or relay) listens on")
+  parser.add_argument('--port', type=int, default=3334, help="Port the control software (or relay) listens on")
+  parser.add_argument('--duration', type=float, default=5000, help="Recipe Duration parameter [ms]")
+  parser.add_argument('--latency', type=float, default=0, help="Response latency [s]")
+  parser.add_argument('--jitter', type=float, default=0, help="Random extra response latency, up to this many seconds")
+  parser.add_argument('--error-rate', type=float, default=0, help="Probability of answering a command with an error")
+  parser.add_argument('--benchmark', type=int, default=0, help="Instead of connecting out, listen like the control software does and time this many light on/off cycles through the wavelabs class")
+  args = parser.parse_args()
+
+  recipes = {'am1_5_1_sun': {(1, 'Light', 'Intensity'): 100.0, (1, 'Light', 'Duration'): args.duration}}
+  emulator = wavelabs_emulator(host=args.host, port=args.port, recipes=recipes, latency=args.latency, jitter=args.jitter)
+  emulator.error_rate = args.error_rate
+
+  if args.benchmark > 0:
+    from mutovis_control.wavelabs import wavelabs
+    from mutovis_control.iostats import iostats
+    wl = wavelabs('wavelabs://{:s}:{:d}'.format(args.host, args.port))
+    wl.stats = iostats()
+    emulator.start()
+    wl.connect()
+    t = time.perf_counter()
+    for i in range(args.benchmark):
+      wl.on()
+      wl.off()
+    elapsed = time.perf_counter() - t
+    print('{:d} on/off cycles in {:.3f} s ({:.2f} ms per cycle)'.format(args.benchmark, elapsed, elapsed/args.benchmark*1000))
+    wl.stats.printSummary('WaveLabs command latency')
+    emulator.stop()
+  else:
+    emulator.start()
+    print('Emulating WaveLabs software, connecting to {:s}:{:d}'.format(args.host, args.port))
+    try:
+      while emulator.thread.is_alive():
+        time.sleep(1)
+    except KeyboardInterrupt:
+      emulator.stop()